@@ -0,0 +1,161 @@
+"""
+Admission control for generation requests
+Bounds in-flight and queued generations so load spikes are rejected fast with a
+Retry-After hint instead of piling up behind the model until the platform times out
+"""
+import asyncio
+import logging
+import math
+import os
+from collections import deque
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables (0 in-flight = one per model instance)
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "0"))
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "16"))
+ADMISSION_MAX_QUEUE_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_QUEUE_WAIT_SECONDS", "30"))
+# Service time assumed before any generation has finished
+DEFAULT_SERVICE_TIME_SECONDS = 5.0
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; carries a Retry-After estimate"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """A granted generation slot; release() is idempotent"""
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._controller._release()
+
+
+class AdmissionController:
+    """
+    Bounded admission queue in front of generation
+
+    At most max_in_flight requests generate at once and at most max_queued wait for
+    a slot (FIFO). A request is rejected when the queue is full or when it waited
+    longer than max_queue_wait. Retry-After is derived from the observed service
+    time and the number of requests ahead.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        max_queued: int,
+        max_queue_wait: float,
+        service_time: Optional[Callable[[], Optional[float]]] = None
+    ):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queued = max(0, max_queued)
+        self.max_queue_wait = max_queue_wait
+        self._service_time = service_time
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._waiters: deque = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def resize(self, max_in_flight: int):
+        """Change the number of generation slots (e.g. when model workers report their capacity)"""
+        max_in_flight = max(1, max_in_flight)
+        if max_in_flight == self.max_in_flight:
+            return
+        logger.info(f"Admission slots: {self.max_in_flight} -> {max_in_flight}")
+        self.max_in_flight = max_in_flight
+        # New slots go to waiting requests; extra ones in use are given back on release
+        while self.in_flight < self.max_in_flight and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def retry_after(self) -> int:
+        """Seconds until a new request would likely be admitted"""
+        service_time = self._service_time() if self._service_time else None
+        if not service_time:
+            service_time = DEFAULT_SERVICE_TIME_SECONDS
+        ahead = self.queued + 1
+        return max(1, math.ceil(ahead * service_time / self.max_in_flight))
+
+    async def acquire(self) -> AdmissionTicket:
+        """
+        Wait for a generation slot
+
+        Returns:
+            AdmissionTicket that must be released when generation finishes
+
+        Raises:
+            AdmissionRejected: If the queue is full or the wait exceeded max_queue_wait
+        """
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return AdmissionTicket(self)
+
+        if len(self._waiters) >= self.max_queued:
+            self.rejected += 1
+            raise AdmissionRejected("Server is busy, generation queue is full", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout=self.max_queue_wait)
+        except asyncio.TimeoutError:
+            self._discard(waiter)
+            self.timed_out += 1
+            raise AdmissionRejected("Server is busy, timed out waiting for a generation slot", self.retry_after())
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the caller went away
+                self._release()
+            else:
+                self._discard(waiter)
+            raise
+
+        # The releasing request handed its slot over; in_flight is unchanged
+        self.admitted += 1
+        return AdmissionTicket(self)
+
+    def _release(self):
+        while self._waiters and self.in_flight <= self.max_in_flight:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def _discard(self, waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def stats(self) -> dict:
+        """Queue depth and admission counters (used for autoscaling)"""
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_in_flight": self.max_in_flight,
+            "max_queued": self.max_queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "retry_after": self.retry_after(),
+        }
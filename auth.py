@@ -1,7 +1,7 @@
 """
 Authentication routes for sign up and sign in
 """
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel, EmailStr, field_validator, model_validator
 from typing import Optional
@@ -10,8 +10,12 @@ from jose import JWTError, jwt
 import bcrypt
 from database import get_database
 from bson import ObjectId
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import logging
 import os
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -21,12 +25,28 @@ router = APIRouter(prefix="/auth", tags=["authentication"])
 # Password hashing
 # Password hashing using direct bcrypt
 # pwd_context removed as it's incompatible with bcrypt 5.0.0+
+# bcrypt releases the GIL, so hashing runs on a bounded thread pool off the event loop
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_MAX_WORKERS = int(os.getenv("PASSWORD_HASH_MAX_WORKERS", str(min(4, os.cpu_count() or 1))))
+_password_executor = ThreadPoolExecutor(
+    max_workers=max(1, PASSWORD_HASH_MAX_WORKERS),
+    thread_name_prefix="password-hash"
+)
 
 # JWT settings
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-this-in-production")  # Change this in production!
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 
+# Authenticated user lookups are cached briefly to avoid a DB round trip per request
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "4096"))
+# Trust the signed token's name/uid claims instead of loading the user at all
+AUTH_STATELESS = os.getenv("AUTH_STATELESS", "false").lower() == "true"
+
+# email -> (expires_at, user without password)
+_user_cache: "OrderedDict[str, tuple]" = OrderedDict()
+
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/signin")
 
@@ -74,7 +94,8 @@ class UserResponse(BaseModel):
     id: str
     name: str
     email: str
-    created_at: datetime
+    # None in AUTH_STATELESS mode: the token does not carry it
+    created_at: Optional[datetime] = None
 
 
 # Helper functions
@@ -87,12 +108,32 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(plain_password, hashed_password)
 
 
-def get_password_hash(password: str) -> str:
-    """Hash a password"""
+def get_password_hash(password: str, rounds: Optional[int] = None) -> str:
+    """Hash a password with BCRYPT_ROUNDS (or the given cost factor)"""
     if isinstance(password, str):
         password = password.encode('utf-8')
-    # Use default rounds (usually 12)
-    return bcrypt.hashpw(password, bcrypt.gensalt()).decode('utf-8')
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds or BCRYPT_ROUNDS)).decode('utf-8')
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """Check whether a stored hash uses a different cost factor than BCRYPT_ROUNDS"""
+    try:
+        # Format: $2b$<cost>$<salt+hash>
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password on the password-hash thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_executor, verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash on the password-hash thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_executor, get_password_hash, password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -129,6 +170,44 @@ async def get_user_by_email(email: str):
         return None
 
 
+def get_cached_user(email: str) -> Optional[dict]:
+    """Return a copy of the cached user for an email, or None if absent or expired"""
+    key = email.lower()
+    entry = _user_cache.get(key)
+    if entry is None:
+        return None
+    expires_at, user = entry
+    if time.monotonic() >= expires_at:
+        del _user_cache[key]
+        return None
+    _user_cache.move_to_end(key)
+    return dict(user)
+
+
+def cache_user(user: dict):
+    """Cache an authenticated user (password removed) for USER_CACHE_TTL_SECONDS"""
+    if USER_CACHE_TTL_SECONDS <= 0 or USER_CACHE_MAX_ENTRIES <= 0:
+        return
+    cached = {k: v for k, v in user.items() if k != "password"}
+    _user_cache[user["email"].lower()] = (time.monotonic() + USER_CACHE_TTL_SECONDS, cached)
+    _user_cache.move_to_end(user["email"].lower())
+    while len(_user_cache) > USER_CACHE_MAX_ENTRIES:
+        _user_cache.popitem(last=False)
+
+
+def invalidate_user_cache(email: Optional[str] = None):
+    """
+    Drop cached user data; call whenever a user document changes
+    
+    Args:
+        email: User to invalidate, or None to clear the whole cache
+    """
+    if email is None:
+        _user_cache.clear()
+    else:
+        _user_cache.pop(email.lower(), None)
+
+
 async def create_user(user_data: dict):
     """Create a new user in database"""
     db = get_database()
@@ -147,7 +226,7 @@ async def create_user(user_data: dict):
         )
     
     # Hash password
-    user_data["password"] = get_password_hash(user_data["password"])
+    user_data["password"] = await get_password_hash_async(user_data["password"])
     user_data["email"] = user_data["email"].lower()
     user_data["created_at"] = datetime.utcnow()
     
@@ -155,6 +234,7 @@ async def create_user(user_data: dict):
     user_data.pop("confirm_password", None)
     
     result = await db.users.insert_one(user_data)
+    invalidate_user_cache(user_data["email"])
     user_data["id"] = str(result.inserted_id)
     user_data.pop("_id", None)
     user_data.pop("password", None)  # Don't return password
@@ -162,6 +242,20 @@ async def create_user(user_data: dict):
     return user_data
 
 
+async def rehash_password(email: str, password: str):
+    """Re-hash a password with the configured cost factor after a successful login"""
+    db = get_database()
+    if db is None:
+        return
+    try:
+        new_hash = await get_password_hash_async(password)
+        await db.users.update_one({"email": email.lower()}, {"$set": {"password": new_hash}})
+        invalidate_user_cache(email)
+        logger.info(f"Re-hashed password for {email} with {BCRYPT_ROUNDS} rounds")
+    except Exception as e:
+        logger.error(f"Error re-hashing password: {e}")
+
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     """Get current authenticated user from JWT token"""
     credentials_exception = HTTPException(
@@ -177,11 +271,20 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise credentials_exception
     
+    # Stateless mode: the signed claims carry everything handlers use
+    if AUTH_STATELESS and payload.get("uid") and payload.get("name"):
+        return {"id": payload["uid"], "name": payload["name"], "email": email.lower()}
+    
+    user = get_cached_user(email)
+    if user is not None:
+        return user
+    
     user = await get_user_by_email(email)
     if user is None:
         raise credentials_exception
     
     user.pop("password", None)  # Don't return password
+    cache_user(user)
     return user
 
 
@@ -220,7 +323,7 @@ async def signup(request: SignUpRequest):
 
 
 @router.post("/signin", response_model=TokenResponse)
-async def signin(request: SignInRequest):
+async def signin(request: SignInRequest, background_tasks: BackgroundTasks):
     """
     User sign in endpoint
     
@@ -244,7 +347,7 @@ async def signin(request: SignInRequest):
         logger.info(f"User found: {user.get('email')}, verifying password...")
         
         # Verify password
-        password_valid = verify_password(request.password, user["password"])
+        password_valid = await verify_password_async(request.password, user["password"])
         if not password_valid:
             logger.warning(f"Signin failed: Invalid password for email: {request.email}")
             raise HTTPException(
@@ -254,10 +357,18 @@ async def signin(request: SignInRequest):
         
         logger.info(f"Password verified successfully for: {request.email}")
         
+        # Transparently upgrade hashes made with a different cost factor
+        if password_needs_rehash(user["password"]):
+            background_tasks.add_task(rehash_password, user["email"], request.password)
+        
+        # Fresh copy of the user document; later authenticated requests reuse it
+        cache_user(user)
+        
         # Create access token
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        # name/uid claims let AUTH_STATELESS deployments skip the user lookup entirely
         access_token = create_access_token(
-            data={"sub": user["email"]},
+            data={"sub": user["email"], "name": user["name"], "uid": user["id"]},
             expires_delta=access_token_expires
         )
         
@@ -292,5 +403,5 @@ async def get_current_user_info(current_user: dict = Depends(get_current_user)):
         id=current_user["id"],
         name=current_user["name"],
         email=current_user["email"],
-        created_at=current_user.get("created_at", datetime.utcnow())
+        created_at=current_user.get("created_at")
     )
@@ -0,0 +1,63 @@
+"""
+Benchmark signin password verification: inline bcrypt vs the bounded thread pool
+
+Simulates a burst of concurrent logins while a heartbeat task measures how long the
+event loop is stalled (what a concurrent chat stream would feel).
+
+Usage:
+    python benchmark_auth.py [--logins 16] [--rounds 12]
+"""
+import argparse
+import asyncio
+import time
+
+import auth
+
+
+async def heartbeat(stop: asyncio.Event, lags: list, interval: float = 0.01):
+    """Record how late each tick fires"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def run(verify, logins: int, hashed: str) -> dict:
+    stop = asyncio.Event()
+    lags = []
+    ticker = asyncio.create_task(heartbeat(stop, lags))
+    await asyncio.sleep(0.05)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(verify("correct horse", hashed) for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await ticker
+    assert all(results)
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "logins_per_s": round(logins / elapsed, 1),
+        "max_loop_lag_ms": round(max(lags) * 1000, 1) if lags else None,
+    }
+
+
+async def inline_verify(password: str, hashed: str) -> bool:
+    """Previous behaviour: bcrypt runs directly on the event loop"""
+    return auth.verify_password(password, hashed)
+
+
+async def main(logins: int, rounds: int):
+    hashed = auth.get_password_hash("correct horse", rounds=rounds)
+    print(f"{logins} concurrent logins, bcrypt cost {rounds}, "
+          f"{auth.PASSWORD_HASH_MAX_WORKERS} hash worker(s)")
+    print("inline (before):     ", await run(inline_verify, logins, hashed))
+    print("thread pool (after): ", await run(auth.verify_password_async, logins, hashed))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--logins", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=auth.BCRYPT_ROUNDS)
+    args = parser.parse_args()
+    asyncio.run(main(args.logins, args.rounds))
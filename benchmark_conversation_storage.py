@@ -0,0 +1,76 @@
+"""
+Benchmark the conversation storage layouts under concurrent load
+
+Each simulated user runs chat turns of "read history, store message" against a
+scratch database, once per layout, with the in-process history cache and write
+buffer disabled so every operation hits MongoDB.
+
+Usage:
+    MONGODB_URL=mongodb://localhost:27017 python benchmark_conversation_storage.py [--users 50] [--turns 20]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import conversation_memory
+import database
+from conversation_memory import get_conversation_history, setup_conversation_indexes, store_message
+
+BENCHMARK_DATABASE = "tourplanner_benchmark"
+
+
+async def user_session(user: str, turns: int, latencies: list):
+    for turn in range(turns):
+        start = time.perf_counter()
+        await get_conversation_history(user)
+        await store_message(user, "user", f"message {turn} " + "x" * 200)
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_layout(layout: str, users: int, turns: int) -> dict:
+    conversation_memory.CONVERSATION_STORAGE_LAYOUT = layout
+    db = database.get_database()
+    await db.conversation_history.drop()
+    await db.conversation_sessions.drop()
+    await setup_conversation_indexes()
+
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(user_session(f"user{i}@example.com", turns, latencies) for i in range(users)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "turns_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+        "documents": await db.conversation_history.count_documents({})
+        + await db.conversation_sessions.count_documents({}),
+    }
+
+
+async def main(users: int, turns: int):
+    if not await database.connect_to_mongo():
+        raise SystemExit("Could not connect to MongoDB")
+    database.database = database.client[BENCHMARK_DATABASE]
+    conversation_memory.history_cache.max_users = 0
+    try:
+        print(f"{users} users x {turns} turns")
+        for layout in ("messages", "session"):
+            print(f"{layout:>9}:", await run_layout(layout, users, turns))
+    finally:
+        await database.client.drop_database(BENCHMARK_DATABASE)
+        await database.close_mongo_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark conversation storage layouts")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.turns))
@@ -0,0 +1,92 @@
+"""
+Concurrent pre-generation enrichment for chat requests
+Conversation history and Google Maps journey lookups are independent, so they run
+concurrently with per-stage deadlines; pre-generation latency is bounded by the
+slowest single stage instead of the sum of all of them.
+"""
+import asyncio
+import logging
+import os
+from typing import Awaitable, List, Optional, Tuple, TypeVar
+
+from conversation_memory import get_conversation_history
+from directions_cache import resolve_journey_cached
+from google_maps_service import JourneyResolution, extract_locations_from_text
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Per-stage deadlines; a stage that misses its deadline is skipped, not fatal
+HISTORY_TIMEOUT_SECONDS = float(os.getenv("HISTORY_TIMEOUT_SECONDS", "2"))
+DIRECTIONS_TIMEOUT_SECONDS = float(os.getenv("DIRECTIONS_TIMEOUT_SECONDS", "5"))
+
+
+class ChatEnrichment:
+    """Context gathered for a chat request before generation"""
+    
+    def __init__(self, history: List[dict], journeys: List[JourneyResolution]):
+        self.history = history
+        self.journeys = journeys
+    
+    @property
+    def journey(self) -> Optional[JourneyResolution]:
+        """The most recent detected journey (drives map_image_url/journey_details)"""
+        return self.journeys[-1] if self.journeys else None
+
+
+async def run_stage(stage: str, awaitable: Awaitable[T], timeout: float, default: T) -> T:
+    """
+    Await one enrichment stage with a deadline
+    
+    Args:
+        stage: Stage name for logging
+        awaitable: Stage coroutine
+        timeout: Deadline in seconds
+        default: Value used when the stage times out or fails
+    
+    Returns:
+        Stage result, or default
+    """
+    try:
+        return await asyncio.wait_for(awaitable, timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Enrichment stage '{stage}' exceeded its {timeout}s deadline, skipping")
+    except Exception as e:
+        logger.error(f"Enrichment stage '{stage}' failed: {e}")
+    return default
+
+
+def detect_journeys(user_messages: List[str]) -> List[Tuple[str, str]]:
+    """Origin/destination pairs mentioned in the user's messages, in order"""
+    journeys = []
+    for content in user_messages:
+        origin, destination = extract_locations_from_text(content)
+        if origin and destination:
+            logger.info(f"Detected journey request: {origin} to {destination}")
+            journeys.append((origin, destination))
+    return journeys
+
+
+async def gather_enrichment(user_email: str, user_messages: List[str]) -> ChatEnrichment:
+    """
+    Fetch conversation history and resolve detected journeys concurrently
+    
+    Args:
+        user_email: Conversation owner
+        user_messages: Contents of the user messages in the request
+    
+    Returns:
+        ChatEnrichment with history (oldest first) and resolved journeys
+    """
+    stages = [run_stage("history", get_conversation_history(user_email), HISTORY_TIMEOUT_SECONDS, [])]
+    for origin, destination in detect_journeys(user_messages):
+        stages.append(run_stage(
+            "directions",
+            resolve_journey_cached(origin, destination),
+            DIRECTIONS_TIMEOUT_SECONDS,
+            JourneyResolution(origin, destination, None)
+        ))
+    
+    history, *journeys = await asyncio.gather(*stages)
+    return ChatEnrichment(history, journeys)
@@ -0,0 +1,257 @@
+"""
+Content-addressed cache for /v1/completions
+Batch jobs resend identical prompts. With deterministic sampling (temperature 0 or
+top_k 1) the model returns the same text for the same prompt and parameters, so
+completions are stored under a hash of the prompt, every sampling parameter and
+the model identity. Entries live in an in-memory LRU and, optionally, in SQLite so
+they survive restarts and are shared by the worker processes of one machine.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables
+COMPLETION_CACHE_ENABLED = os.getenv("COMPLETION_CACHE_ENABLED", "true").lower() == "true"
+# false: also cache sampled requests when prompt and parameters repeat exactly
+COMPLETION_CACHE_DETERMINISTIC_ONLY = os.getenv("COMPLETION_CACHE_DETERMINISTIC_ONLY", "true").lower() == "true"
+COMPLETION_CACHE_MAX_ENTRIES = int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES", "1024"))
+COMPLETION_CACHE_MAX_MB = float(os.getenv("COMPLETION_CACHE_MAX_MB", "64"))
+# SQLite file for the on-disk tier ("" disables it)
+COMPLETION_CACHE_SQLITE_PATH = os.getenv("COMPLETION_CACHE_SQLITE_PATH", "")
+COMPLETION_CACHE_SQLITE_MAX_ENTRIES = int(os.getenv("COMPLETION_CACHE_SQLITE_MAX_ENTRIES", "100000"))
+
+# Disk eviction runs once every this many writes
+_DISK_TRIM_INTERVAL = 100
+
+
+def is_deterministic(sampling: dict) -> bool:
+    """Whether greedy decoding makes the output a pure function of prompt and parameters"""
+    temperature = sampling.get("temperature")
+    return (temperature is not None and temperature <= 0) or sampling.get("top_k") == 1
+
+
+def make_completion_key(prompt: str, sampling: dict, model_identity: str) -> str:
+    """
+    Content address of a completion request
+
+    Args:
+        prompt: Raw completion prompt
+        sampling: max_tokens, temperature, top_p, top_k, repeat_penalty, stop
+        model_identity: Identifies the model file and backend
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    payload = json.dumps([
+        model_identity,
+        prompt,
+        sampling.get("max_tokens"),
+        sampling.get("temperature"),
+        sampling.get("top_p"),
+        sampling.get("top_k"),
+        sampling.get("repeat_penalty"),
+        sampling.get("stop") or None,
+    ], separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _entry_size(entry: dict) -> int:
+    return len(entry["text"].encode("utf-8")) + 64
+
+
+class CompletionCache:
+    """
+    Two-tier (memory LRU, optional SQLite) cache of completion results
+
+    Args:
+        max_entries: Memory tier entry bound
+        max_bytes: Memory tier size bound (completion text)
+        sqlite_path: Database file for the disk tier, None to disable it
+        sqlite_max_entries: Disk tier entry bound (least recently used rows are deleted)
+        deterministic_only: Only cache requests with deterministic sampling
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        max_bytes: int,
+        sqlite_path: Optional[str] = None,
+        sqlite_max_entries: int = 100000,
+        deterministic_only: bool = True
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sqlite_path = sqlite_path or None
+        self.sqlite_max_entries = sqlite_max_entries
+        self.deterministic_only = deterministic_only
+        # Model that serves the completions (model_loader.model_identity), set by main
+        # once the model is loaded or the model workers reported it; no caching until then
+        self.model_identity: Optional[str] = None
+        self.current_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._disk_writes = 0
+        # Rows in the disk tier, counted when it is opened and kept up to date by this
+        # process's puts and trims (rows written by other workers show up on restart)
+        self._disk_entries: Optional[int] = None
+
+    def key_for(self, prompt: str, sampling: dict) -> Optional[str]:
+        """Cache key for a request, None if its output is not reproducible (or caching is off)"""
+        if (self.max_entries <= 0 and not self.sqlite_path) or self.model_identity is None:
+            return None
+        if self.deterministic_only and not is_deterministic(sampling):
+            with self._lock:
+                self.skipped += 1
+            return None
+        return make_completion_key(prompt, sampling, self.model_identity)
+
+    async def get(self, key: str) -> Optional[dict]:
+        """Cached {text, completion_tokens, prompt_tokens}, memory first, then disk"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return entry
+
+        if self.sqlite_path:
+            entry = await asyncio.to_thread(self._disk_get, key)
+            if entry is not None:
+                self._memory_put(key, entry)
+                with self._lock:
+                    self.disk_hits += 1
+                return entry
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    async def put(self, key: str, text: str, completion_tokens: int, prompt_tokens: int):
+        """Store a finished completion in both tiers"""
+        entry = {"text": text, "completion_tokens": completion_tokens, "prompt_tokens": prompt_tokens}
+        self._memory_put(key, entry)
+        if self.sqlite_path:
+            await asyncio.to_thread(self._disk_put, key, entry)
+
+    def _memory_put(self, key: str, entry: dict):
+        size = _entry_size(entry)
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= _entry_size(previous)
+            self._entries[key] = entry
+            self.current_bytes += size
+            while len(self._entries) > self.max_entries or self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= _entry_size(evicted)
+                self.evictions += 1
+
+    def _connection(self) -> sqlite3.Connection:
+        """Open the disk tier (caller holds _db_lock)"""
+        if self._db is None:
+            self._db = sqlite3.connect(self.sqlite_path, check_same_thread=False, timeout=5)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, text TEXT NOT NULL, completion_tokens INTEGER, "
+                "prompt_tokens INTEGER, created_at REAL, last_used REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used)")
+            self._disk_entries = self._db.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        return self._db
+
+    def _disk_get(self, key: str) -> Optional[dict]:
+        try:
+            with self._db_lock:
+                db = self._connection()
+                row = db.execute(
+                    "SELECT text, completion_tokens, prompt_tokens FROM completions WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                db.execute("UPDATE completions SET last_used = ? WHERE key = ?", (time.time(), key))
+                db.commit()
+            return {"text": row[0], "completion_tokens": row[1], "prompt_tokens": row[2]}
+        except sqlite3.Error as e:
+            logger.error(f"Error reading completion cache: {e}")
+            return None
+
+    def _disk_put(self, key: str, entry: dict):
+        now = time.time()
+        try:
+            with self._db_lock:
+                db = self._connection()
+                row = (key, entry["text"], entry["completion_tokens"], entry["prompt_tokens"], now, now)
+                inserted = db.execute("INSERT OR IGNORE INTO completions VALUES (?, ?, ?, ?, ?, ?)", row).rowcount
+                if not inserted:
+                    db.execute(
+                        "UPDATE completions SET text = ?, completion_tokens = ?, prompt_tokens = ?, "
+                        "created_at = ?, last_used = ? WHERE key = ?",
+                        row[1:] + (key,)
+                    )
+                self._disk_writes += 1
+                trimmed = 0
+                if self._disk_writes % _DISK_TRIM_INTERVAL == 0:
+                    # Keep the newest sqlite_max_entries rows by last use
+                    trimmed = db.execute(
+                        "DELETE FROM completions WHERE key IN (SELECT key FROM completions "
+                        "ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                        (self.sqlite_max_entries,)
+                    ).rowcount
+                db.commit()
+                self._disk_entries = max(0, self._disk_entries + inserted - trimmed)
+        except sqlite3.Error as e:
+            logger.error(f"Error writing completion cache: {e}")
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+                self._disk_entries = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            stats = {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "skipped_nondeterministic": self.skipped,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+        # Maintained counter: /metrics must not query SQLite (or wait on _db_lock) on the event loop
+        stats["disk_entries"] = self._disk_entries
+        return stats
+
+
+completion_cache = CompletionCache(
+    max_entries=COMPLETION_CACHE_MAX_ENTRIES if COMPLETION_CACHE_ENABLED else 0,
+    max_bytes=int(COMPLETION_CACHE_MAX_MB * 1024 * 1024),
+    sqlite_path=COMPLETION_CACHE_SQLITE_PATH if COMPLETION_CACHE_ENABLED else None,
+    sqlite_max_entries=COMPLETION_CACHE_SQLITE_MAX_ENTRIES,
+    deterministic_only=COMPLETION_CACHE_DETERMINISTIC_ONLY
+)
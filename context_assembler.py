@@ -0,0 +1,164 @@
+"""
+Token-budget-aware prompt assembly for chat requests
+History is packed newest-first into whatever room N_CTX leaves after the system
+prompt, journey data, the current messages and the completion budget, so prompts
+never overflow the context window and short chats keep all the history they can.
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from prompt_builder import ASSISTANT_HEADER, format_chat_message
+
+logger = logging.getLogger(__name__)
+
+# Tokens held back for template/BOS differences between counting and generation
+CONTEXT_SAFETY_MARGIN = 16
+
+
+def model_tokenizer(model, use_ctransformers: bool) -> Callable[[str], List[int]]:
+    """
+    Tokenize function for formatted prompt segments (special tokens parsed, no BOS)
+    
+    Tokenizing only reads the vocabulary, so it is safe to call while the same model
+    generates on its inference thread.
+    """
+    if use_ctransformers:
+        return lambda text: model.tokenize(text, add_bos_token=False)
+    return lambda text: model.tokenize(text.encode("utf-8"), add_bos=False, special=True)
+
+
+def model_bos_ids(model, use_ctransformers: bool) -> List[int]:
+    """Token ids (BOS or nothing) the backend prepends when it tokenizes a prompt"""
+    try:
+        if use_ctransformers:
+            return list(model.tokenize(""))
+        return list(model.tokenize(b"", add_bos=True, special=True))
+    except Exception as e:
+        logger.warning(f"Could not determine BOS handling, assuming no BOS token: {e}")
+        return []
+
+
+class TokenCounter:
+    """
+    LRU cache of segment tokens keyed by a hash of the text
+    
+    Args:
+        tokenize: Tokenizer for prompt segments (see model_tokenizer)
+        max_entries: Number of cached segments
+        bos_ids: Token ids the backend prepends to every prompt
+    """
+    
+    def __init__(self, tokenize: Callable[[str], List[int]], max_entries: int = 8192, bos_ids: Sequence[int] = ()):
+        self._tokenize = tokenize
+        self.max_entries = max_entries
+        self.bos_ids = tuple(bos_ids)
+        self.hits = 0
+        self.misses = 0
+        self._tokens: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @property
+    def bos_tokens(self) -> int:
+        return len(self.bos_ids)
+    
+    def tokens(self, text: str) -> tuple:
+        """Tokens of one prompt segment (no BOS), tokenized at most once while cached"""
+        key = hashlib.sha1(text.encode("utf-8")).digest()
+        with self._lock:
+            if key in self._tokens:
+                self._tokens.move_to_end(key)
+                self.hits += 1
+                return self._tokens[key]
+        tokens = tuple(self._tokenize(text))
+        with self._lock:
+            self.misses += 1
+            self._tokens[key] = tokens
+            while len(self._tokens) > self.max_entries:
+                self._tokens.popitem(last=False)
+        return tokens
+    
+    def count(self, text: str) -> int:
+        return len(self.tokens(text))
+    
+    def count_prompt(self, segments: List[str]) -> int:
+        """
+        Tokens in a prompt made of segments that start and end on token boundaries
+        
+        Chat template turns are delimited by special tokens, so the prompt's count is
+        the sum of its cached segment counts plus the backend's BOS token.
+        """
+        return self.bos_tokens + sum(self.count(segment) for segment in segments)
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"entries": len(self._tokens), "hits": self.hits, "misses": self.misses}
+
+
+class ContextAssembler:
+    """
+    Chooses how much conversation history fits in the context window
+    
+    Args:
+        counter: TokenCounter using the loaded model's tokenizer
+        n_ctx: Model context length
+    """
+    
+    def __init__(self, counter: TokenCounter, n_ctx: int):
+        self.counter = counter
+        self.n_ctx = n_ctx
+        self.trimmed_requests = 0
+        self.trimmed_messages = 0
+    
+    def count_messages(self, messages: List[Tuple[str, str]]) -> int:
+        """Tokens taken by (role, content) turns rendered with the chat template"""
+        return sum(self.counter.count(format_chat_message(role, content)) for role, content in messages)
+    
+    def select_history(
+        self,
+        history: List[Dict],
+        fixed_messages: List[Tuple[str, str]],
+        max_tokens: int
+    ) -> List[Dict]:
+        """
+        Keep the newest contiguous history that fits the token budget
+        
+        Args:
+            history: Stored messages with 'role' and 'content', oldest first
+            fixed_messages: (role, content) turns always included in the prompt
+                (system prompt, journey data, current request messages)
+            max_tokens: Completion budget reserved for the response
+        
+        Returns:
+            Suffix of history that fits, oldest first
+        """
+        # Assistant header that opens the response
+        overhead = self.counter.count(ASSISTANT_HEADER)
+        budget = (
+            self.n_ctx - max_tokens - CONTEXT_SAFETY_MARGIN - overhead
+            - self.count_messages(fixed_messages)
+        )
+        
+        kept = 0
+        for message in reversed(history):
+            cost = self.counter.count(format_chat_message(message["role"], message["content"]))
+            if cost > budget:
+                break
+            budget -= cost
+            kept += 1
+        
+        if kept < len(history):
+            self.trimmed_requests += 1
+            self.trimmed_messages += len(history) - kept
+            logger.info(f"Dropped {len(history) - kept} oldest history message(s) to fit N_CTX={self.n_ctx}")
+        return history[len(history) - kept:]
+    
+    def stats(self) -> Dict:
+        return {
+            "n_ctx": self.n_ctx,
+            "trimmed_requests": self.trimmed_requests,
+            "trimmed_messages": self.trimmed_messages,
+            "token_counts": self.counter.stats(),
+        }
@@ -1,18 +1,422 @@
 """
 Conversation memory management for short-term chat history
 Stores user conversations in MongoDB with 30-minute TTL auto-expiration
+
+Two storage layouts are supported (CONVERSATION_STORAGE_LAYOUT):
+- "messages": one conversation_history document per message, TTL on created_at
+- "session": one conversation_sessions document per user holding the last
+  CONVERSATION_HISTORY_LIMIT messages, TTL on last_activity
 """
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+from bson import ObjectId
 from database import get_database
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+import asyncio
 import logging
 import os
+import time
 
 logger = logging.getLogger(__name__)
 
 # Configuration from environment variables
 CONVERSATION_TTL_MINUTES = int(os.getenv("CONVERSATION_TTL_MINUTES", "30"))
 CONVERSATION_HISTORY_LIMIT = int(os.getenv("CONVERSATION_HISTORY_LIMIT", "10"))
+# "messages" (one document per message) or "session" (one bounded document per user)
+CONVERSATION_STORAGE_LAYOUT = os.getenv("CONVERSATION_STORAGE_LAYOUT", "messages").lower()
+# Write-behind buffer for conversation messages
+HISTORY_WRITE_BATCH_SIZE = int(os.getenv("HISTORY_WRITE_BATCH_SIZE", "100"))
+HISTORY_WRITE_FLUSH_INTERVAL_MS = int(os.getenv("HISTORY_WRITE_FLUSH_INTERVAL_MS", "200"))
+HISTORY_WRITE_BUFFER_MAX = int(os.getenv("HISTORY_WRITE_BUFFER_MAX", "5000"))
+HISTORY_WRITE_MAX_ATTEMPTS = int(os.getenv("HISTORY_WRITE_MAX_ATTEMPTS", "3"))
+# In-process hot cache of recent history per user
+HISTORY_CACHE_ENABLED = os.getenv("HISTORY_CACHE_ENABLED", "true").lower() == "true"
+HISTORY_CACHE_MAX_USERS = int(os.getenv("HISTORY_CACHE_MAX_USERS", "10000"))
+# How long a user's cached history is trusted before it is re-read from MongoDB
+HISTORY_CACHE_TTL_SECONDS = float(os.getenv("HISTORY_CACHE_TTL_SECONDS", "60"))
+
+# MongoDB error code for a duplicate key
+DUPLICATE_KEY_ERROR = 11000
+
+
+class ConversationWriteBuffer:
+    """
+    Write-behind buffer that batches message inserts across requests
+    
+    Messages are flushed with insert_many(ordered=False) (one unordered bulk upsert
+    per user in the session layout) when batch_size messages are pending or every
+    flush_interval seconds. When max_pending messages are
+    waiting, the caller flushes inline. If that cannot shrink the queue (MongoDB is
+    down or failing), the oldest messages are dropped and counted as failed, so the
+    buffer never holds more than max_pending messages. Unflushed messages are
+    visible to get_conversation_history through pending_for().
+    
+    Messages of a failed write go back to the head of the queue and are retried on
+    the next flush, up to max_attempts writes each. stop() lets the flush loop
+    finish its current batch and drains the queue before returning.
+    """
+    
+    def __init__(self, batch_size: int, flush_interval: float, max_pending: int, max_attempts: int = 3):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_pending = max(self.batch_size, max_pending)
+        self.max_attempts = max(1, max_attempts)
+        self.written = 0
+        self.failed = 0
+        self.retried = 0
+        self.flushes = 0
+        self._pending: deque = deque()
+        self._in_flight: List[Dict] = []
+        # Failed write attempts per queued document (keyed by id())
+        self._attempts: Dict[int, int] = {}
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+    
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+    
+    def start(self):
+        """Start the background flush loop (call from the running event loop)"""
+        if not self.running:
+            self._flush_lock = asyncio.Lock()
+            self._wakeup = asyncio.Event()
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+            logger.info(
+                f"Conversation write buffer started (batch {self.batch_size}, "
+                f"every {self.flush_interval * 1000:.0f} ms)"
+            )
+    
+    async def stop(self):
+        """Stop the flush loop and write everything still pending"""
+        # Not cancelled: a batch being written when stop() is called must not be lost
+        self._stopping = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+    
+    async def add(self, message_doc: Dict):
+        """Queue a message document for the next batch"""
+        self._pending.append(message_doc)
+        if len(self._pending) >= self.max_pending:
+            # Buffer is full: the caller pays for the write instead of growing memory
+            await self.flush()
+            self._drop_overflow()
+        elif len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+    
+    def pending_for(self, user_email: str) -> List[Dict]:
+        """Messages for a user that are not yet in MongoDB, oldest first"""
+        return [
+            doc for doc in list(self._in_flight) + list(self._pending)
+            if doc["user_email"] == user_email
+        ]
+    
+    def discard(self, user_email: str) -> int:
+        """Drop a user's unflushed messages (e.g. when their history is cleared)"""
+        kept = [doc for doc in self._pending if doc["user_email"] != user_email]
+        dropped = len(self._pending) - len(kept)
+        self._pending = deque(kept)
+        kept_ids = {id(doc) for doc in kept}
+        self._attempts = {key: n for key, n in self._attempts.items() if key in kept_ids}
+        return dropped
+    
+    async def flush(self):
+        """
+        Write pending messages in batches of batch_size
+        
+        A failed batch is requeued and the flush ends there (the next one retries it),
+        except while stopping, when retries continue until the queue is empty.
+        """
+        async with self._flush_lock:
+            while self._pending:
+                db = get_database()
+                if db is None:
+                    logger.warning("Database not available, cannot flush conversation messages")
+                    return
+                batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+                self._in_flight = batch
+                try:
+                    written, failed_docs = await write_message_batch(db, batch)
+                except BaseException:
+                    # Cancelled mid-write: keep the batch for the next flush
+                    self._pending.extendleft(reversed(batch))
+                    raise
+                finally:
+                    self._in_flight = []
+                self.flushes += 1
+                self.written += written
+                failed_ids = {id(doc) for doc in failed_docs}
+                for doc in batch:
+                    if id(doc) not in failed_ids:
+                        self._attempts.pop(id(doc), None)
+                if failed_docs:
+                    self._requeue(failed_docs)
+                    if not self._stopping:
+                        return
+    
+    def _drop_overflow(self):
+        """Drop the oldest messages beyond max_pending (the database is not keeping up)"""
+        dropped = 0
+        while len(self._pending) > self.max_pending:
+            doc = self._pending.popleft()
+            self._attempts.pop(id(doc), None)
+            dropped += 1
+        if dropped:
+            self.failed += dropped
+            logger.warning(
+                f"Conversation write buffer full ({self.max_pending} messages), "
+                f"dropped the {dropped} oldest"
+            )
+    
+    def _requeue(self, failed_docs: List[Dict]):
+        """Put failed messages back at the head of the queue, dropping exhausted ones"""
+        retry = []
+        for doc in failed_docs:
+            attempts = self._attempts.get(id(doc), 0) + 1
+            if attempts >= self.max_attempts:
+                self._attempts.pop(id(doc), None)
+                self.failed += 1
+            else:
+                self._attempts[id(doc)] = attempts
+                retry.append(doc)
+        if retry:
+            self.retried += len(retry)
+            logger.warning(f"Retrying {len(retry)} conversation messages on the next flush")
+        self._pending.extendleft(reversed(retry))
+    
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+    
+    def stats(self) -> Dict:
+        """Buffer depth and write counters for monitoring"""
+        return {
+            "pending": len(self._pending),
+            "max_pending": self.max_pending,
+            "written": self.written,
+            "failed": self.failed,
+            "retried": self.retried,
+            "flushes": self.flushes,
+        }
+
+
+write_buffer = ConversationWriteBuffer(
+    batch_size=HISTORY_WRITE_BATCH_SIZE,
+    flush_interval=HISTORY_WRITE_FLUSH_INTERVAL_MS / 1000,
+    max_pending=HISTORY_WRITE_BUFFER_MAX,
+    max_attempts=HISTORY_WRITE_MAX_ATTEMPTS
+)
+
+
+class ConversationHotCache:
+    """
+    Per-user ring buffers of the most recent messages, served without a query
+    
+    A user's buffer is filled from MongoDB on the first read and then kept current
+    by store_message (write-through), so follow-up questions need no history query.
+    Messages older than the conversation TTL are dropped on read, mirroring the
+    MongoDB TTL index. Users are evicted LRU beyond max_users; after a restart or
+    eviction the next read falls back to MongoDB.
+    
+    The cache only sees this process's writes and clears. It needs a single worker
+    or sticky sessions; otherwise a buffer is served for at most max_age_seconds
+    after it was read from MongoDB, so other workers' turns and clears show up late.
+    """
+    
+    def __init__(self, capacity: int, ttl_seconds: float, max_users: int, max_age_seconds: float = 60):
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self._entries: "OrderedDict[str, deque]" = OrderedDict()
+        self._loaded_at: Dict[str, float] = {}
+        # Bumped on every write so a read racing a write does not cache a stale snapshot
+        self._versions: Dict[str, int] = {}
+    
+    def get(self, user_email: str, limit: int) -> Optional[List[Dict]]:
+        """Cached history (oldest first), or None if the user is not cached"""
+        messages = self._entries.get(user_email)
+        if messages is None or limit > self.capacity:
+            self.misses += 1
+            return None
+        if time.monotonic() - self._loaded_at.get(user_email, 0) > self.max_age_seconds:
+            # Re-read from MongoDB to pick up writes from other processes
+            self._entries.pop(user_email)
+            self.refreshes += 1
+            self.misses += 1
+            return None
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+        while messages and messages[0]["timestamp"] < cutoff:
+            messages.popleft()
+        self._entries.move_to_end(user_email)
+        self.hits += 1
+        return [dict(message) for message in list(messages)[-limit:]] if limit > 0 else []
+    
+    def version(self, user_email: str) -> int:
+        return self._versions.get(user_email, 0)
+    
+    def load(self, user_email: str, messages: List[Dict], version: int):
+        """Fill a user's buffer from a MongoDB read started at `version`"""
+        if self.max_users <= 0 or self.version(user_email) != version:
+            return
+        self._entries[user_email] = deque(
+            ({"role": m["role"], "content": m["content"], "timestamp": m["timestamp"]} for m in messages),
+            maxlen=self.capacity
+        )
+        self._loaded_at[user_email] = time.monotonic()
+        self._entries.move_to_end(user_email)
+        while len(self._entries) > self.max_users:
+            evicted, _ = self._entries.popitem(last=False)
+            self._versions.pop(evicted, None)
+            self._loaded_at.pop(evicted, None)
+    
+    def append(self, user_email: str, message_doc: Dict):
+        """Write-through: add a stored message to the user's buffer if cached"""
+        self._versions[user_email] = self.version(user_email) + 1
+        messages = self._entries.get(user_email)
+        if messages is not None:
+            messages.append({
+                "role": message_doc["role"],
+                "content": message_doc["content"],
+                "timestamp": message_doc["timestamp"]
+            })
+    
+    def invalidate(self, user_email: str):
+        self._versions[user_email] = self.version(user_email) + 1
+        self._entries.pop(user_email, None)
+        self._loaded_at.pop(user_email, None)
+    
+    def stats(self) -> Dict:
+        """Hit/miss counters for monitoring"""
+        lookups = self.hits + self.misses
+        return {
+            "users": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+history_cache = ConversationHotCache(
+    capacity=CONVERSATION_HISTORY_LIMIT,
+    ttl_seconds=CONVERSATION_TTL_MINUTES * 60,
+    max_users=HISTORY_CACHE_MAX_USERS if HISTORY_CACHE_ENABLED else 0,
+    max_age_seconds=HISTORY_CACHE_TTL_SECONDS
+)
+
+
+def session_update(user_email: str, messages: List[Dict]) -> UpdateOne:
+    """
+    Upsert that appends messages to a user's session document, keeping the newest
+    CONVERSATION_HISTORY_LIMIT of them
+    
+    Idempotent, so a batch that timed out or partially applied can be retried: each
+    message carries its document's _id, and messages whose id is already in the
+    session are skipped (an update pipeline instead of $push, which would append
+    them again).
+    """
+    existing_ids = {"$ifNull": ["$messages.id", []]}
+    new_messages = [
+        {"id": m["_id"], "role": m["role"], "content": m["content"], "timestamp": m["timestamp"]}
+        for m in messages
+    ]
+    return UpdateOne(
+        {"_id": user_email},
+        [{"$set": {
+            "messages": {"$slice": [
+                {"$concatArrays": [
+                    {"$ifNull": ["$messages", []]},
+                    {"$filter": {
+                        # $literal: message content must not be read as a field path or operator
+                        "input": {"$literal": new_messages},
+                        "cond": {"$not": [{"$in": ["$$this.id", existing_ids]}]}
+                    }}
+                ]},
+                -CONVERSATION_HISTORY_LIMIT
+            ]},
+            "last_activity": {"$max": ["$last_activity", max(m["timestamp"] for m in messages)]}
+        }}],
+        upsert=True
+    )
+
+
+def _message_key(message: Dict) -> Tuple:
+    """Identity of a message across the write buffer and MongoDB (which stores milliseconds)"""
+    timestamp = message["timestamp"]
+    return (
+        timestamp.replace(microsecond=timestamp.microsecond // 1000 * 1000),
+        message["role"],
+        message["content"]
+    )
+
+
+async def write_message_batch(db, message_docs: List[Dict]) -> Tuple[int, List[Dict]]:
+    """
+    Write message documents in the configured storage layout
+    
+    Args:
+        db: Database instance
+        message_docs: Documents built by store_message (oldest first)
+    
+    Returns:
+        Tuple of (messages written, documents that failed and may be retried)
+    """
+    for doc in message_docs:
+        # Ids are assigned once, so every retry of a document writes the same message
+        doc.setdefault("_id", ObjectId())
+    
+    if CONVERSATION_STORAGE_LAYOUT == "session":
+        # One upsert per user, however many messages they have in the batch
+        by_user: Dict[str, List[Dict]] = {}
+        for doc in message_docs:
+            by_user.setdefault(doc["user_email"], []).append(doc)
+        groups = list(by_user.values())
+        try:
+            await db.conversation_sessions.bulk_write(
+                [session_update(user, messages) for user, messages in by_user.items()],
+                ordered=False
+            )
+            return len(message_docs), []
+        except BulkWriteError as e:
+            failed = [doc for error in e.details.get("writeErrors", []) for doc in groups[error["index"]]]
+            logger.error(f"Error writing conversation sessions: {len(failed)} messages failed")
+            return len(message_docs) - len(failed), failed
+        except Exception as e:
+            logger.error(f"Error writing conversation sessions: {e}")
+            return 0, list(message_docs)
+    
+    try:
+        result = await db.conversation_history.insert_many(message_docs, ordered=False)
+        return len(result.inserted_ids), []
+    except BulkWriteError as e:
+        # With ordered=False the rest of the batch is still attempted. A duplicate _id
+        # means an earlier attempt of this document already got through.
+        failed = [
+            message_docs[error["index"]] for error in e.details.get("writeErrors", [])
+            if error.get("code") != DUPLICATE_KEY_ERROR
+        ]
+        logger.error(f"Error writing conversation messages: {len(failed)} failed")
+        return len(message_docs) - len(failed), failed
+    except Exception as e:
+        logger.error(f"Error writing conversation messages: {e}")
+        return 0, list(message_docs)
 
 
 async def setup_conversation_indexes():
@@ -26,6 +430,15 @@ async def setup_conversation_indexes():
         return False
     
     try:
+        if CONVERSATION_STORAGE_LAYOUT == "session":
+            # Session documents expire after CONVERSATION_TTL_MINUTES without activity
+            await db.conversation_sessions.create_index(
+                "last_activity",
+                expireAfterSeconds=CONVERSATION_TTL_MINUTES * 60
+            )
+            logger.info(f"Conversation session index created (TTL: {CONVERSATION_TTL_MINUTES} minutes)")
+            return True
+        
         # Create TTL index on created_at field (expires after 30 minutes)
         await db.conversation_history.create_index(
             "created_at",
@@ -52,6 +465,9 @@ async def store_message(user_email: str, role: str, content: str) -> bool:
     """
     Store a conversation message in MongoDB
     
+    When the write buffer is running the message is queued and written in the next
+    batch; otherwise it is inserted immediately.
+    
     Args:
         user_email: User's email address (identifier)
         role: Message role ('user' or 'assistant')
@@ -74,9 +490,17 @@ async def store_message(user_email: str, role: str, content: str) -> bool:
             "created_at": datetime.utcnow()  # TTL index field
         }
         
-        await db.conversation_history.insert_one(message_doc)
-        logger.debug(f"Stored {role} message for {user_email}")
-        return True
+        history_cache.append(message_doc["user_email"], message_doc)
+        
+        if write_buffer.running:
+            await write_buffer.add(message_doc)
+            logger.debug(f"Queued {role} message for {user_email}")
+            return True
+        
+        written, _ = await write_message_batch(db, [message_doc])
+        if written:
+            logger.debug(f"Stored {role} message for {user_email}")
+        return bool(written)
     except Exception as e:
         logger.error(f"Error storing message: {e}")
         return False
@@ -97,22 +521,57 @@ async def get_conversation_history(
         List of message dictionaries with 'role' and 'content' keys
         Sorted chronologically (oldest first)
     """
+    cached = history_cache.get(user_email.lower(), limit)
+    if cached is not None:
+        logger.debug(f"Retrieved {len(cached)} cached messages for {user_email}")
+        return cached
+    
     db = get_database()
     if db is None:
         logger.warning("Database not available, returning empty history")
         return []
     
     try:
-        # Query messages for this user, sorted by timestamp descending
-        cursor = db.conversation_history.find(
-            {"user_email": user_email.lower()},
-            {"role": 1, "content": 1, "timestamp": 1, "_id": 0}
-        ).sort("timestamp", -1).limit(limit)
+        version = history_cache.version(user_email.lower())
+        # Snapshot the write buffer before the read: a batch flushed during the read
+        # is then either in the query result or in this snapshot (or both)
+        pending = write_buffer.pending_for(user_email.lower())
         
-        messages = await cursor.to_list(length=limit)
+        if CONVERSATION_STORAGE_LAYOUT == "session":
+            # Single document read; messages are already oldest first
+            session = await db.conversation_sessions.find_one(
+                {"_id": user_email.lower()},
+                {"messages": {"$slice": -limit}, "_id": 0}
+            )
+            messages = [
+                {"role": m["role"], "content": m["content"], "timestamp": m["timestamp"]}
+                for m in (session["messages"] if session else [])
+            ]
+        else:
+            # Query messages for this user, sorted by timestamp descending
+            cursor = db.conversation_history.find(
+                {"user_email": user_email.lower()},
+                {"role": 1, "content": 1, "timestamp": 1, "_id": 0}
+            ).sort("timestamp", -1).limit(limit)
+            
+            messages = await cursor.to_list(length=limit)
+            
+            # Reverse to get chronological order (oldest first)
+            messages.reverse()
         
-        # Reverse to get chronological order (oldest first)
-        messages.reverse()
+        # Append messages still waiting in the write buffer (always the newest),
+        # skipping those the read already returned
+        pending += write_buffer.pending_for(user_email.lower())
+        seen = {_message_key(m) for m in messages}
+        for doc in pending:
+            key = _message_key(doc)
+            if key not in seen:
+                seen.add(key)
+                messages.append({"role": doc["role"], "content": doc["content"], "timestamp": doc["timestamp"]})
+        messages = messages[-limit:] if limit > 0 else []
+        
+        if limit >= history_cache.capacity:
+            history_cache.load(user_email.lower(), messages, version)
         
         logger.debug(f"Retrieved {len(messages)} messages for {user_email}")
         return messages
@@ -137,6 +596,12 @@ async def clear_conversation_history(user_email: str) -> bool:
         return False
     
     try:
+        write_buffer.discard(user_email.lower())
+        history_cache.invalidate(user_email.lower())
+        if CONVERSATION_STORAGE_LAYOUT == "session":
+            await db.conversation_sessions.delete_one({"_id": user_email.lower()})
+            logger.info(f"Cleared conversation session for {user_email}")
+            return True
         result = await db.conversation_history.delete_many(
             {"user_email": user_email.lower()}
         )
@@ -162,6 +627,14 @@ async def get_conversation_stats(user_email: str) -> Dict:
         return {"message_count": 0, "oldest_message": None}
     
     try:
+        if CONVERSATION_STORAGE_LAYOUT == "session":
+            session = await db.conversation_sessions.find_one({"_id": user_email.lower()})
+            messages = session["messages"] if session else []
+            return {
+                "message_count": len(messages),
+                "oldest_message": messages[0]["timestamp"] if messages else None
+            }
+        
         count = await db.conversation_history.count_documents(
             {"user_email": user_email.lower()}
         )
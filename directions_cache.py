@@ -0,0 +1,238 @@
+"""
+Cache for Google Directions results
+Popular routes are requested over and over; results are kept in a TTL + LRU memory
+cache and, optionally, in a MongoDB collection with a TTL index so every worker
+process shares the hits.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from database import get_database
+from google_maps_service import JourneyResolution, get_directions
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables
+DIRECTIONS_CACHE_TTL_SECONDS = int(os.getenv("DIRECTIONS_CACHE_TTL_SECONDS", "900"))
+DIRECTIONS_CACHE_MAX_ENTRIES = int(os.getenv("DIRECTIONS_CACHE_MAX_ENTRIES", "1024"))
+# Requests departing within the same bucket share traffic estimates
+DIRECTIONS_CACHE_BUCKET_MINUTES = int(os.getenv("DIRECTIONS_CACHE_BUCKET_MINUTES", "15"))
+DIRECTIONS_CACHE_MONGO = os.getenv("DIRECTIONS_CACHE_MONGO", "false").lower() == "true"
+
+
+def normalize_location(location: str) -> str:
+    """Case- and whitespace-folded location used in cache keys"""
+    return " ".join(location.split()).casefold()
+
+
+def make_cache_key(
+    origin: str,
+    destination: str,
+    mode: str = "driving",
+    departure_time: Optional[datetime] = None,
+    bucket_minutes: int = DIRECTIONS_CACHE_BUCKET_MINUTES
+) -> str:
+    """
+    Build the cache key for a directions request
+    
+    Args:
+        origin: Starting location
+        destination: End location
+        mode: Travel mode
+        departure_time: Departure time (defaults to now, like get_directions)
+        bucket_minutes: Width of the departure-time bucket
+    
+    Returns:
+        Key string such as "driving|new york|boston|1934812"
+    """
+    if departure_time is None:
+        departure_time = datetime.now()
+    bucket = int(departure_time.timestamp() // (max(1, bucket_minutes) * 60))
+    return "|".join([mode.lower(), normalize_location(origin), normalize_location(destination), str(bucket)])
+
+
+class DirectionsCache:
+    """
+    In-memory TTL + LRU cache of directions results with hit-rate counters
+    
+    The optional MongoDB tier is consulted on a memory miss; its documents expire
+    through a TTL index on created_at.
+    """
+    
+    def __init__(self, ttl_seconds: float, max_entries: int, use_mongo: bool = False):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.use_mongo = use_mongo
+        self.hits = 0
+        self.mongo_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[List[Dict]]:
+        """Return cached directions from memory, or None on a miss or expired entry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, directions = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return directions
+    
+    def put(self, key: str, directions: List[Dict]):
+        """Store directions in memory, evicting the least recently used entries"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), directions)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def record(self, hit: bool = False, mongo_hit: bool = False):
+        with self._lock:
+            if mongo_hit:
+                self.mongo_hits += 1
+            elif hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+    
+    def stats(self) -> dict:
+        """Hit-rate counters for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.mongo_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "mongo_hits": self.mongo_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.mongo_hits) / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "mongo_enabled": self.use_mongo,
+            }
+
+
+directions_cache = DirectionsCache(
+    ttl_seconds=DIRECTIONS_CACHE_TTL_SECONDS,
+    max_entries=DIRECTIONS_CACHE_MAX_ENTRIES,
+    use_mongo=DIRECTIONS_CACHE_MONGO
+)
+
+
+async def setup_directions_cache_indexes():
+    """
+    Set up the TTL index for the shared MongoDB directions cache
+    """
+    if not directions_cache.use_mongo:
+        return False
+    
+    db = get_database()
+    if db is None:
+        logger.warning("Database not available, skipping directions cache index setup")
+        return False
+    
+    try:
+        await db.directions_cache.create_index(
+            "created_at",
+            expireAfterSeconds=int(directions_cache.ttl_seconds)
+        )
+        logger.info(f"Directions cache index created (TTL: {directions_cache.ttl_seconds} seconds)")
+        return True
+    except Exception as e:
+        logger.error(f"Error setting up directions cache indexes: {e}")
+        return False
+
+
+async def _mongo_get(key: str) -> Optional[List[Dict]]:
+    db = get_database()
+    if db is None:
+        return None
+    try:
+        doc = await db.directions_cache.find_one({"_id": key})
+        return doc["directions"] if doc else None
+    except Exception as e:
+        logger.error(f"Error reading directions cache: {e}")
+        return None
+
+
+async def _mongo_put(key: str, directions: List[Dict]):
+    db = get_database()
+    if db is None:
+        return
+    try:
+        await db.directions_cache.replace_one(
+            {"_id": key},
+            {"_id": key, "directions": directions, "created_at": datetime.utcnow()},
+            upsert=True
+        )
+    except Exception as e:
+        logger.error(f"Error writing directions cache: {e}")
+
+
+async def get_directions_cached(
+    origin: str,
+    destination: str,
+    mode: str = "driving",
+    departure_time: Optional[datetime] = None
+) -> Optional[List[Dict]]:
+    """
+    Get directions through the cache, calling the Directions API only on a miss
+    
+    Args:
+        origin: Starting location
+        destination: End location
+        mode: Travel mode
+        departure_time: Departure time for traffic estimates
+    
+    Returns:
+        List of route dictionaries or None if no route was found
+    """
+    key = make_cache_key(origin, destination, mode, departure_time)
+    
+    directions = directions_cache.get(key)
+    if directions is not None:
+        directions_cache.record(hit=True)
+        return directions
+    
+    if directions_cache.use_mongo:
+        directions = await _mongo_get(key)
+        if directions is not None:
+            directions_cache.record(mongo_hit=True)
+            directions_cache.put(key, directions)
+            return directions
+    
+    directions_cache.record()
+    directions = await get_directions(origin, destination, mode=mode, departure_time=departure_time)
+    if directions:
+        directions_cache.put(key, directions)
+        if directions_cache.use_mongo:
+            await _mongo_put(key, directions)
+    return directions
+
+
+async def resolve_journey_cached(origin: str, destination: str, mode: str = "driving") -> JourneyResolution:
+    """
+    Fetch directions once (through the cache) and wrap them for the summary and map steps
+    
+    Returns:
+        JourneyResolution (check .found for whether a route was returned)
+    """
+    directions = await get_directions_cached(origin, destination, mode=mode)
+    return JourneyResolution(origin, destination, directions)
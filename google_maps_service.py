@@ -1,33 +1,44 @@
 """
 Google Maps API service for journey planning and route information
 """
-import googlemaps
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 import os
 import logging
 from dotenv import load_dotenv
+from maps_client import MapsApiError, MapsClient
 
 # Load environment variables
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-# Initialize Google Maps client
+# Google Maps client (created on first use so it binds to the running event loop)
 GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
-gmaps = None
+maps_client: Optional[MapsClient] = None
 
-if GOOGLE_MAPS_API_KEY:
-    try:
-        gmaps = googlemaps.Client(key=GOOGLE_MAPS_API_KEY)
-        logger.info("Google Maps client initialized successfully")
-    except Exception as e:
-        logger.error(f"Failed to initialize Google Maps client: {e}")
-else:
+if not GOOGLE_MAPS_API_KEY:
     logger.warning("GOOGLE_MAPS_API_KEY not found in environment variables")
 
 
-def get_directions(
+def get_maps_client() -> Optional[MapsClient]:
+    """Return the shared Maps client, or None if no API key is configured"""
+    global maps_client
+    if maps_client is None and GOOGLE_MAPS_API_KEY:
+        maps_client = MapsClient(api_key=GOOGLE_MAPS_API_KEY)
+        logger.info("Google Maps client initialized successfully")
+    return maps_client
+
+
+async def close_maps_client():
+    """Close the shared Maps client's connection pool"""
+    global maps_client
+    if maps_client is not None:
+        await maps_client.aclose()
+        maps_client = None
+
+
+async def get_directions(
     origin: str,
     destination: str,
     mode: str = "driving",
@@ -47,7 +58,8 @@ def get_directions(
     Returns:
         List of route dictionaries or None if error
     """
-    if not gmaps:
+    client = get_maps_client()
+    if not client:
         logger.error("Google Maps client not initialized")
         return None
     
@@ -56,7 +68,7 @@ def get_directions(
         if departure_time is None:
             departure_time = datetime.now()
         
-        directions_result = gmaps.directions(
+        directions_result = await client.directions(
             origin=origin,
             destination=destination,
             mode=mode,
@@ -72,15 +84,15 @@ def get_directions(
             logger.warning(f"No routes found from {origin} to {destination}")
             return None
             
-    except googlemaps.exceptions.ApiError as e:
+    except MapsApiError as e:
         logger.error(f"Google Maps API error: {e}")
         return None
     except Exception as e:
-        logger.error(f"Error getting directions: {e}")
+        logger.error(f"Error getting directions: {e!r}")
         return None
 
 
-def get_distance_matrix(
+async def get_distance_matrix(
     origins: List[str],
     destinations: List[str],
     mode: str = "driving",
@@ -98,7 +110,8 @@ def get_distance_matrix(
     Returns:
         Distance matrix dictionary or None if error
     """
-    if not gmaps:
+    client = get_maps_client()
+    if not client:
         logger.error("Google Maps client not initialized")
         return None
     
@@ -106,7 +119,7 @@ def get_distance_matrix(
         if departure_time is None:
             departure_time = datetime.now()
         
-        matrix_result = gmaps.distance_matrix(
+        matrix_result = await client.distance_matrix(
             origins=origins,
             destinations=destinations,
             mode=mode,
@@ -121,11 +134,11 @@ def get_distance_matrix(
             logger.warning("No distance matrix data returned")
             return None
             
-    except googlemaps.exceptions.ApiError as e:
+    except MapsApiError as e:
         logger.error(f"Google Maps API error: {e}")
         return None
     except Exception as e:
-        logger.error(f"Error getting distance matrix: {e}")
+        logger.error(f"Error getting distance matrix: {e!r}")
         return None
 
 
@@ -215,18 +228,24 @@ def extract_locations_from_text(text: str) -> Tuple[Optional[str], Optional[str]
     return origin, destination
 
 
-def format_journey_summary(origin: str, destination: str) -> Optional[str]:
+async def format_journey_summary(
+    origin: str,
+    destination: str,
+    directions: Optional[List[Dict]] = None
+) -> Optional[str]:
     """
     Get journey information and format it for the LLM
     
     Args:
         origin: Starting location
         destination: End location
+        directions: Directions already fetched for this pair (skips the API call)
     
     Returns:
         Formatted journey summary or None if error
     """
-    directions = get_directions(origin, destination)
+    if directions is None:
+        directions = await get_directions(origin, destination)
     
     if directions:
         return parse_journey_data(directions)
@@ -234,19 +253,48 @@ def format_journey_summary(origin: str, destination: str) -> Optional[str]:
         return None
 
 
-def generate_map_image_url(
+def get_route_center(directions: Optional[List[Dict]]) -> Optional[Tuple[float, float]]:
+    """
+    Center point of the recommended route's bounding box
+    
+    Args:
+        directions: Raw directions result from Google Maps API
+    
+    Returns:
+        Tuple of (lat, lng) or None if the route has no bounds
+    """
+    if not directions:
+        return None
+    bounds = directions[0].get('bounds', {})
+    ne = bounds.get('northeast', {})
+    sw = bounds.get('southwest', {})
+    if not ne or not sw:
+        return None
+    return (ne.get('lat', 0) + sw.get('lat', 0)) / 2, (ne.get('lng', 0) + sw.get('lng', 0)) / 2
+
+
+def get_route_polyline(directions: Optional[List[Dict]]) -> Optional[str]:
+    """Encoded overview polyline of the recommended route, if any"""
+    if not directions:
+        return None
+    return directions[0].get('overview_polyline', {}).get('points', '') or None
+
+
+def build_map_image_url(
     origin: str, 
     destination: str, 
+    directions: Optional[List[Dict]],
     size: str = "600x400",
     zoom: Optional[int] = None,
     scale: int = 2
 ) -> Optional[str]:
     """
-    Generate a Google Maps Static API URL showing the route from origin to destination
+    Build a Google Maps Static API URL showing the route from origin to destination
     
     Args:
         origin: Starting location
         destination: End location
+        directions: Directions for this pair (used for the polyline and center point)
         size: Image size in format "widthxheight" (max 640x640 for free tier)
         zoom: Optional zoom level (1-21). If None, Google Maps auto-calculates best zoom
         scale: Scale factor for higher resolution (1 or 2, default 2 for retina displays)
@@ -267,68 +315,38 @@ def generate_map_image_url(
         # Build the Static Maps API URL
         base_url = "https://maps.googleapis.com/maps/api/staticmap"
         
-        # Get directions to extract the polyline and center point
-        directions = get_directions(origin, destination)
+        polyline = get_route_polyline(directions)
+        
+        params = [
+            f"size={size}",
+            f"scale={scale}",
+            f"markers=color:green|label:A|{origin_encoded}",
+            f"markers=color:red|label:B|{destination_encoded}",
+            f"key={GOOGLE_MAPS_API_KEY}"
+        ]
         
         if zoom is not None:
             # When zoom is specified, we need to use center parameter
-            # Calculate center point from the route
-            center_lat = None
-            center_lng = None
-            
-            if directions and len(directions) > 0:
-                # Get bounds from the route
-                bounds = directions[0].get('bounds', {})
-                if bounds:
-                    ne = bounds.get('northeast', {})
-                    sw = bounds.get('southwest', {})
-                    if ne and sw:
-                        # Calculate center point
-                        center_lat = (ne.get('lat', 0) + sw.get('lat', 0)) / 2
-                        center_lng = (ne.get('lng', 0) + sw.get('lng', 0)) / 2
+            center = get_route_center(directions)
             
             # Validate zoom level (Google Maps supports 0-21, but we'll use 1-21)
             zoom = max(1, min(21, zoom))
             
-            # Build params with center and zoom
-            params = [
-                f"size={size}",
-                f"scale={scale}",
-                f"markers=color:green|label:A|{origin_encoded}",
-                f"markers=color:red|label:B|{destination_encoded}",
-                f"key={GOOGLE_MAPS_API_KEY}"
-            ]
-            
             # Add center if we calculated it, otherwise use origin
-            if center_lat is not None and center_lng is not None:
-                params.insert(2, f"center={center_lat},{center_lng}")
+            if center is not None:
+                params.insert(2, f"center={center[0]},{center[1]}")
             else:
                 params.insert(2, f"center={origin_encoded}")
             
             params.insert(3, f"zoom={zoom}")
             
             # Add path with polyline if available
-            if directions and len(directions) > 0:
-                polyline = directions[0].get('overview_polyline', {}).get('points', '')
-                if polyline:
-                    params.insert(4, f"path=weight:3|color:0x0000ff|enc:{polyline}")
+            if polyline:
+                params.insert(4, f"path=weight:3|color:0x0000ff|enc:{polyline}")
         
-        else:
-            # When zoom is None, use path to auto-fit the route
-            params = [
-                f"size={size}",
-                f"scale={scale}",
-                f"markers=color:green|label:A|{origin_encoded}",
-                f"markers=color:red|label:B|{destination_encoded}",
-                f"key={GOOGLE_MAPS_API_KEY}"
-            ]
-            
-            # Add polyline path for auto-fit
-            if directions and len(directions) > 0:
-                polyline = directions[0].get('overview_polyline', {}).get('points', '')
-                if polyline:
-                    # Insert path before key parameter
-                    params.insert(-1, f"path=weight:3|color:0x0000ff|enc:{polyline}")
+        elif polyline:
+            # When zoom is None, use path to auto-fit the route (insert before key parameter)
+            params.insert(-1, f"path=weight:3|color:0x0000ff|enc:{polyline}")
         
         map_url = f"{base_url}?{'&'.join(params)}"
         
@@ -338,3 +356,68 @@ def generate_map_image_url(
     except Exception as e:
         logger.error(f"Error generating map image URL: {e}")
         return None
+
+
+async def generate_map_image_url(
+    origin: str, 
+    destination: str, 
+    size: str = "600x400",
+    zoom: Optional[int] = None,
+    scale: int = 2,
+    directions: Optional[List[Dict]] = None
+) -> Optional[str]:
+    """
+    Generate a Google Maps Static API URL showing the route from origin to destination
+    
+    Args:
+        origin: Starting location
+        destination: End location
+        size: Image size in format "widthxheight" (max 640x640 for free tier)
+        zoom: Optional zoom level (1-21). If None, Google Maps auto-calculates best zoom
+        scale: Scale factor for higher resolution (1 or 2, default 2 for retina displays)
+        directions: Directions already fetched for this pair (skips the API call)
+    
+    Returns:
+        URL to the static map image or None if API key not available
+    """
+    if not GOOGLE_MAPS_API_KEY:
+        logger.error("Google Maps API key not available for map image generation")
+        return None
+    
+    # Get directions to extract the polyline and center point
+    if directions is None:
+        directions = await get_directions(origin, destination)
+    return build_map_image_url(origin, destination, directions, size=size, zoom=zoom, scale=scale)
+
+
+class JourneyResolution:
+    """
+    Directions for one origin/destination pair, fetched once
+    
+    The journey summary and map image URL are both derived from the same Directions
+    API result instead of each step calling the API again. The summary is formatted
+    once here; the chat handler and the response cache read it several times.
+    """
+    
+    def __init__(self, origin: str, destination: str, directions: Optional[List[Dict]]):
+        self.origin = origin
+        self.destination = destination
+        # Empty list (not None) when the lookup failed, so later steps never refetch
+        self.directions = directions or []
+        # Journey summary formatted for the LLM, or None if no route was found
+        self.summary: Optional[str] = parse_journey_data(self.directions) if self.directions else None
+    
+    @property
+    def found(self) -> bool:
+        return bool(self.directions)
+    
+    def map_image_url(self, size: str = "600x400", zoom: Optional[int] = None, scale: int = 2) -> Optional[str]:
+        """Static map URL for the resolved route (see build_map_image_url)"""
+        return build_map_image_url(
+            self.origin,
+            self.destination,
+            self.directions,
+            size=size,
+            zoom=zoom,
+            scale=scale
+        )
@@ -0,0 +1,65 @@
+"""
+Gunicorn configuration for running several uvicorn workers on one machine
+
+    gunicorn -c gunicorn.conf.py main:app
+
+This is the Procfile's web process. The master imports the app once (preload_app;
+importing main.py does not load the model) and warms the page cache with the GGUF
+file before forking, so the workers' model loads do not each wait on the disk.
+Each worker loads its own model context. The backends mmap the GGUF read-only, so
+the workers share its page-cache pages and the weights are held in memory once; per
+worker, only the KV cache and compute buffers are extra. Check it with:
+
+    python process_memory.py --children <master pid>
+
+Give each worker N_THREADS = cores / WEB_WORKERS. Alternatively, set
+MODEL_WORKER_SOCKETS so the web workers stay lean and model_worker.py processes
+generate.
+
+The conversation history cache and the authenticated-user cache live in each
+worker and only see that worker's writes. Unless WEB_WORKERS_STICKY says a user's
+requests always reach the same worker, more than one worker turns the history
+cache off and caps the user cache TTL, so one worker's new turns, history clears and
+account changes are not hidden from the others.
+"""
+import logging
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Not WEB_CONCURRENCY: some platforms set that from the dyno size, which would
+# multiply model contexts without anyone asking for it
+workers = int(os.getenv("WEB_WORKERS", "1"))
+# The load balancer pins each user to one worker (per-process caches stay correct)
+sticky_sessions = os.getenv("WEB_WORKERS_STICKY", "false").lower() == "true"
+# Longest a worker may serve a cached user record another worker has changed
+MULTI_WORKER_USER_CACHE_TTL_SECONDS = 5.0
+
+if workers > 1 and not sticky_sessions:
+    # Set before the preloaded app reads its configuration
+    if os.getenv("HISTORY_CACHE_ENABLED", "true").lower() == "true":
+        logger.warning("HISTORY_CACHE_ENABLED turned off: it is per worker and WEB_WORKERS > 1")
+    os.environ["HISTORY_CACHE_ENABLED"] = "false"
+    user_cache_ttl = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+    os.environ["USER_CACHE_TTL_SECONDS"] = str(min(user_cache_ttl, MULTI_WORKER_USER_CACHE_TTL_SECONDS))
+
+from model_loader import MODEL_PATH
+from model_worker_client import MODEL_WORKER_SOCKETS
+from process_memory import preload_model_pages
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Model loading and warm-up run in the worker's lifespan
+timeout = int(os.getenv("WEB_WORKER_TIMEOUT_SECONDS", "300"))
+graceful_timeout = 30
+
+
+def on_starting(server):
+    """Runs in the master before any worker is forked; page-cache warm-up only"""
+    if not MODEL_WORKER_SOCKETS and os.path.exists(MODEL_PATH):
+        preload_model_pages(MODEL_PATH)
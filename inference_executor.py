@@ -0,0 +1,518 @@
+"""
+Inference executor for running LLM generation off the event loop
+A dedicated worker thread owns the loaded model and handlers await its results.
+Every generation is queued as a job whose queue wait and token rate are recorded.
+"""
+import asyncio
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterator, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Sentinel marking the end of a streamed generation
+_STREAM_END = object()
+
+
+class GenerationResult:
+    """Output and timings of one generation job"""
+
+    def __init__(self):
+        self.text = ""
+        self.completion_tokens = 0
+        # Reported by the backend when available (llama-cpp-python non-streaming)
+        self.prompt_tokens: Optional[int] = None
+        self.enqueued_at = time.perf_counter()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def queue_wait(self) -> float:
+        """Seconds spent waiting for the inference thread"""
+        if self.started_at is None:
+            return time.perf_counter() - self.enqueued_at
+        return self.started_at - self.enqueued_at
+
+    @property
+    def generation_time(self) -> float:
+        """Seconds spent generating on the inference thread"""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    @property
+    def tokens_per_second(self) -> float:
+        if self.generation_time <= 0:
+            return 0.0
+        return self.completion_tokens / self.generation_time
+
+    def timings(self) -> dict:
+        """Per-request timings reported alongside the completion"""
+        return {
+            "queue_wait_ms": round(self.queue_wait * 1000, 1),
+            "generation_ms": round(self.generation_time * 1000, 1),
+            "completion_tokens": self.completion_tokens,
+            "tokens_per_second": round(self.tokens_per_second, 2),
+        }
+
+
+class SchedulerStats:
+    """
+    Rolling queue wait, service time and throughput figures for finished jobs
+
+    Streams closed before their generation ran to the end are only counted as
+    cancelled: their truncated (or zero) durations would drag down the average
+    service time the admission controller's Retry-After estimate is based on.
+    """
+
+    def __init__(self, window: int = 200):
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.total_tokens = 0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, result: GenerationResult, failed: bool = False, cancelled: bool = False):
+        with self._lock:
+            if failed:
+                self.failed += 1
+                return
+            if cancelled:
+                self.cancelled += 1
+                return
+            self.completed += 1
+            self.total_tokens += result.completion_tokens
+            self._recent.append((result.queue_wait, result.generation_time, result.completion_tokens))
+
+    def average_service_time(self) -> Optional[float]:
+        """Mean seconds per job over the recent window, None until a job finished"""
+        with self._lock:
+            if not self._recent:
+                return None
+            return sum(job[1] for job in self._recent) / len(self._recent)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            recent = list(self._recent)
+            completed, failed, cancelled = self.completed, self.failed, self.cancelled
+            total_tokens = self.total_tokens
+
+        waits = sorted(job[0] for job in recent)
+        busy_time = sum(job[1] for job in recent)
+        tokens = sum(job[2] for job in recent)
+        return {
+            "completed": completed,
+            "failed": failed,
+            "cancelled": cancelled,
+            "total_completion_tokens": total_tokens,
+            "avg_queue_wait_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            "p95_queue_wait_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0,
+            "avg_generation_ms": round(busy_time / len(recent) * 1000, 1) if recent else 0.0,
+            "tokens_per_second": round(tokens / busy_time, 2) if busy_time > 0 else 0.0,
+        }
+
+
+class GenerationStream:
+    """
+    Async iterator over the text pieces of one streamed generation
+
+    The backend generator is driven on the inference thread and its pieces are
+    handed to the event loop through a queue. Closing the iteration (for example
+    when the client disconnects) stops generation at the next token. Timings are
+    available on .result once the stream is exhausted.
+
+    The executor is picked from the dispatcher (an executor or a pool) when
+    iteration starts, so a pool routes the stream to the least-busy instance.
+    """
+
+    def __init__(self, dispatcher, prompt: str, params: dict):
+        self.dispatcher = dispatcher
+        self.prompt = prompt
+        self.params = params
+        self.result = GenerationResult()
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        cancelled = threading.Event()
+        executor = self.dispatcher.acquire()
+        result = self.result
+        failed = False
+        finished = False
+
+        def produce(model):
+            if cancelled.is_set():
+                # The consumer went away while the job was queued
+                loop.call_soon_threadsafe(queue.put_nowait, (_STREAM_END, None))
+                return
+            result.started_at = time.perf_counter()
+            try:
+                pieces = executor._run_backend(model, self.prompt, stream=True, **self.params)
+                generated = []
+                for piece in pieces:
+                    if cancelled.is_set():
+                        break
+                    generated.append(piece)
+                    loop.call_soon_threadsafe(queue.put_nowait, (piece, None))
+                # Pieces are not tokens (text held back around stop strings is merged)
+                result.completion_tokens = executor._count_tokens(model, "".join(generated), len(generated))
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, (None, e))
+            finally:
+                result.finished_at = time.perf_counter()
+                loop.call_soon_threadsafe(queue.put_nowait, (_STREAM_END, None))
+
+        producer = asyncio.ensure_future(executor.submit(produce))
+        # Errors are delivered through the queue; keep the future from logging them twice
+        producer.add_done_callback(lambda f: f.cancelled() or f.exception())
+        pieces = []
+        try:
+            while True:
+                piece, error = await queue.get()
+                if error is not None:
+                    failed = True
+                    raise error
+                if piece is _STREAM_END:
+                    finished = True
+                    break
+                pieces.append(piece)
+                yield piece
+            result.text = "".join(pieces)
+        finally:
+            cancelled.set()
+            executor.stats.record(result, failed=failed, cancelled=not finished)
+
+
+class InferenceExecutor:
+    """
+    Owns a loaded model and runs every call against it on a single worker thread
+
+    The llama context is not thread-safe, so generation jobs are queued FIFO and
+    run one at a time on that thread while the event loop stays free for auth,
+    health and map requests. Queue wait and tokens/sec are recorded per job.
+
+    There is no batched decode: concurrent sequences are not interleaved token by
+    token in one llama batch. ctransformers and the high-level llama-cpp-python
+    Llama API drive a single sequence per context; batching would require the
+    low-level llama_batch/llama_decode bindings, per-sequence KV slots and our own
+    sampling loop, bypassing the prefix and conversation state caches. Requests
+    run in parallel across InferenceExecutorPool instances instead.
+    """
+
+    def __init__(self, model, use_ctransformers: bool, stats: Optional[SchedulerStats] = None):
+        self.model = model
+        self.use_ctransformers = use_ctransformers
+        self.pending = 0
+        self.stats = stats or SchedulerStats()
+        # Optional PrefixStateCache restored before each generation
+        self.prefix_cache = None
+        # Optional ConversationStateCache of per-user states (llama-cpp-python only)
+        self.conversation_cache = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+
+    def acquire(self) -> "InferenceExecutor":
+        """Dispatcher interface shared with InferenceExecutorPool"""
+        return self
+
+    async def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run fn(model, *args, **kwargs) on the inference thread and await the result
+
+        Args:
+            fn: Callable receiving the model as its first argument
+            *args: Positional arguments forwarded to fn
+            **kwargs: Keyword arguments forwarded to fn
+
+        Returns:
+            Whatever fn returns
+        """
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        try:
+            return await loop.run_in_executor(
+                self._executor,
+                functools.partial(fn, self.model, *args, **kwargs)
+            )
+        finally:
+            self.pending -= 1
+
+    async def generate(
+        self,
+        prompt: str,
+        max_tokens: int,
+        temperature: float,
+        top_p: float,
+        top_k: int,
+        repeat_penalty: float,
+        stop: Optional[List[str]] = None,
+        cache_key: Optional[str] = None,
+        save_state: bool = False,
+        prompt_ids: Optional[List[int]] = None
+    ) -> GenerationResult:
+        """
+        Generate a completion for the prompt on the inference thread
+
+        Args:
+            cache_key: Conversation owner whose cached model state may be reused
+            save_state: Snapshot the state afterwards for the owner's next turn
+            prompt_ids: Prompt already tokenized (llama-cpp-python only, skips tokenizing prompt)
+
+        Returns:
+            GenerationResult with the generated text (without the prompt) and timings
+        """
+        result = GenerationResult()
+        params = {
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "top_k": top_k,
+            "repeat_penalty": repeat_penalty,
+            "stop": stop,
+            "cache_key": cache_key,
+            "save_state": save_state,
+            "prompt_ids": prompt_ids,
+        }
+
+        def job(model):
+            result.started_at = time.perf_counter()
+            try:
+                result.text, result.completion_tokens, result.prompt_tokens = self._generate(model, prompt, **params)
+            finally:
+                result.finished_at = time.perf_counter()
+
+        try:
+            await self.submit(job)
+        except Exception:
+            self.stats.record(result, failed=True)
+            raise
+
+        self.stats.record(result)
+        logger.info(
+            f"Generation finished: queue_wait={result.queue_wait * 1000:.0f}ms "
+            f"tokens={result.completion_tokens} tokens/s={result.tokens_per_second:.1f}"
+        )
+        return result
+
+    def stream(
+        self,
+        prompt: str,
+        max_tokens: int,
+        temperature: float,
+        top_p: float,
+        top_k: int,
+        repeat_penalty: float,
+        stop: Optional[List[str]] = None,
+        cache_key: Optional[str] = None,
+        save_state: bool = False,
+        prompt_ids: Optional[List[int]] = None
+    ) -> GenerationStream:
+        """
+        Stream a completion for the prompt, yielding text pieces as they are produced
+
+        Returns:
+            GenerationStream to iterate with `async for`; timings end up on .result
+        """
+        return GenerationStream(self, prompt, {
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "top_k": top_k,
+            "repeat_penalty": repeat_penalty,
+            "stop": stop,
+            "cache_key": cache_key,
+            "save_state": save_state,
+            "prompt_ids": prompt_ids,
+        })
+
+    def _generate(self, model, prompt: str, **params) -> tuple:
+        """
+        Blocking generation call, only ever run on the inference thread
+
+        Returns:
+            Tuple of (text, completion tokens, prompt tokens or None if not reported)
+        """
+        if self.use_ctransformers:
+            text = self._run_backend(model, prompt, stream=False, **params)
+            return text, self._count_tokens(model, text), None
+        response = self._run_backend(model, prompt, stream=False, raw=True, **params)
+        usage = response.get("usage", {})
+        return response["choices"][0]["text"], usage.get("completion_tokens", 0), usage.get("prompt_tokens")
+
+    def _count_tokens(self, model, text: str, fallback: int = 0) -> int:
+        """Tokens in generated text, by the backend's tokenizer (fallback if it fails)"""
+        if not text:
+            return 0
+        try:
+            if self.use_ctransformers:
+                return len(model.tokenize(text, add_bos_token=False))
+            return len(model.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+        except Exception as e:
+            logger.warning(f"Could not count completion tokens: {e}")
+            return fallback
+
+    def _run_backend(
+        self,
+        model,
+        prompt: str,
+        stream: bool,
+        max_tokens: int,
+        temperature: float,
+        top_p: float,
+        top_k: int,
+        repeat_penalty: float,
+        stop: Optional[List[str]] = None,
+        cache_key: Optional[str] = None,
+        save_state: bool = False,
+        prompt_ids: Optional[List[int]] = None,
+        raw: bool = False
+    ) -> Union[str, dict, Iterator[str]]:
+        """
+        Call the loaded backend, returning the full text or an iterator of text pieces
+
+        With raw=True the llama-cpp-python completion dict is returned unchanged.
+        prompt_ids (the prompt's tokens, BOS included) are handed to llama-cpp-python
+        as-is; ctransformers always gets the prompt text. The conversation state is
+        saved only with save_state, for chats whose next turn will share the prompt.
+        """
+        use_conversation_cache = (
+            cache_key is not None
+            and self.conversation_cache is not None
+            and not self.use_ctransformers
+        )
+        restored = use_conversation_cache and self.conversation_cache.restore(model, cache_key, prompt, prompt_ids)
+        if not restored and self.prefix_cache is not None:
+            self.prefix_cache.restore(model, prompt)
+
+        if self.use_ctransformers:
+            # ctransformers uses max_new_tokens
+            generation_kwargs = {
+                "max_new_tokens": max_tokens,
+                "temperature": temperature,
+                "top_p": top_p,
+                "top_k": top_k,
+                "repetition_penalty": repeat_penalty,
+            }
+            if stop:
+                generation_kwargs["stop"] = stop
+            if stream:
+                generation_kwargs["stream"] = True
+
+            return model(prompt, **generation_kwargs)
+
+        # llama-cpp-python uses max_tokens (not max_new_tokens)
+        # and uses create_completion method which returns a Completion object
+        response = model.create_completion(
+            prompt=prompt_ids if prompt_ids is not None else prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            repeat_penalty=repeat_penalty,
+            stop=stop if stop else [],
+            stream=stream,
+        )
+        save_key = cache_key if use_conversation_cache and save_state else None
+        if stream:
+            return self._iter_llama_chunks(model, response, save_key)
+        if save_key is not None:
+            self.conversation_cache.save(model, save_key)
+        return response if raw else response["choices"][0]["text"]
+
+    def _iter_llama_chunks(self, model, chunks, cache_key: Optional[str]) -> Iterator[str]:
+        """Unwrap streamed llama-cpp chunks, saving the conversation state once finished"""
+        for chunk in chunks:
+            yield chunk["choices"][0]["text"]
+        if cache_key is not None:
+            self.conversation_cache.save(model, cache_key)
+
+    def shutdown(self):
+        """Wait for the running generation to finish and stop the worker thread"""
+        self._executor.shutdown(wait=True)
+        logger.info("Inference executor stopped")
+
+
+class InferenceExecutorPool:
+    """
+    Independent model instances, each behind its own InferenceExecutor
+
+    Every generation is dispatched to the instance with the fewest pending jobs, so
+    several requests generate in parallel on machines with spare cores. The
+    instances share one SchedulerStats and the same prefix/conversation caches.
+    """
+
+    def __init__(self, executors: List[InferenceExecutor]):
+        if not executors:
+            raise ValueError("InferenceExecutorPool needs at least one executor")
+        self.executors = executors
+        self.use_ctransformers = executors[0].use_ctransformers
+        self.stats = executors[0].stats
+        for executor in executors:
+            executor.stats = self.stats
+        self._next = 0
+
+    @classmethod
+    def from_models(cls, models: List[object], use_ctransformers: bool) -> "InferenceExecutorPool":
+        stats = SchedulerStats()
+        return cls([InferenceExecutor(model, use_ctransformers, stats) for model in models])
+
+    @property
+    def pending(self) -> int:
+        """Jobs queued or running across all instances"""
+        return sum(executor.pending for executor in self.executors)
+
+    @property
+    def prefix_cache(self):
+        return self.executors[0].prefix_cache
+
+    @prefix_cache.setter
+    def prefix_cache(self, cache):
+        for executor in self.executors:
+            executor.prefix_cache = cache
+
+    @property
+    def conversation_cache(self):
+        return self.executors[0].conversation_cache
+
+    @conversation_cache.setter
+    def conversation_cache(self, cache):
+        for executor in self.executors:
+            executor.conversation_cache = cache
+
+    def acquire(self) -> InferenceExecutor:
+        """Pick the least-loaded instance, rotating between equally idle ones"""
+        count = len(self.executors)
+        order = [self.executors[(self._next + i) % count] for i in range(count)]
+        executor = min(order, key=lambda e: e.pending)
+        self._next = (self.executors.index(executor) + 1) % count
+        return executor
+
+    async def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        return await self.acquire().submit(fn, *args, **kwargs)
+
+    async def submit_all(self, fn: Callable[..., Any], *args, **kwargs) -> List[Any]:
+        """Run fn(model, ...) once on every instance (e.g. to prime caches)"""
+        return await asyncio.gather(*(executor.submit(fn, *args, **kwargs) for executor in self.executors))
+
+    async def generate(self, prompt: str, **params) -> GenerationResult:
+        return await self.acquire().generate(prompt, **params)
+
+    def stream(self, prompt: str, **params) -> GenerationStream:
+        return GenerationStream(self, prompt, params)
+
+    def occupancy(self) -> dict:
+        """Per-instance load for /health"""
+        pending = [executor.pending for executor in self.executors]
+        return {
+            "size": len(self.executors),
+            "busy": sum(1 for p in pending if p > 0),
+            "pending": pending,
+        }
+
+    def shutdown(self):
+        for executor in self.executors:
+            executor.shutdown()
@@ -2,85 +2,86 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import AsyncIterator, Awaitable, Callable, Optional, List, Union
+import asyncio
 import os
+import json
+import time
 import logging
 from contextlib import asynccontextmanager
+
+# Configure logging before importing modules that log at import time
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
 from database import connect_to_mongo, close_mongo_connection
 from auth import router as auth_router, get_current_user
 from conversation_memory import (
+    CONVERSATION_HISTORY_LIMIT,
     setup_conversation_indexes,
     store_message,
-    get_conversation_history,
-    clear_conversation_history
+    clear_conversation_history,
+    history_cache,
+    write_buffer
 )
-from google_maps_service import (
-    extract_locations_from_text,
-    format_journey_summary,
-    generate_map_image_url
+from google_maps_service import close_maps_client
+from directions_cache import (
+    directions_cache,
+    resolve_journey_cached,
+    setup_directions_cache_indexes
 )
+from chat_enrichment import gather_enrichment
 from travel_agent_prompt import get_travel_agent_prompt
+from inference_executor import InferenceExecutorPool
+# Backend libraries are imported by model_loader only when a model is loaded
+import model_loader
+from model_loader import MODEL_PATH
+from model_runtime import start_model_runtime
+from model_worker_client import (
+    MODEL_WORKER_HANDSHAKE_INTERVAL_SECONDS,
+    MODEL_WORKER_SOCKETS,
+    RemoteInferencePool
+)
+from context_assembler import ContextAssembler
+from prompt_builder import PromptBuilder, strip_prompt_echo
+from model_warmup import model_warmup
+from process_memory import memory_report
+from response_cache import response_cache
+from completion_cache import completion_cache
+from admission import (
+    ADMISSION_MAX_IN_FLIGHT,
+    ADMISSION_MAX_QUEUED,
+    ADMISSION_MAX_QUEUE_WAIT_SECONDS,
+    AdmissionController,
+    AdmissionRejected,
+    AdmissionTicket
+)
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+# Model instances, each owned by an inference worker thread; handlers await generations through it.
+# With MODEL_WORKER_SOCKETS set, generations go to model_worker.py processes instead
+inference_pool: Optional[Union[InferenceExecutorPool, RemoteInferencePool]] = None
 
-# Try to import ctransformers, fallback to llama-cpp-python
-USE_CTRANSFORMERS = None
-ctransformers_available = False
-llama_cpp_available = False
-
-try:
-    from ctransformers import AutoModelForCausalLM
-    ctransformers_available = True
-    logger.info("ctransformers library is available")
-except ImportError:
-    logger.warning("ctransformers not available")
-
-try:
-    from llama_cpp import Llama
-    llama_cpp_available = True
-    logger.info("llama-cpp-python library is available")
-except (ImportError, ValueError, Exception) as e:
-    logger.warning(f"llama-cpp-python not available: {e}")
-    llama_cpp_available = False
-
-# Prefer ctransformers, but allow fallback
-if ctransformers_available:
-    USE_CTRANSFORMERS = True
-    logger.info("Will try to use ctransformers first")
-elif llama_cpp_available:
-    USE_CTRANSFORMERS = False
-    logger.info("Will use llama-cpp-python")
-else:
-    raise ImportError(
-        "Neither ctransformers nor llama-cpp-python is installed.\n"
-        "Install one of them:\n"
-        "  pip install ctransformers\n"
-        "  OR\n"
-        "  pip install llama-cpp-python --extra-index-url https://abetlen.github.io/llama-cpp-python/whl/cpu"
-    )
+# Backend of the in-process model (None until loaded or in split mode)
+USE_CTRANSFORMERS: Optional[bool] = None
 
-# Configuration
-MODEL_PATH = os.getenv("MODEL_PATH", "Llama-3.2-3B-Instruct-Q8_0.gguf")
-# Convert to absolute path if relative
-if not os.path.isabs(MODEL_PATH):
-    MODEL_PATH = os.path.abspath(MODEL_PATH)
-N_CTX = int(os.getenv("N_CTX", "2048"))
-N_THREADS = int(os.getenv("N_THREADS", "4"))
-N_GPU_LAYERS = int(os.getenv("N_GPU_LAYERS", "0"))
+# Bounded admission queue in front of generation
+admission: Optional[AdmissionController] = None
 
-# Global model instance
-llm_model = None
+# Polls the model workers' handshake in the split deployment
+worker_sync_task: Optional[asyncio.Task] = None
+
+# Packs chat history into the context window using the model's tokenizer
+context_assembler: Optional[ContextAssembler] = None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown events"""
-    global llm_model, USE_CTRANSFORMERS
+    global inference_pool, admission, context_assembler, USE_CTRANSFORMERS, worker_sync_task
     
     # Connect to MongoDB
     await connect_to_mongo()
@@ -88,111 +89,40 @@ async def lifespan(app: FastAPI):
     # Set up conversation memory indexes
     await setup_conversation_indexes()
     
+    # Batch conversation message writes in the background
+    write_buffer.start()
+    
+    # Shared directions cache collection (optional)
+    await setup_directions_cache_indexes()
+    
     # Startup
     try:
-        if not os.path.exists(MODEL_PATH):
-            logger.error(f"Model file not found at {MODEL_PATH}")
-            logger.info(f"Please ensure the GGUF model file is available at {MODEL_PATH}")
-            yield
-            return
-        
-        logger.info(f"Loading model from {MODEL_PATH}")
-        
-        if USE_CTRANSFORMERS:
-            # Using ctransformers - try different model types for Llama 3.2
-            # Try various model types that might work with Llama 3.2
-            model_types_to_try = ["llama", "llama3", "llama-2", None]  # None = auto-detect
-            local_files_options = [False, True]  # Try False first (allows downloading config if needed)
-            
-            loaded = False
-            for local_files_only in local_files_options:
-                for model_type in model_types_to_try:
-                    try:
-                        logger.info(f"Trying to load with model_type={model_type if model_type else 'auto-detect'}, local_files_only={local_files_only}")
-                        # Try with model_file parameter for GGUF files
-                        try:
-                            if model_type:
-                                llm_model = AutoModelForCausalLM.from_pretrained(
-                                    MODEL_PATH,
-                                    model_type=model_type,
-                                    context_length=N_CTX,
-                                    threads=N_THREADS,
-                                    gpu_layers=N_GPU_LAYERS,
-                                    local_files_only=local_files_only,
-                                )
-                            else:
-                                # Auto-detect model type - don't specify model_type
-                                llm_model = AutoModelForCausalLM.from_pretrained(
-                                    MODEL_PATH,
-                                    context_length=N_CTX,
-                                    threads=N_THREADS,
-                                    gpu_layers=N_GPU_LAYERS,
-                                    local_files_only=local_files_only,
-                                )
-                        except Exception as e1:
-                            # If from_pretrained fails, try using model_file parameter directly
-                            logger.debug(f"from_pretrained failed, trying model_file parameter: {e1}")
-                            if model_type:
-                                llm_model = AutoModelForCausalLM(
-                                    model_file=MODEL_PATH,
-                                    model_type=model_type,
-                                    context_length=N_CTX,
-                                    threads=N_THREADS,
-                                    gpu_layers=N_GPU_LAYERS,
-                                )
-                            else:
-                                llm_model = AutoModelForCausalLM(
-                                    model_file=MODEL_PATH,
-                                    context_length=N_CTX,
-                                    threads=N_THREADS,
-                                    gpu_layers=N_GPU_LAYERS,
-                                )
-                        
-                        logger.info(f"Successfully loaded with model_type={model_type if model_type else 'auto-detect'}")
-                        loaded = True
-                        break
-                    except Exception as e:
-                        logger.warning(f"Failed with model_type={model_type if model_type else 'auto-detect'}, local_files_only={local_files_only}: {e}")
-                        continue
-                if loaded:
-                    break
-            
-            if not loaded:
-                # If ctransformers failed but llama-cpp-python is available, try that
-                if llama_cpp_available:
-                    logger.warning("ctransformers failed, trying llama-cpp-python as fallback...")
-                    USE_CTRANSFORMERS = False
-                    llm_model = Llama(
-                        model_path=MODEL_PATH,
-                        n_ctx=N_CTX,
-                        n_threads=N_THREADS,
-                        n_gpu_layers=N_GPU_LAYERS,
-                        verbose=False
-                    )
-                    logger.info("Successfully loaded with llama-cpp-python fallback")
-                else:
-                    error_msg = (
-                        "Failed to load model with ctransformers. All model types failed.\n"
-                        "Possible solutions:\n"
-                        "1. Upgrade ctransformers: pip install --upgrade ctransformers\n"
-                        "2. Install llama-cpp-python (may require Visual C++ Redistributables on Windows):\n"
-                        "   pip install llama-cpp-python --extra-index-url https://abetlen.github.io/llama-cpp-python/whl/cpu\n"
-                        "   If that fails, try: pip install llama-cpp-python --force-reinstall --no-cache-dir\n"
-                        "3. Check if the GGUF model file is valid and not corrupted"
-                    )
-                    logger.error(error_msg)
-                    raise Exception(error_msg)
+        if MODEL_WORKER_SOCKETS:
+            # Split deployment: model workers load the model, this process stays lean
+            inference_pool = RemoteInferencePool(MODEL_WORKER_SOCKETS)
+            logger.info(f"Serving generations through {len(MODEL_WORKER_SOCKETS)} model worker(s)")
         else:
-            # Using llama-cpp-python
-            llm_model = Llama(
-                model_path=MODEL_PATH,
-                n_ctx=N_CTX,
-                n_threads=N_THREADS,
-                n_gpu_layers=N_GPU_LAYERS,
-                verbose=False
-            )
+            if not os.path.exists(MODEL_PATH):
+                logger.error(f"Model file not found at {MODEL_PATH}")
+                logger.info(f"Please ensure the GGUF model file is available at {MODEL_PATH}")
+                yield
+                return
+            
+            runtime = await start_model_runtime()
+            inference_pool = runtime.pool
+            context_assembler = runtime.context_assembler
+            USE_CTRANSFORMERS = runtime.use_ctransformers
+            completion_cache.model_identity = runtime.model_identity
+        
+        admission = AdmissionController(
+            max_in_flight=ADMISSION_MAX_IN_FLIGHT or inference_pool.occupancy()["size"],
+            max_queued=ADMISSION_MAX_QUEUED,
+            max_queue_wait=ADMISSION_MAX_QUEUE_WAIT_SECONDS,
+            service_time=inference_pool.stats.average_service_time
+        )
         
-        logger.info("Model loaded successfully!")
+        if isinstance(inference_pool, RemoteInferencePool):
+            worker_sync_task = asyncio.create_task(sync_model_workers())
         
     except Exception as e:
         logger.error(f"Error loading model: {e}")
@@ -200,7 +130,7 @@ async def lifespan(app: FastAPI):
         logger.error("MODEL LOADING FAILED!")
         logger.error("=" * 60)
         try:
-            if USE_CTRANSFORMERS:
+            if model_loader.USE_CTRANSFORMERS:
                 logger.error("ctransformers failed to load the model.")
                 logger.error("You can try:")
                 logger.error("1. Install llama-cpp-python instead: pip install llama-cpp-python --extra-index-url https://abetlen.github.io/llama-cpp-python/whl/cpu")
@@ -220,15 +150,51 @@ async def lifespan(app: FastAPI):
     yield
     
     # Shutdown
-    if llm_model:
+    if worker_sync_task is not None:
+        worker_sync_task.cancel()
+        worker_sync_task = None
+    await model_warmup.stop()
+    completion_cache.close()
+    admission = None
+    context_assembler = None
+    if isinstance(inference_pool, RemoteInferencePool):
+        await inference_pool.aclose()
+        inference_pool = None
+    elif inference_pool:
         logger.info("Unloading model...")
-        llm_model = None
+        inference_pool.shutdown()
+        inference_pool = None
         logger.info("Model unloaded")
     
-    # Close MongoDB connection
+    # Write out buffered conversation messages before the connection closes
+    await write_buffer.stop()
+    
+    # Close Google Maps and MongoDB connections
+    await close_maps_client()
     await close_mongo_connection()
 
 
+def apply_worker_handshake():
+    """Take the model identity and capacity from what the model workers reported"""
+    if not isinstance(inference_pool, RemoteInferencePool):
+        return
+    # The workers' model, not this process's MODEL_PATH; a swap makes old entries unreachable
+    completion_cache.model_identity = inference_pool.model_identity
+    if admission is not None and not ADMISSION_MAX_IN_FLIGHT:
+        admission.resize(inference_pool.capacity())
+
+
+async def sync_model_workers():
+    """Refresh the model workers' handshake (they may still be loading, or restart with another model)"""
+    while True:
+        try:
+            await inference_pool.health()
+            apply_worker_handshake()
+        except Exception as e:
+            logger.warning(f"Could not reach model workers: {e}")
+        await asyncio.sleep(MODEL_WORKER_HANDSHAKE_INTERVAL_SECONDS)
+
+
 app = FastAPI(
     title="LLM Server with Llama-3.2-3B-Instruct",
     version="1.0.0",
@@ -261,6 +227,7 @@ class ChatRequest(BaseModel):
     top_k: Optional[int] = 40
     repeat_penalty: Optional[float] = 1.1
     stop: Optional[List[str]] = None
+    stream: Optional[bool] = False          # Stream chat.completion.chunk events over SSE
 
 
 class CompletionRequest(BaseModel):
@@ -271,6 +238,7 @@ class CompletionRequest(BaseModel):
     top_k: Optional[int] = 40
     repeat_penalty: Optional[float] = 1.1
     stop: Optional[List[str]] = None
+    stream: Optional[bool] = False
 
 
 class ChatResponse(BaseModel):
@@ -283,175 +251,475 @@ class CompletionResponse(BaseModel):
     usage: dict
 
 
-def format_messages_for_llama(messages: List[ChatMessage]) -> str:
-    """Format messages for Llama-3.2-Instruct format"""
-    # Llama-3.2-Instruct uses a specific chat template
-    formatted = ""
-    is_first_message = True
+def prompt_token_ids(builder: PromptBuilder) -> Optional[List[int]]:
+    """
+    Token ids for a built prompt from cached segment tokens
     
-    for msg in messages:
-        if msg.role == "system":
-            # Only add begin_of_text for the very first system message
-            if is_first_message:
-                formatted += f"<|begin_of_text|><|start_header_id|>system<|end_header_id|>\n\n{msg.content}<|eot_id|>"
-                is_first_message = False
-            else:
-                # Subsequent system messages don't need begin_of_text
-                formatted += f"<|start_header_id|>system<|end_header_id|>\n\n{msg.content}<|eot_id|>"
-        elif msg.role == "user":
-            formatted += f"<|start_header_id|>user<|end_header_id|>\n\n{msg.content}<|eot_id|>"
-            is_first_message = False
-        elif msg.role == "assistant":
-            formatted += f"<|start_header_id|>assistant<|end_header_id|>\n\n{msg.content}<|eot_id|>"
-            is_first_message = False
+    Returns:
+        Token list for llama-cpp-python, None when the backend needs the text
+    """
+    if context_assembler is None or USE_CTRANSFORMERS or not context_assembler.counter.bos_ids:
+        return None
+    return builder.token_ids(context_assembler.counter)
+
+
+def conversation_state_resumable(
+    stored_history: List[dict],
+    selected_history: List[dict],
+    request_messages: List[ChatMessage],
+    journey_messages: List[ChatMessage]
+) -> bool:
+    """
+    Whether the next turn's prompt will start with this turn's prompt up to its user message
     
-    # Add assistant header for response
-    formatted += "<|start_header_id|>assistant<|end_header_id|>\n\n"
-    return formatted
+    Only user messages are stored, so the next prompt is the system prompt, the stored
+    history and this turn's user messages. Anything else (journey data, assistant turns,
+    history trimmed to fit or about to slide out of the history window) makes it diverge
+    early, and a saved model state would never be reused.
+    """
+    return (
+        not journey_messages
+        and all(msg.role == "user" for msg in request_messages)
+        and len(selected_history) == len(stored_history)
+        and len(stored_history) + len(request_messages) <= CONVERSATION_HISTORY_LIMIT
+    )
+
+
+def count_prompt_tokens(segments: List[str]) -> int:
+    """Prompt tokens from cached per-segment counts (word count if no tokenizer is loaded)"""
+    if context_assembler is None:
+        return len("".join(segments).split())
+    return context_assembler.counter.count_prompt(segments)
+
+
+def build_usage(prompt_tokens: int, completion_tokens: int) -> dict:
+    """OpenAI-style usage block"""
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+
+
+def get_sampling_params(request) -> dict:
+    """Extract the generation parameters shared by ChatRequest and CompletionRequest"""
+    return {
+        "max_tokens": request.max_tokens,
+        "temperature": request.temperature,
+        "top_p": request.top_p,
+        "top_k": request.top_k,
+        "repeat_penalty": request.repeat_penalty,
+        "stop": request.stop,
+    }
+
+
+def format_sse_event(payload) -> str:
+    """Serialize a payload as a server-sent event (OpenAI streaming wire format)"""
+    if isinstance(payload, str):
+        return f"data: {payload}\n\n"
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+async def stream_completion_events(
+    prompt: str,
+    request,
+    completion_id: str,
+    object_type: str,
+    final_extra: Optional[dict] = None,
+    cache_key: Optional[str] = None,
+    save_state: bool = False,
+    ticket: Optional[AdmissionTicket] = None,
+    prompt_tokens: Optional[int] = None,
+    prompt_ids: Optional[List[int]] = None,
+    on_complete: Optional[Callable[[str, dict], Optional[Awaitable[None]]]] = None
+) -> AsyncIterator[str]:
+    """
+    Stream generated tokens as OpenAI-compatible SSE chunks
+    
+    Args:
+        prompt: Fully formatted prompt to generate from
+        request: ChatRequest or CompletionRequest with sampling parameters
+        completion_id: ID shared by every chunk of this completion
+        object_type: "chat.completion.chunk" or "text_completion"
+        final_extra: Extra fields (e.g. map_image_url) attached to the final chunk
+        cache_key: Conversation owner whose cached model state may be reused
+        save_state: Keep the model state for the owner's next turn
+        ticket: Admission slot released as soon as generation ends
+        prompt_tokens: Prompt token count (counted from the prompt if omitted)
+        prompt_ids: Prompt already tokenized for llama-cpp-python
+        on_complete: Called with (text, usage) once generation finished without error
+    
+    Yields:
+        Encoded SSE events, terminated by "data: [DONE]"
+    """
+    created = int(time.time())
+    is_chat = object_type == "chat.completion.chunk"
+    
+    def make_chunk(text: Optional[str], finish_reason: Optional[str] = None, role: Optional[str] = None) -> dict:
+        if is_chat:
+            delta = {}
+            if role:
+                delta["role"] = role
+            if text is not None:
+                delta["content"] = text
+            choice = {"index": 0, "delta": delta, "finish_reason": finish_reason}
+        else:
+            choice = {"index": 0, "text": text or "", "finish_reason": finish_reason}
+        return {
+            "id": completion_id,
+            "object": object_type,
+            "created": created,
+            "model": "llama-3.2-3b-instruct",
+            "choices": [choice]
+        }
+    
+    if is_chat:
+        yield format_sse_event(make_chunk(None, role="assistant"))
+    
+    pieces = []
+    generation = inference_pool.stream(
+        prompt,
+        cache_key=cache_key,
+        save_state=save_state,
+        prompt_ids=prompt_ids,
+        **get_sampling_params(request)
+    )
+    try:
+        async for piece in generation:
+            pieces.append(piece)
+            yield format_sse_event(make_chunk(piece))
+    except Exception as e:
+        logger.error(f"Error streaming completion: {e}")
+        yield format_sse_event({"error": {"message": str(e), "type": "server_error"}})
+        yield format_sse_event("[DONE]")
+        return
+    finally:
+        if ticket:
+            ticket.release()
+    
+    # Token counts reported by the backend (or a model worker) take precedence
+    if generation.result.prompt_tokens is not None:
+        prompt_tokens = generation.result.prompt_tokens
+    elif prompt_tokens is None:
+        prompt_tokens = count_prompt_tokens([prompt])
+    
+    final_chunk = make_chunk(None, finish_reason="stop")
+    final_chunk["usage"] = build_usage(prompt_tokens, generation.result.completion_tokens)
+    final_chunk["timings"] = generation.result.timings()
+    if on_complete:
+        stored = on_complete(generation.result.text, final_chunk["usage"])
+        if stored is not None:
+            await stored
+    if final_extra:
+        final_chunk.update(final_extra)
+    yield format_sse_event(final_chunk)
+    yield format_sse_event("[DONE]")
+
+
+def cached_chat_response(cached: dict, extra: dict) -> dict:
+    """chat.completion body for an answer served from the response cache"""
+    return {
+        "id": cached["id"],
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "llama-3.2-3b-instruct",
+        "choices": [{
+            "index": 0,
+            "message": {
+                "role": "assistant",
+                "content": cached["content"]
+            },
+            "finish_reason": "stop"
+        }],
+        "usage": cached["usage"],
+        "timings": None,
+        "cached": True,
+        **extra
+    }
+
+
+async def cached_completion_events(
+    object_type: str,
+    completion_id: str,
+    text: str,
+    usage: dict,
+    extra: Optional[dict] = None
+) -> AsyncIterator[str]:
+    """A cached answer as SSE chunks (one content chunk), in the same format as a live stream"""
+    created = int(time.time())
+    is_chat = object_type == "chat.completion.chunk"
+    
+    def make_chunk(content: Optional[str], finish_reason: Optional[str] = None, role: Optional[str] = None) -> dict:
+        if is_chat:
+            delta = {"role": role} if role else {}
+            if content is not None:
+                delta["content"] = content
+            choice = {"index": 0, "delta": delta, "finish_reason": finish_reason}
+        else:
+            choice = {"index": 0, "text": content or "", "finish_reason": finish_reason}
+        return {
+            "id": completion_id,
+            "object": object_type,
+            "created": created,
+            "model": "llama-3.2-3b-instruct",
+            "choices": [choice]
+        }
+    
+    if is_chat:
+        yield format_sse_event(make_chunk(None, role="assistant"))
+    yield format_sse_event(make_chunk(text))
+    final_chunk = make_chunk(None, finish_reason="stop")
+    final_chunk.update(usage=usage, timings=None, cached=True, **(extra or {}))
+    yield format_sse_event(final_chunk)
+    yield format_sse_event("[DONE]")
+
+
+def event_stream_response(
+    events: AsyncIterator[str],
+    ticket: Optional[AdmissionTicket],
+    background_tasks: Optional[BackgroundTasks] = None
+) -> StreamingResponse:
+    """Wrap SSE events in a response; background tasks run after the stream (and free the slot if it never started)"""
+    background = background_tasks or BackgroundTasks()
+    if ticket:
+        background.add_task(ticket.release)
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        background=background
+    )
+
+
+async def acquire_generation_slot() -> Optional[AdmissionTicket]:
+    """Admit a generation request or reject it fast with 429 and Retry-After"""
+    if admission is None:
+        return None
+    try:
+        return await admission.acquire()
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected generation request: {e}")
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
 
 
 @app.get("/")
 async def root():
     """Health check endpoint"""
-    model_loaded = llm_model is not None
+    model_loaded = inference_pool is not None
     return {
         "status": "running",
         "model_loaded": model_loaded,
         "model_path": MODEL_PATH,
-        "library": "ctransformers" if USE_CTRANSFORMERS else "llama-cpp-python"
+        "library": (
+            "model-workers" if isinstance(inference_pool, RemoteInferencePool)
+            else "ctransformers" if USE_CTRANSFORMERS else "llama-cpp-python"
+        )
     }
 
 
 @app.get("/health")
 async def health():
     """Health check endpoint"""
-    model_loaded = llm_model is not None
+    workers = None
+    if isinstance(inference_pool, RemoteInferencePool):
+        # Ready as soon as one model worker is; warming while any is still loading
+        workers = await inference_pool.health()
+        apply_worker_handshake()
+        statuses = {worker["status"] for worker in workers}
+        model_loaded = "ready" in statuses
+        warming = not model_loaded and bool(statuses & {"loading", "warming"})
+    else:
+        model_loaded = inference_pool is not None
+        warming = model_loaded and not model_warmup.ready
+    status = {
+        "status": "warming" if warming else "healthy" if model_loaded else "unhealthy",
+        "model_loaded": model_loaded,
+        "model_pool": inference_pool.occupancy() if inference_pool else None,
+        "queue_depth": admission.queued if admission else 0
+    }
+    if workers is not None:
+        status["model_workers"] = workers
+    if warming:
+        # Not ready for traffic until the weights are paged in
+        return JSONResponse(status_code=503, content=status)
+    return status
+
+
+@app.get("/metrics")
+async def metrics():
+    """Cache and inference metrics for monitoring"""
+    pool = inference_pool
     return {
-        "status": "healthy" if model_loaded else "unhealthy",
-        "model_loaded": model_loaded
+        "inference": pool.stats.snapshot() if pool else None,
+        "queue_depth": pool.pending if pool else 0,
+        "admission": admission.stats() if admission else None,
+        "warmup": model_warmup.stats(),
+        "model_pool": pool.occupancy() if pool else None,
+        "process_memory": memory_report(None if MODEL_WORKER_SOCKETS else MODEL_PATH),
+        "directions_cache": directions_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "completion_cache": completion_cache.stats(),
+        "conversation_write_buffer": write_buffer.stats(),
+        "conversation_history_cache": history_cache.stats(),
+        "context_assembler": context_assembler.stats() if context_assembler else None,
+        "prefix_cache": pool.prefix_cache.stats() if pool and pool.prefix_cache else None,
+        "conversation_state_cache": (
+            pool.conversation_cache.stats() if pool and pool.conversation_cache else None
+        )
     }
 
 
 @app.post("/v1/chat/completions")
-async def chat_completions(request: ChatRequest, current_user: dict = Depends(get_current_user)):
+async def chat_completions(
+    request: ChatRequest,
+    background_tasks: BackgroundTasks,
+    current_user: dict = Depends(get_current_user)
+):
     """Chat completions endpoint compatible with OpenAI API (requires authentication)"""
-    if llm_model is None:
+    if inference_pool is None:
         raise HTTPException(status_code=503, detail="Model not loaded")
     
+    ticket = None
     try:
         user_email = current_user.get("email")
         
-        # Retrieve conversation history from MongoDB
-        history = await get_conversation_history(user_email)
+        user_messages = [msg.content for msg in request.messages if msg.role == "user"]
         
-        # Combine history with current request messages
-        # History is already in chronological order (oldest first)
-        all_messages = []
+        # Retrieve conversation history and Google Maps journey data concurrently
+        enrichment = await gather_enrichment(user_email, user_messages)
+        
+        # Store the user's current message(s) after the response is sent
+        for content in user_messages:
+            background_tasks.add_task(store_message, user_email, "user", content)
         
         # Add travel agent system prompt at the beginning
         system_prompt = get_travel_agent_prompt()
-        all_messages.append(ChatMessage(
-            role="system",
-            content=system_prompt
-        ))
-        
-        # Add historical messages
-        for hist_msg in history:
-            all_messages.append(ChatMessage(
-                role=hist_msg["role"],
-                content=hist_msg["content"]
-            ))
-        
-        # Check if user message contains location information
-        journey_info = None
-        map_image_url = None
-        detected_origin = None
-        detected_destination = None
-        
-        for msg in request.messages:
-            if msg.role == "user":
-                # Try to extract origin and destination
-                origin, destination = extract_locations_from_text(msg.content)
-                
-                if origin and destination:
-                    # Store for later use
-                    detected_origin = origin
-                    detected_destination = destination
-                    
-                    # Fetch journey information from Google Maps
-                    logger.info(f"Detected journey request: {origin} to {destination}")
-                    journey_info = format_journey_summary(origin, destination)
-                    
-                    # Generate map image URL
-                    map_image_url = generate_map_image_url(origin, destination)
-                    
-                    if journey_info:
-                        # Add journey information as a system message before user's message
-                        all_messages.append(ChatMessage(
-                            role="system",
-                            content=f"[JOURNEY DATA FROM GOOGLE MAPS]\n{journey_info}\n[Use this information to provide a helpful travel summary to the user]"
-                        ))
-                        logger.info("Successfully retrieved journey information from Google Maps")
-                    else:
-                        logger.warning("Failed to retrieve journey information from Google Maps")
+        
+        journey_messages = []
+        for journey in enrichment.journeys:
+            journey_info = journey.summary
+            if journey_info:
+                # Add journey information as a system message before user's message
+                journey_messages.append(ChatMessage(
+                    role="system",
+                    content=f"[JOURNEY DATA FROM GOOGLE MAPS]\n{journey_info}\n[Use this information to provide a helpful travel summary to the user]"
+                ))
+                logger.info("Successfully retrieved journey information from Google Maps")
+            else:
+                logger.warning("Failed to retrieve journey information from Google Maps")
+        
+        # Map image URL comes from the same directions result as the summary
+        journey = enrichment.journey
+        map_image_url = journey.map_image_url() if journey else None
+        journey_details = {
+            "origin": journey.origin,
+            "destination": journey.destination
+        } if journey else None
+        journey_extra = {"map_image_url": map_image_url, "journey_details": journey_details}
+        
+        # First-turn answers are shared between users; a hit needs no generation slot
+        response_key = response_cache.key_for(
+            user_messages,
+            enrichment.history,
+            enrichment.journeys,
+            get_sampling_params(request),
+            has_assistant_turns=any(msg.role == "assistant" for msg in request.messages)
+        )
+        cached = response_cache.get(response_key) if response_key else None
+        if cached is not None:
+            if request.stream:
+                events = cached_completion_events(
+                    "chat.completion.chunk", cached["id"], cached["content"], cached["usage"], journey_extra
+                )
+                return event_stream_response(events, None, background_tasks)
+            return cached_chat_response(cached, journey_extra)
+        
+        ticket = await acquire_generation_slot()
+        
+        # Keep as much recent history as fits next to everything else in N_CTX
+        history = enrichment.history
+        fixed_messages = [("system", system_prompt)] + [
+            (msg.role, msg.content) for msg in journey_messages + list(request.messages)
+        ]
+        if context_assembler is not None:
+            history = context_assembler.select_history(history, fixed_messages, request.max_tokens or 0)
+        elif isinstance(inference_pool, RemoteInferencePool) and history:
+            # The lean process has no tokenizer; a model worker counts tokens
+            history = await inference_pool.select_history(history, fixed_messages, request.max_tokens or 0)
+        
+        # Combine history with current request messages
+        # History is already in chronological order (oldest first)
+        all_messages = [ChatMessage(role="system", content=system_prompt)]
+        all_messages.extend(
+            ChatMessage(role=hist_msg["role"], content=hist_msg["content"])
+            for hist_msg in history
+        )
+        all_messages.extend(journey_messages)
         
         # Add current request messages
         all_messages.extend(request.messages)
         
-        # Store the user's current message(s) in the database
-        for msg in request.messages:
-            if msg.role == "user":
-                await store_message(user_email, "user", msg.content)
-        
         # Format messages for Llama-3.2-Instruct
-        prompt = format_messages_for_llama(all_messages)
-        
-        # Generate response
-        if USE_CTRANSFORMERS:
-            # ctransformers uses max_new_tokens
-            generation_kwargs = {
-                "max_new_tokens": request.max_tokens,
-                "temperature": request.temperature,
-                "top_p": request.top_p,
-                "top_k": request.top_k,
-                "repetition_penalty": request.repeat_penalty,
-            }
-            if request.stop:
-                generation_kwargs["stop"] = request.stop
-            
-            response_text = llm_model(
+        builder = PromptBuilder().add_messages(all_messages).finish()
+        prompt = builder.text
+        # System prompt and history segments are already tokenized, so this is nearly free
+        prompt_ids = prompt_token_ids(builder)
+        prompt_tokens = len(prompt_ids) if prompt_ids is not None else count_prompt_tokens(builder.segments)
+        completion_id = "chatcmpl-" + str(hash(prompt))
+        save_state = conversation_state_resumable(
+            enrichment.history, history, list(request.messages), journey_messages
+        )
+        
+        def cache_response(content: str, usage: dict):
+            if response_key is not None:
+                response_cache.put(response_key, {"id": completion_id, "content": content, "usage": usage})
+        
+        if request.stream:
+            # Map and journey payload ride on the final chunk so tokens start flowing immediately
+            events = stream_completion_events(
                 prompt,
-                **generation_kwargs
+                request,
+                completion_id=completion_id,
+                object_type="chat.completion.chunk",
+                final_extra=dict(journey_extra, cached=False),
+                cache_key=user_email.lower(),
+                save_state=save_state,
+                ticket=ticket,
+                prompt_tokens=prompt_tokens,
+                prompt_ids=prompt_ids,
+                on_complete=cache_response
             )
-        else:
-            # llama-cpp-python uses max_tokens (not max_new_tokens)
-            # and uses create_completion method which returns a Completion object
-            response = llm_model.create_completion(
-                prompt=prompt,
-                max_tokens=request.max_tokens,
-                temperature=request.temperature,
-                top_p=request.top_p,
-                top_k=request.top_k,
-                repeat_penalty=request.repeat_penalty,
-                stop=request.stop if request.stop else [],
-            )
-            response_text = response["choices"][0]["text"]
+            events_ticket, ticket = ticket, None  # Released by the stream once generation ends
+            return event_stream_response(events, events_ticket, background_tasks)
+        
+        # Generate response on the inference thread so the event loop stays responsive
+        result = await inference_pool.generate(
+            prompt,
+            cache_key=user_email.lower(),
+            save_state=save_state,
+            prompt_ids=prompt_ids,
+            **get_sampling_params(request)
+        )
         
         # Clean up response (remove the prompt if it was included)
-        if response_text.startswith(prompt):
-            response_text = response_text[len(prompt):].strip()
+        response_text = strip_prompt_echo(result.text, len(prompt))
         
         # Note: Only user messages are stored in conversation history
         # Assistant responses are NOT stored to save database space
         
-        # Calculate usage (approximate)
-        prompt_tokens = len(prompt.split())
-        completion_tokens = len(response_text.split())
+        # Token counts reported by the backend take precedence over our own count
+        if result.prompt_tokens is not None:
+            prompt_tokens = result.prompt_tokens
+        usage = build_usage(prompt_tokens, result.completion_tokens)
+        cache_response(response_text, usage)
         
         return {
-            "id": "chatcmpl-" + str(hash(prompt)),
+            "id": completion_id,
             "object": "chat.completion",
-            "created": int(__import__("time").time()),
+            "created": int(time.time()),
             "model": "llama-3.2-3b-instruct",
             "choices": [{
                 "index": 0,
@@ -461,84 +729,112 @@ async def chat_completions(request: ChatRequest, current_user: dict = Depends(ge
                 },
                 "finish_reason": "stop"
             }],
-            "usage": {
-                "prompt_tokens": prompt_tokens,
-                "completion_tokens": completion_tokens,
-                "total_tokens": prompt_tokens + completion_tokens
-            },
+            "usage": usage,
+            "timings": result.timings(),
+            "cached": False,
             # Include map image URL if journey was detected
             "map_image_url": map_image_url,
-            "journey_details": {
-                "origin": detected_origin,
-                "destination": detected_destination
-            } if detected_origin and detected_destination else None
+            "journey_details": journey_details
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error generating chat completion: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if ticket:
+            ticket.release()
 
 
 @app.post("/v1/completions")
 async def completions(request: CompletionRequest, current_user: dict = Depends(get_current_user)):
     """Text completions endpoint (requires authentication)"""
-    if llm_model is None:
+    if inference_pool is None:
         raise HTTPException(status_code=503, detail="Model not loaded")
     
+    completion_id = "cmpl-" + str(hash(request.prompt))
+    sampling = get_sampling_params(request)
+    # Generations report the workers' model identity, so a swap is picked up here
+    apply_worker_handshake()
+    
+    # Deterministic repeats are answered from the cache without a generation slot
+    cache_key = completion_cache.key_for(request.prompt, sampling)
+    cached = await completion_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        usage = build_usage(cached["prompt_tokens"], cached["completion_tokens"])
+        if request.stream:
+            return event_stream_response(
+                cached_completion_events("text_completion", completion_id, cached["text"], usage),
+                None
+            )
+        return {
+            "id": completion_id,
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": "llama-3.2-3b-instruct",
+            "choices": [{
+                "index": 0,
+                "text": cached["text"],
+                "finish_reason": "stop"
+            }],
+            "usage": usage,
+            "timings": None,
+            "cached": True
+        }
+    
+    def cache_completion(text: str, usage: dict) -> Optional[Awaitable[None]]:
+        if cache_key is None:
+            return None
+        return completion_cache.put(cache_key, text, usage["completion_tokens"], usage["prompt_tokens"])
+    
+    ticket = await acquire_generation_slot()
     try:
-        # Generate response
-        if USE_CTRANSFORMERS:
-            # ctransformers uses max_new_tokens
-            generation_kwargs = {
-                "max_new_tokens": request.max_tokens,
-                "temperature": request.temperature,
-                "top_p": request.top_p,
-                "top_k": request.top_k,
-                "repetition_penalty": request.repeat_penalty,
-            }
-            if request.stop:
-                generation_kwargs["stop"] = request.stop
-            
-            response_text = llm_model(
+        if request.stream:
+            events = stream_completion_events(
                 request.prompt,
-                **generation_kwargs
-            )
-        else:
-            # llama-cpp-python uses max_tokens (not max_new_tokens)
-            # and uses create_completion method which returns a Completion object
-            response = llm_model.create_completion(
-                prompt=request.prompt,
-                max_tokens=request.max_tokens,
-                temperature=request.temperature,
-                top_p=request.top_p,
-                top_k=request.top_k,
-                repeat_penalty=request.repeat_penalty,
-                stop=request.stop if request.stop else [],
+                request,
+                completion_id=completion_id,
+                object_type="text_completion",
+                ticket=ticket,
+                final_extra={"cached": False},
+                on_complete=cache_completion
             )
-            response_text = response["choices"][0]["text"]
+            events_ticket, ticket = ticket, None  # Released by the stream once generation ends
+            return event_stream_response(events, events_ticket)
+        
+        # Generate response on the inference thread so the event loop stays responsive
+        result = await inference_pool.generate(request.prompt, **sampling)
+        response_text = result.text
         
-        # Calculate usage (approximate)
-        prompt_tokens = len(request.prompt.split())
-        completion_tokens = len(response_text.split())
+        # Token counts reported by the backend take precedence over our own count
+        prompt_tokens = result.prompt_tokens
+        if prompt_tokens is None:
+            prompt_tokens = count_prompt_tokens([request.prompt])
+        usage = build_usage(prompt_tokens, result.completion_tokens)
+        stored = cache_completion(response_text, usage)
+        if stored is not None:
+            await stored
         
         return {
-            "id": "cmpl-" + str(hash(request.prompt)),
+            "id": completion_id,
             "object": "text_completion",
-            "created": int(__import__("time").time()),
+            "created": int(time.time()),
             "model": "llama-3.2-3b-instruct",
             "choices": [{
                 "index": 0,
                 "text": response_text,
                 "finish_reason": "stop"
             }],
-            "usage": {
-                "prompt_tokens": prompt_tokens,
-                "completion_tokens": completion_tokens,
-                "total_tokens": prompt_tokens + completion_tokens
-            }
+            "usage": usage,
+            "timings": result.timings(),
+            "cached": False
         }
     except Exception as e:
         logger.error(f"Error generating completion: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if ticket:
+            ticket.release()
 
 
 
@@ -578,13 +874,9 @@ async def generate_map(request: MapRequest, current_user: dict = Depends(get_cur
                     detail="Zoom level must be between 1 and 21"
                 )
         
-        # Generate map image URL
-        map_url = generate_map_image_url(
-            origin=request.origin,
-            destination=request.destination,
-            size=request.size,
-            zoom=request.zoom
-        )
+        # Generate map image URL (directions come from the shared cache)
+        journey = await resolve_journey_cached(request.origin, request.destination)
+        map_url = journey.map_image_url(size=request.size, zoom=request.zoom)
         
         if not map_url:
             raise HTTPException(
@@ -618,6 +910,11 @@ async def clear_conversations(current_user: dict = Depends(get_current_user)):
         user_email = current_user.get("email")
         success = await clear_conversation_history(user_email)
         
+        if isinstance(inference_pool, RemoteInferencePool):
+            await inference_pool.invalidate_conversation(user_email.lower())
+        elif inference_pool and inference_pool.conversation_cache:
+            inference_pool.conversation_cache.invalidate(user_email.lower())
+        
         if success:
             return {
                 "status": "success",
@@ -0,0 +1,174 @@
+"""
+Asyncio-native Google Maps web service client
+Replaces the blocking googlemaps.Client: one persistent httpx.AsyncClient keeps
+connections alive (HTTP/2 when the h2 package is installed), every call has a
+timeout, and transient failures are retried with jittered exponential backoff.
+"""
+import asyncio
+import logging
+import os
+import random
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Configuration from environment variables
+GOOGLE_MAPS_BASE_URL = os.getenv("GOOGLE_MAPS_BASE_URL", "https://maps.googleapis.com")
+MAPS_TIMEOUT_SECONDS = float(os.getenv("MAPS_TIMEOUT_SECONDS", "10"))
+MAPS_MAX_RETRIES = int(os.getenv("MAPS_MAX_RETRIES", "2"))
+MAPS_MAX_CONNECTIONS = int(os.getenv("MAPS_MAX_CONNECTIONS", "20"))
+
+# HTTP statuses and API statuses worth retrying
+RETRY_HTTP_STATUSES = {429, 500, 502, 503, 504}
+RETRY_API_STATUSES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR"}
+
+
+class MapsApiError(Exception):
+    """Raised when the Maps API answers with an error status"""
+
+    def __init__(self, status: str, message: Optional[str] = None):
+        super().__init__(f"{status}: {message}" if message else status)
+        self.status = status
+
+
+class MapsClient:
+    """
+    Google Maps Directions / Distance Matrix client on a shared httpx.AsyncClient
+    
+    Mirrors the googlemaps.Client surface used by this service: directions()
+    returns the list of routes and distance_matrix() returns the response body.
+    """
+    
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = GOOGLE_MAPS_BASE_URL,
+        timeout: float = MAPS_TIMEOUT_SECONDS,
+        max_retries: int = MAPS_MAX_RETRIES,
+        max_connections: int = MAPS_MAX_CONNECTIONS,
+        backoff_base: float = 0.25
+    ):
+        self.api_key = api_key
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=timeout,
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections
+            )
+        )
+    
+    async def _request(self, path: str, params: Dict, timeout: Optional[float] = None) -> Dict:
+        """
+        GET a Maps web service endpoint, retrying transient failures
+        
+        Returns:
+            Decoded JSON body with status OK or ZERO_RESULTS
+        
+        Raises:
+            MapsApiError: If the API answers with a non-retryable error status
+            httpx.HTTPError: If the request still fails after all retries
+        """
+        params = dict(params, key=self.api_key)
+        request_timeout = timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT
+        
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                response = await self._client.get(path, params=params, timeout=request_timeout)
+            except httpx.TransportError as e:
+                if last_attempt:
+                    raise
+                logger.warning(f"Maps request to {path} failed ({e!r}), retrying")
+                await self._backoff(attempt)
+                continue
+            
+            if response.status_code in RETRY_HTTP_STATUSES and not last_attempt:
+                logger.warning(f"Maps request to {path} returned HTTP {response.status_code}, retrying")
+                await self._backoff(attempt)
+                continue
+            response.raise_for_status()
+            body = response.json()
+            
+            status = body.get("status", "OK")
+            if status in ("OK", "ZERO_RESULTS"):
+                return body
+            if status in RETRY_API_STATUSES and not last_attempt:
+                logger.warning(f"Maps request to {path} returned {status}, retrying")
+                await self._backoff(attempt)
+                continue
+            raise MapsApiError(status, body.get("error_message"))
+        
+        raise MapsApiError("UNKNOWN_ERROR", "retries exhausted")
+    
+    async def _backoff(self, attempt: int):
+        """Sleep with full-jitter exponential backoff"""
+        await asyncio.sleep(random.uniform(0, self.backoff_base * (2 ** attempt)))
+    
+    async def directions(
+        self,
+        origin: str,
+        destination: str,
+        mode: str = "driving",
+        departure_time: Optional[datetime] = None,
+        alternatives: bool = False,
+        traffic_model: Optional[str] = None,
+        timeout: Optional[float] = None
+    ) -> List[Dict]:
+        """
+        Call the Directions API
+        
+        Returns:
+            List of route dictionaries (empty if no route was found)
+        """
+        params = {"origin": origin, "destination": destination, "mode": mode}
+        if departure_time is not None:
+            params["departure_time"] = int(departure_time.timestamp())
+        if alternatives:
+            params["alternatives"] = "true"
+        if traffic_model and mode == "driving":
+            params["traffic_model"] = traffic_model
+        body = await self._request("/maps/api/directions/json", params, timeout=timeout)
+        return body.get("routes", [])
+    
+    async def distance_matrix(
+        self,
+        origins: List[str],
+        destinations: List[str],
+        mode: str = "driving",
+        departure_time: Optional[datetime] = None,
+        traffic_model: Optional[str] = None,
+        timeout: Optional[float] = None
+    ) -> Dict:
+        """
+        Call the Distance Matrix API
+        
+        Returns:
+            Response body with origin_addresses, destination_addresses and rows
+        """
+        params = {
+            "origins": "|".join(origins),
+            "destinations": "|".join(destinations),
+            "mode": mode,
+        }
+        if departure_time is not None:
+            params["departure_time"] = int(departure_time.timestamp())
+        if traffic_model and mode == "driving":
+            params["traffic_model"] = traffic_model
+        return await self._request("/maps/api/distancematrix/json", params, timeout=timeout)
+    
+    async def aclose(self):
+        """Close the pooled connections"""
+        await self._client.aclose()
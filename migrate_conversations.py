@@ -0,0 +1,108 @@
+"""
+Migrate conversation history between storage layouts
+
+messages -> session: groups conversation_history by user, keeps the newest
+CONVERSATION_HISTORY_LIMIT messages and upserts one conversation_sessions document
+per user. session -> messages: expands session documents back into one document per
+message. Both directions are idempotent; the source collection is left untouched
+unless --drop-source is given.
+
+Usage:
+    python migrate_conversations.py --to session [--drop-source]
+    python migrate_conversations.py --to messages [--drop-source]
+
+Set CONVERSATION_STORAGE_LAYOUT to the new layout and restart the server afterwards.
+"""
+import argparse
+import asyncio
+import logging
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from pymongo import ReplaceOne
+
+from conversation_memory import CONVERSATION_HISTORY_LIMIT
+from database import connect_to_mongo, close_mongo_connection, get_database
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+async def migrate_to_session(db) -> int:
+    """Build one session document per user from per-message documents"""
+    pipeline = [
+        {"$sort": {"timestamp": 1}},
+        {"$group": {
+            "_id": "$user_email",
+            "messages": {"$push": {
+                "id": "$_id", "role": "$role", "content": "$content", "timestamp": "$timestamp"
+            }},
+            "last_activity": {"$max": "$created_at"},
+        }},
+        {"$project": {"messages": {"$slice": ["$messages", -CONVERSATION_HISTORY_LIMIT]}, "last_activity": 1}},
+    ]
+    migrated = 0
+    batch = []
+    async for session in db.conversation_history.aggregate(pipeline, allowDiskUse=True):
+        batch.append(ReplaceOne({"_id": session["_id"]}, session, upsert=True))
+        if len(batch) >= BATCH_SIZE:
+            await db.conversation_sessions.bulk_write(batch, ordered=False)
+            migrated += len(batch)
+            batch = []
+    if batch:
+        await db.conversation_sessions.bulk_write(batch, ordered=False)
+        migrated += len(batch)
+    return migrated
+
+
+async def migrate_to_messages(db) -> int:
+    """Expand session documents into one document per message"""
+    migrated = 0
+    async for session in db.conversation_sessions.find({}):
+        docs = [
+            {
+                "user_email": session["_id"],
+                "role": message["role"],
+                "content": message["content"],
+                "timestamp": message["timestamp"],
+                "created_at": message["timestamp"],
+            }
+            for message in session.get("messages", [])
+        ]
+        # Replace the user's messages so re-running the migration does not duplicate them
+        await db.conversation_history.delete_many({"user_email": session["_id"]})
+        if docs:
+            await db.conversation_history.insert_many(docs, ordered=False)
+        migrated += 1
+    return migrated
+
+
+async def main(target: str, drop_source: bool):
+    if not await connect_to_mongo():
+        raise SystemExit("Could not connect to MongoDB")
+    db = get_database()
+    try:
+        if target == "session":
+            count = await migrate_to_session(db)
+            source = "conversation_history"
+        else:
+            count = await migrate_to_messages(db)
+            source = "conversation_sessions"
+        logger.info(f"Migrated {count} users to the '{target}' layout")
+        if drop_source:
+            await db[source].drop()
+            logger.info(f"Dropped {source}")
+    finally:
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate conversation history storage layout")
+    parser.add_argument("--to", choices=["session", "messages"], required=True)
+    parser.add_argument("--drop-source", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args.to, args.drop_source))
@@ -0,0 +1,374 @@
+"""
+GGUF model loading for the ctransformers and llama-cpp-python backends
+
+The backend configuration that loaded a model file is recorded in a small manifest
+next to it, so later boots load directly instead of trying every configuration.
+Regenerate it offline with:
+    python model_loader.py --probe [--model-path PATH]
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Backend libraries are imported on first use (detect_backends), so processes that
+# never load a model (the lean API process) do not pay for importing them
+USE_CTRANSFORMERS = None
+ctransformers_available = False
+llama_cpp_available = False
+AutoModelForCausalLM = None
+Llama = None
+_backends_detected = False
+
+
+def detect_backends() -> bool:
+    """
+    Import the installed backend libraries (once)
+
+    Returns:
+        True if ctransformers should be tried first, False for llama-cpp-python
+
+    Raises:
+        ImportError: If neither library is installed
+    """
+    global USE_CTRANSFORMERS, ctransformers_available, llama_cpp_available
+    global AutoModelForCausalLM, Llama, _backends_detected
+    if _backends_detected:
+        return USE_CTRANSFORMERS
+
+    try:
+        from ctransformers import AutoModelForCausalLM
+        ctransformers_available = True
+        logger.info("ctransformers library is available")
+    except ImportError:
+        logger.warning("ctransformers not available")
+
+    try:
+        from llama_cpp import Llama
+        llama_cpp_available = True
+        logger.info("llama-cpp-python library is available")
+    except (ImportError, ValueError, Exception) as e:
+        logger.warning(f"llama-cpp-python not available: {e}")
+        llama_cpp_available = False
+
+    # Prefer ctransformers, but allow fallback
+    if ctransformers_available:
+        USE_CTRANSFORMERS = True
+        logger.info("Will try to use ctransformers first")
+    elif llama_cpp_available:
+        USE_CTRANSFORMERS = False
+        logger.info("Will use llama-cpp-python")
+    else:
+        raise ImportError(
+            "Neither ctransformers nor llama-cpp-python is installed.\n"
+            "Install one of them:\n"
+            "  pip install ctransformers\n"
+            "  OR\n"
+            "  pip install llama-cpp-python --extra-index-url https://abetlen.github.io/llama-cpp-python/whl/cpu"
+        )
+    _backends_detected = True
+    return USE_CTRANSFORMERS
+
+
+# Configuration
+MODEL_PATH = os.getenv("MODEL_PATH", "Llama-3.2-3B-Instruct-Q8_0.gguf")
+# Convert to absolute path if relative
+if not os.path.isabs(MODEL_PATH):
+    MODEL_PATH = os.path.abspath(MODEL_PATH)
+N_CTX = int(os.getenv("N_CTX", "2048"))
+N_THREADS = int(os.getenv("N_THREADS", "4"))
+N_GPU_LAYERS = int(os.getenv("N_GPU_LAYERS", "0"))
+# Number of independent model instances; they share the mmap'd GGUF weights
+MODEL_POOL_SIZE = max(1, int(os.getenv("MODEL_POOL_SIZE", "1")))
+# Lock the mmap'd weights in RAM so they are never paged out (needs RLIMIT_MEMLOCK)
+MODEL_MLOCK = os.getenv("MODEL_MLOCK", "false").lower() == "true"
+# Backend manifest location ("" disables it); defaults to <MODEL_PATH>.backend.json
+MODEL_MANIFEST_PATH = os.getenv("MODEL_MANIFEST_PATH")
+# Leading bytes of the GGUF file hashed into the fingerprint (header and metadata)
+MANIFEST_HEADER_BYTES = 1024 * 1024
+MANIFEST_VERSION = 1
+
+
+def manifest_path() -> Optional[str]:
+    """Where the backend manifest for MODEL_PATH lives, None if disabled"""
+    if MODEL_MANIFEST_PATH is not None:
+        return MODEL_MANIFEST_PATH or None
+    return f"{MODEL_PATH}.backend.json"
+
+
+def model_fingerprint(path: str) -> dict:
+    """
+    Identify a model file cheaply: size, mtime and a hash of its header
+
+    Args:
+        path: GGUF model file
+
+    Returns:
+        Dict compared against the fingerprint stored in the manifest
+    """
+    stat = os.stat(path)
+    with open(path, "rb") as f:
+        header_hash = hashlib.sha256(f.read(MANIFEST_HEADER_BYTES)).hexdigest()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "header_sha256": header_hash}
+
+
+def model_identity(model_path: str, backend: str) -> str:
+    """Model file (name, size, mtime) and backend; results cached for one model are not reused for another"""
+    try:
+        stat = os.stat(model_path)
+        return f"{os.path.basename(model_path)}|{stat.st_size}|{stat.st_mtime_ns}|{backend}"
+    except OSError:
+        return f"{os.path.basename(model_path)}|{backend}"
+
+
+def read_manifest() -> Optional[dict]:
+    """
+    Backend configuration recorded for the current model file
+
+    Returns:
+        The configuration, or None if there is no manifest or the file changed
+    """
+    path = manifest_path()
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+        if manifest.get("version") != MANIFEST_VERSION:
+            return None
+        if manifest.get("fingerprint") != model_fingerprint(MODEL_PATH):
+            logger.info(f"Backend manifest {path} is stale (model file changed)")
+            return None
+        return manifest["config"]
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable backend manifest {path}: {e}")
+        return None
+
+
+def write_manifest(config: dict, load_seconds: Optional[float] = None) -> bool:
+    """
+    Record the configuration that loaded the current model file
+
+    Returns:
+        True if the manifest was written (the model directory may be read-only)
+    """
+    path = manifest_path()
+    if not path:
+        return False
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "model_path": MODEL_PATH,
+        "fingerprint": model_fingerprint(MODEL_PATH),
+        "config": config,
+        "load_seconds": round(load_seconds, 2) if load_seconds is not None else None,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, path)
+        logger.info(f"Wrote backend manifest {path}: {config}")
+        return True
+    except OSError as e:
+        logger.warning(f"Could not write backend manifest {path}: {e}")
+        return False
+
+
+def backend_available(config: dict) -> bool:
+    """Whether the library a configuration needs is importable"""
+    if config.get("backend") == "llama-cpp":
+        return llama_cpp_available
+    return config.get("backend") == "ctransformers" and ctransformers_available
+
+
+def load_model_from_config(config: dict):
+    """
+    Load one model instance with a backend configuration that is known to work
+
+    Args:
+        config: Backend configuration as returned by load_model
+
+    Returns:
+        Loaded ctransformers or llama-cpp-python model
+    """
+    detect_backends()
+    if config["backend"] == "llama-cpp":
+        return Llama(
+            model_path=MODEL_PATH,
+            n_ctx=N_CTX,
+            n_threads=N_THREADS,
+            n_gpu_layers=N_GPU_LAYERS,
+            use_mlock=MODEL_MLOCK,
+            verbose=False
+        )
+
+    ctransformers_kwargs = {
+        "context_length": N_CTX,
+        "threads": N_THREADS,
+        "gpu_layers": N_GPU_LAYERS,
+        "mlock": MODEL_MLOCK,
+    }
+    if config.get("model_type"):
+        ctransformers_kwargs["model_type"] = config["model_type"]
+
+    if config["loader"] == "from_pretrained":
+        return AutoModelForCausalLM.from_pretrained(
+            MODEL_PATH,
+            local_files_only=config["local_files_only"],
+            **ctransformers_kwargs,
+        )
+    return AutoModelForCausalLM(model_file=MODEL_PATH, **ctransformers_kwargs)
+
+
+def load_model(use_ctransformers: bool, use_manifest: bool = True) -> Tuple[object, dict]:
+    """
+    Load the GGUF model, directly from the manifest if one matches the file
+
+    Args:
+        use_ctransformers: Whether to try ctransformers first
+        use_manifest: Read and update the backend manifest
+
+    Returns:
+        Tuple of (model, backend configuration that loaded it)
+
+    Raises:
+        Exception: If no backend could load the model
+    """
+    detect_backends()
+    if use_manifest:
+        config = read_manifest()
+        allowed = config is not None and backend_available(config) and (
+            use_ctransformers or config["backend"] == "llama-cpp"
+        )
+        if allowed:
+            try:
+                logger.info(f"Loading model with manifest configuration {config}")
+                return load_model_from_config(config), config
+            except Exception as e:
+                logger.warning(f"Manifest configuration failed, probing backends again: {e}")
+
+    started = time.perf_counter()
+    model, config = probe_backends(use_ctransformers)
+    if use_manifest:
+        write_manifest(config, time.perf_counter() - started)
+    return model, config
+
+
+def probe_backends(use_ctransformers: bool) -> Tuple[object, dict]:
+    """
+    Find a working backend, trying ctransformers configurations before llama-cpp-python
+
+    Args:
+        use_ctransformers: Whether to try ctransformers first
+
+    Returns:
+        Tuple of (model, backend configuration that loaded it)
+
+    Raises:
+        Exception: If no backend could load the model
+    """
+    if not use_ctransformers:
+        # Using llama-cpp-python
+        config = {"backend": "llama-cpp"}
+        return load_model_from_config(config), config
+
+    # Using ctransformers - try different model types for Llama 3.2
+    # Try various model types that might work with Llama 3.2
+    model_types_to_try = ["llama", "llama3", "llama-2", None]  # None = auto-detect
+    local_files_options = [False, True]  # Try False first (allows downloading config if needed)
+
+    for local_files_only in local_files_options:
+        for model_type in model_types_to_try:
+            try:
+                logger.info(f"Trying to load with model_type={model_type if model_type else 'auto-detect'}, local_files_only={local_files_only}")
+                config = {
+                    "backend": "ctransformers",
+                    "loader": "from_pretrained",
+                    "model_type": model_type,
+                    "local_files_only": local_files_only,
+                }
+                # Try with model_file parameter for GGUF files
+                try:
+                    model = load_model_from_config(config)
+                except Exception as e1:
+                    # If from_pretrained fails, try using model_file parameter directly
+                    logger.debug(f"from_pretrained failed, trying model_file parameter: {e1}")
+                    config["loader"] = "model_file"
+                    model = load_model_from_config(config)
+
+                logger.info(f"Successfully loaded with model_type={model_type if model_type else 'auto-detect'}")
+                return model, config
+            except Exception as e:
+                logger.warning(f"Failed with model_type={model_type if model_type else 'auto-detect'}, local_files_only={local_files_only}: {e}")
+                continue
+
+    # If ctransformers failed but llama-cpp-python is available, try that
+    if llama_cpp_available:
+        logger.warning("ctransformers failed, trying llama-cpp-python as fallback...")
+        config = {"backend": "llama-cpp"}
+        model = load_model_from_config(config)
+        logger.info("Successfully loaded with llama-cpp-python fallback")
+        return model, config
+
+    error_msg = (
+        "Failed to load model with ctransformers. All model types failed.\n"
+        "Possible solutions:\n"
+        "1. Upgrade ctransformers: pip install --upgrade ctransformers\n"
+        "2. Install llama-cpp-python (may require Visual C++ Redistributables on Windows):\n"
+        "   pip install llama-cpp-python --extra-index-url https://abetlen.github.io/llama-cpp-python/whl/cpu\n"
+        "   If that fails, try: pip install llama-cpp-python --force-reinstall --no-cache-dir\n"
+        "3. Check if the GGUF model file is valid and not corrupted"
+    )
+    logger.error(error_msg)
+    raise Exception(error_msg)
+
+
+def load_model_pool(size: int, use_ctransformers: Optional[bool] = None) -> Tuple[List[object], dict]:
+    """
+    Load `size` independent model instances (use_ctransformers=None: detected preference)
+
+    The first instance discovers a working backend configuration; the others reuse
+    it directly. Both backends mmap the GGUF file, so the instances share the weight
+    pages and each extra instance only costs its own context (KV cache) memory.
+
+    Returns:
+        Tuple of (list of models, backend configuration)
+    """
+    if use_ctransformers is None:
+        use_ctransformers = detect_backends()
+    model, config = load_model(use_ctransformers)
+    models = [model]
+    for index in range(1, size):
+        logger.info(f"Loading model instance {index + 1}/{size}")
+        models.append(load_model_from_config(config))
+    return models, config
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="GGUF model backend manifest")
+    parser.add_argument("--probe", action="store_true", help="Probe backends and rewrite the manifest")
+    parser.add_argument("--model-path", default=os.getenv("MODEL_PATH", MODEL_PATH))
+    args = parser.parse_args()
+
+    MODEL_PATH = os.path.abspath(args.model_path)
+    MODEL_MANIFEST_PATH = os.getenv("MODEL_MANIFEST_PATH")
+    if args.probe:
+        started = time.perf_counter()
+        _, probed_config = probe_backends(detect_backends())
+        if not write_manifest(probed_config, time.perf_counter() - started):
+            raise SystemExit(1)
+        print(json.dumps(probed_config))
+    else:
+        print(json.dumps(read_manifest()))
@@ -0,0 +1,114 @@
+"""
+Model runtime: the loaded model pool and the caches built around it
+Used in-process by main.py and by model_worker.py in the split deployment, so both
+load, prime and warm the model the same way.
+"""
+import asyncio
+import logging
+import os
+
+from conversation_memory import CONVERSATION_TTL_MINUTES
+from context_assembler import ContextAssembler, TokenCounter, model_bos_ids, model_tokenizer
+from inference_executor import InferenceExecutorPool
+from model_loader import MODEL_PATH, MODEL_POOL_SIZE, N_CTX, load_model_pool, model_identity
+from model_warmup import MODEL_WARMUP_ENABLED, model_warmup
+from prompt_builder import PromptBuilder, format_system_prefix
+from prompt_cache import ConversationStateCache, PrefixStateCache
+from travel_agent_prompt import get_travel_agent_prompt
+
+logger = logging.getLogger(__name__)
+
+# Evaluate the travel-agent system prompt once at startup and reuse its KV state
+PREFIX_CACHE_ENABLED = os.getenv("PREFIX_CACHE_ENABLED", "true").lower() == "true"
+# Memory budget for per-user conversation KV states (llama-cpp-python only, 0 disables)
+CONVERSATION_STATE_CACHE_MB = int(os.getenv("CONVERSATION_STATE_CACHE_MB", "512"))
+
+
+class ModelRuntime:
+    """Loaded model instances with their executor pool and tokenizer-backed helpers"""
+
+    def __init__(self, pool: InferenceExecutorPool, context_assembler: ContextAssembler, use_ctransformers: bool):
+        self.pool = pool
+        self.context_assembler = context_assembler
+        self.use_ctransformers = use_ctransformers
+        self.model_identity = model_identity(MODEL_PATH, "ctransformers" if use_ctransformers else "llama-cpp")
+
+    def stats(self) -> dict:
+        pool = self.pool
+        return {
+            "inference": pool.stats.snapshot(),
+            "model_pool": pool.occupancy(),
+            "warmup": model_warmup.stats(),
+            "context_assembler": self.context_assembler.stats(),
+            "prefix_cache": pool.prefix_cache.stats() if pool.prefix_cache else None,
+            "conversation_state_cache": pool.conversation_cache.stats() if pool.conversation_cache else None,
+        }
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+def warmup_prompt() -> str:
+    """A chat prompt shaped like real traffic, used to warm up the model"""
+    return (
+        PromptBuilder()
+        .add("system", get_travel_agent_prompt())
+        .add("user", "Plan a day trip from London to Oxford.")
+        .finish()
+        .text
+    )
+
+
+async def start_model_runtime() -> ModelRuntime:
+    """
+    Load MODEL_POOL_SIZE instances of MODEL_PATH and prepare them for serving
+
+    Loading runs in a thread so it does not block other coroutines on the event
+    loop. Callers await this during startup (main.py and model_worker.py lifespans),
+    so the server does not answer requests, including /health, until it returns.
+    The prefix cache is primed before returning; warm-up continues in the background.
+
+    Returns:
+        ModelRuntime ready for generation
+
+    Raises:
+        Exception: If no backend could load the model
+    """
+    logger.info(f"Loading model from {MODEL_PATH} (pool size: {MODEL_POOL_SIZE})")
+
+    models, backend_config = await asyncio.to_thread(load_model_pool, MODEL_POOL_SIZE)
+    use_ctransformers = backend_config["backend"] == "ctransformers"
+
+    logger.info("Model loaded successfully!")
+    pool = InferenceExecutorPool.from_models(models, use_ctransformers)
+
+    if PREFIX_CACHE_ENABLED:
+        prefix_cache = PrefixStateCache(
+            format_system_prefix(get_travel_agent_prompt()),
+            use_ctransformers
+        )
+        # Every instance evaluates the prefix once so none starts cold
+        if all(await pool.submit_all(prefix_cache.prime)):
+            pool.prefix_cache = prefix_cache
+
+    if CONVERSATION_STATE_CACHE_MB > 0 and not use_ctransformers:
+        pool.conversation_cache = ConversationStateCache(
+            max_bytes=CONVERSATION_STATE_CACHE_MB * 1024 * 1024,
+            ttl_seconds=CONVERSATION_TTL_MINUTES * 60
+        )
+
+    context_assembler = ContextAssembler(
+        TokenCounter(
+            model_tokenizer(models[0], use_ctransformers),
+            bos_ids=model_bos_ids(models[0], use_ctransformers)
+        ),
+        n_ctx=N_CTX
+    )
+
+    # Fault in the weights with a short generation; /health reports "warming" meanwhile
+    if MODEL_WARMUP_ENABLED:
+        model_warmup.start(pool, warmup_prompt())
+    else:
+        model_warmup.skip()
+
+    return ModelRuntime(pool, context_assembler, use_ctransformers)
@@ -0,0 +1,102 @@
+"""
+Model warm-up before a worker reports ready
+The first generation after loading pays for page-faulting the mmap'd weights and
+for the backend's first-call allocations. A short synthetic generation runs on every
+model instance in the background, and /health reports "warming" until it finishes
+so the load balancer only routes traffic to hot workers.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables
+MODEL_WARMUP_ENABLED = os.getenv("MODEL_WARMUP_ENABLED", "true").lower() == "true"
+MODEL_WARMUP_TOKENS = int(os.getenv("MODEL_WARMUP_TOKENS", "8"))
+
+
+class ModelWarmup:
+    """
+    Runs the warm-up generation once per model instance and tracks readiness
+
+    A failed warm-up only means the first requests are slow, so the worker is
+    reported ready either way; the error is kept for /metrics.
+    """
+
+    def __init__(self, max_tokens: int = MODEL_WARMUP_TOKENS):
+        self.max_tokens = max_tokens
+        self.status = "pending"
+        self.error: Optional[str] = None
+        self.duration: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.status in ("ready", "failed", "skipped")
+
+    def skip(self):
+        """Mark the worker ready without warming up"""
+        self.status = "skipped"
+
+    def start(self, pool, prompt: str):
+        """
+        Start warming every instance of the pool in the background
+
+        Args:
+            pool: InferenceExecutorPool whose instances are warmed
+            prompt: Formatted prompt resembling real traffic (the travel-agent prompt)
+        """
+        self.status = "warming"
+        self.error = None
+        self.duration = None
+        self._task = asyncio.create_task(self._run(pool, prompt))
+
+    async def _run(self, pool, prompt: str):
+        started = time.perf_counter()
+        params = {
+            "max_tokens": self.max_tokens,
+            "temperature": 0.0,
+            "top_p": 1.0,
+            "top_k": 1,
+            "repeat_penalty": 1.0,
+        }
+        try:
+            # Called on each instance directly so the synthetic jobs stay out of the scheduler stats
+            await asyncio.gather(*(
+                executor.submit(executor._generate, prompt, **params)
+                for executor in pool.executors
+            ))
+            self.status = "ready"
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Model warm-up failed, serving cold: {e}")
+            self.error = str(e)
+            self.status = "failed"
+        finally:
+            self.duration = time.perf_counter() - started
+        logger.info(f"Model warm-up finished in {self.duration:.1f}s ({len(pool.executors)} instance(s))")
+
+    async def stop(self):
+        """Cancel a warm-up still in progress (shutdown)"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "status": self.status,
+            "duration_ms": round(self.duration * 1000, 1) if self.duration is not None else None,
+            "error": self.error,
+        }
+
+
+# Shared warm-up state for the application
+model_warmup = ModelWarmup()
@@ -0,0 +1,189 @@
+"""
+Model worker process for the split deployment
+Loads the model pool and serves generation to the lean API process over a unix
+socket. Workers boot, warm up and scale independently of the API.
+
+Usage:
+    python model_worker.py --socket /tmp/tour-planner-model-0.sock
+
+Then start the API with MODEL_WORKER_SOCKETS=/tmp/tour-planner-model-0.sock[,...].
+"""
+# Load environment variables FIRST, before any other imports that use them
+from dotenv import load_dotenv
+load_dotenv()
+
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+from model_runtime import ModelRuntime, start_model_runtime
+from model_warmup import model_warmup
+
+# Set once the model is loaded; requests before that are answered with 503
+runtime: Optional[ModelRuntime] = None
+load_error: Optional[str] = None
+
+
+async def load_runtime():
+    global runtime, load_error
+    try:
+        runtime = await start_model_runtime()
+    except Exception as e:
+        logger.error(f"Model worker failed to load the model: {e}")
+        load_error = str(e)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load the model in the background so /health answers while it loads"""
+    global runtime
+    loader = asyncio.create_task(load_runtime())
+    yield
+    loader.cancel()
+    await model_warmup.stop()
+    if runtime is not None:
+        runtime.shutdown()
+        runtime = None
+
+
+app = FastAPI(title="Tour Planner Model Worker", lifespan=lifespan)
+
+
+class SamplingParams(BaseModel):
+    max_tokens: Optional[int] = 512
+    temperature: Optional[float] = 0.7
+    top_p: Optional[float] = 0.9
+    top_k: Optional[int] = 40
+    repeat_penalty: Optional[float] = 1.1
+    stop: Optional[List[str]] = None
+
+
+class GenerateRequest(BaseModel):
+    prompt: str
+    cache_key: Optional[str] = None
+    save_state: bool = False
+    params: SamplingParams
+
+
+class SelectHistoryRequest(BaseModel):
+    history: List[Dict[str, str]]
+    fixed_messages: List[List[str]]
+    max_tokens: int
+
+
+class InvalidateRequest(BaseModel):
+    user_key: str
+
+
+def require_runtime() -> ModelRuntime:
+    if runtime is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    return runtime
+
+
+def result_payload(result, prompt: str) -> dict:
+    """Token counts and timings of a finished generation (prompt counted if the backend did not)"""
+    prompt_tokens = result.prompt_tokens
+    if prompt_tokens is None:
+        prompt_tokens = require_runtime().context_assembler.counter.count_prompt([prompt])
+    return {
+        "model_identity": require_runtime().model_identity,
+        "completion_tokens": result.completion_tokens,
+        "prompt_tokens": prompt_tokens,
+        "queue_wait": result.queue_wait,
+        "generation_time": result.generation_time,
+    }
+
+
+@app.get("/health")
+async def health():
+    if runtime is None:
+        status = "failed" if load_error else "loading"
+    else:
+        status = "ready" if model_warmup.ready else "warming"
+    content = {"status": status, "error": load_error}
+    if runtime is not None:
+        # Handshake for the API process: which model this worker serves and its capacity
+        content["model_identity"] = runtime.model_identity
+        content["model_pool"] = runtime.pool.occupancy()
+    return JSONResponse(status_code=200 if status == "ready" else 503, content=content)
+
+
+@app.get("/metrics")
+async def metrics():
+    return require_runtime().stats()
+
+
+@app.post("/generate")
+async def generate(request: GenerateRequest):
+    pool = require_runtime().pool
+    try:
+        result = await pool.generate(
+            request.prompt, cache_key=request.cache_key, save_state=request.save_state, **request.params.model_dump()
+        )
+    except Exception as e:
+        logger.error(f"Error generating completion: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return dict(result_payload(result, request.prompt), text=result.text)
+
+
+@app.post("/stream")
+async def stream(request: GenerateRequest):
+    """Newline-delimited JSON: {"text": ...} per token, then {"done": true, ...} or {"error": ...}"""
+    pool = require_runtime().pool
+    generation = pool.stream(
+        request.prompt, cache_key=request.cache_key, save_state=request.save_state, **request.params.model_dump()
+    )
+
+    async def events():
+        try:
+            async for piece in generation:
+                yield json.dumps({"text": piece}) + "\n"
+        except Exception as e:
+            logger.error(f"Error streaming completion: {e}")
+            yield json.dumps({"error": str(e)}) + "\n"
+            return
+        yield json.dumps(dict(result_payload(generation.result, request.prompt), done=True)) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@app.post("/select_history")
+async def select_history(request: SelectHistoryRequest):
+    """Number of newest history messages that fit the context window"""
+    assembler = require_runtime().context_assembler
+    fixed_messages = [(role, content) for role, content in request.fixed_messages]
+    kept = assembler.select_history(request.history, fixed_messages, request.max_tokens)
+    return {"kept": len(kept)}
+
+
+@app.post("/invalidate")
+async def invalidate(request: InvalidateRequest):
+    pool = require_runtime().pool
+    if pool.conversation_cache:
+        pool.conversation_cache.invalidate(request.user_key)
+    return {"status": "ok"}
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve model generation over a unix socket")
+    parser.add_argument("--socket", default=os.getenv("MODEL_WORKER_SOCKET", "/tmp/tour-planner-model-0.sock"))
+    args = parser.parse_args()
+
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+    uvicorn.run(app, uds=args.socket)
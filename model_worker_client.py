@@ -0,0 +1,268 @@
+"""
+Client for model_worker.py processes (split deployment)
+The lean API process does not import a model backend. It sends generations to
+model workers listening on unix sockets, with the same interface as
+InferenceExecutorPool, so the handlers in main.py work unchanged.
+"""
+import json
+import logging
+import os
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+
+from inference_executor import GenerationResult, SchedulerStats
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated unix socket paths of model workers; empty = load the model in-process
+MODEL_WORKER_SOCKETS = [path.strip() for path in os.getenv("MODEL_WORKER_SOCKETS", "").split(",") if path.strip()]
+MODEL_WORKER_CONNECT_TIMEOUT_SECONDS = float(os.getenv("MODEL_WORKER_CONNECT_TIMEOUT_SECONDS", "2"))
+# Generations are bounded by admission control, so reads wait this long at most
+MODEL_WORKER_READ_TIMEOUT_SECONDS = float(os.getenv("MODEL_WORKER_READ_TIMEOUT_SECONDS", "300"))
+# How often main re-reads the workers' model identity and pool sizes
+MODEL_WORKER_HANDSHAKE_INTERVAL_SECONDS = float(os.getenv("MODEL_WORKER_HANDSHAKE_INTERVAL_SECONDS", "15"))
+
+
+class ModelWorkerError(Exception):
+    """A model worker was unreachable or reported a failed generation"""
+
+
+def apply_worker_timings(result: GenerationResult, payload: dict):
+    """Copy token counts and timings reported by a worker onto a local result"""
+    result.completion_tokens = payload.get("completion_tokens", 0)
+    result.prompt_tokens = payload.get("prompt_tokens")
+    result.started_at = result.enqueued_at + payload.get("queue_wait", 0.0)
+    result.finished_at = result.started_at + payload.get("generation_time", 0.0)
+
+
+class ModelWorkerClient:
+    """
+    HTTP-over-unix-socket connection to one model worker
+
+    Args:
+        socket_path: Socket the worker listens on (model_worker.py --socket)
+        transport: Optional httpx transport (tests)
+    """
+
+    def __init__(self, socket_path: str, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.socket_path = socket_path
+        self.pending = 0
+        # Reported by the worker (/health and every generation); None until it has loaded
+        self.model_identity: Optional[str] = None
+        self.capacity: Optional[int] = None
+        self._client = httpx.AsyncClient(
+            transport=transport or httpx.AsyncHTTPTransport(uds=socket_path),
+            base_url="http://model-worker",
+            timeout=httpx.Timeout(MODEL_WORKER_READ_TIMEOUT_SECONDS, connect=MODEL_WORKER_CONNECT_TIMEOUT_SECONDS)
+        )
+
+    async def post(self, path: str, payload: dict) -> dict:
+        try:
+            response = await self._client.post(path, json=payload)
+        except httpx.HTTPError as e:
+            raise ModelWorkerError(f"Model worker {self.socket_path} unreachable: {e}") from e
+        if response.status_code != 200:
+            raise ModelWorkerError(f"Model worker {self.socket_path} returned {response.status_code}: {response.text}")
+        return response.json()
+
+    async def health(self) -> dict:
+        """Worker readiness; unreachable workers are reported, not raised"""
+        try:
+            response = await self._client.get("/health", timeout=MODEL_WORKER_CONNECT_TIMEOUT_SECONDS)
+            content = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            return {"status": "unreachable", "error": str(e)}
+        self.note_model(content)
+        if content.get("model_pool"):
+            self.capacity = content["model_pool"]["size"]
+        return content
+
+    def note_model(self, payload: dict):
+        """Record the model identity a worker reported (it changes when the worker's model is swapped)"""
+        identity = payload.get("model_identity")
+        if identity and identity != self.model_identity:
+            if self.model_identity is not None:
+                logger.info(f"Model worker {self.socket_path} now serves {identity}")
+            self.model_identity = identity
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+class RemoteGenerationStream:
+    """
+    Async iterator over text pieces streamed by a model worker
+
+    Mirrors GenerationStream: timings end up on .result once the stream is exhausted,
+    and closing the iteration closes the connection, which stops the worker's generation.
+    """
+
+    def __init__(self, pool: "RemoteInferencePool", payload: dict):
+        self.pool = pool
+        self.payload = payload
+        self.result = GenerationResult()
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        worker = self.pool.acquire()
+        result = self.result
+        pieces = []
+        failed = False
+        finished = False
+        worker.pending += 1
+        try:
+            async with worker._client.stream("POST", "/stream", json=self.payload) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise ModelWorkerError(f"Model worker {worker.socket_path} returned {response.status_code}: {response.text}")
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if "error" in event:
+                        raise ModelWorkerError(event["error"])
+                    if event.get("done"):
+                        apply_worker_timings(result, event)
+                        worker.note_model(event)
+                        finished = True
+                        break
+                    pieces.append(event["text"])
+                    yield event["text"]
+                else:
+                    raise ModelWorkerError(f"Model worker {worker.socket_path} ended the stream early")
+            result.text = "".join(pieces)
+        except httpx.HTTPError as e:
+            failed = True
+            raise ModelWorkerError(f"Model worker {worker.socket_path} unreachable: {e}") from e
+        except ModelWorkerError:
+            failed = True
+            raise
+        finally:
+            worker.pending -= 1
+            if result.finished_at is None:
+                result.finished_at = time.perf_counter()
+            self.pool.stats.record(result, failed=failed, cancelled=not finished)
+
+
+class RemoteInferencePool:
+    """
+    Dispatches generations to model workers, least pending requests first
+
+    Exposes the parts of InferenceExecutorPool the API handlers use (generate,
+    stream, stats, pending, occupancy) plus the tokenizer-dependent operations
+    the lean process cannot do itself (select_history, invalidate_conversation).
+    """
+
+    # KV state caches live in the workers
+    prefix_cache = None
+    conversation_cache = None
+
+    def __init__(self, socket_paths: List[str], transports: Optional[Dict[str, httpx.AsyncBaseTransport]] = None):
+        if not socket_paths:
+            raise ValueError("RemoteInferencePool needs at least one worker socket")
+        transports = transports or {}
+        self.workers = [ModelWorkerClient(path, transports.get(path)) for path in socket_paths]
+        self.stats = SchedulerStats()
+        self._next = 0
+
+    @property
+    def pending(self) -> int:
+        return sum(worker.pending for worker in self.workers)
+
+    def acquire(self) -> ModelWorkerClient:
+        """Pick the worker with the fewest in-flight requests, rotating between idle ones"""
+        count = len(self.workers)
+        order = [self.workers[(self._next + i) % count] for i in range(count)]
+        worker = min(order, key=lambda w: w.pending)
+        self._next = (self.workers.index(worker) + 1) % count
+        return worker
+
+    @staticmethod
+    def _payload(prompt: str, cache_key: Optional[str], save_state: bool, params: dict) -> dict:
+        # Token ids are tokenizer-specific; the worker tokenizes the prompt itself
+        params = {key: value for key, value in params.items() if key != "prompt_ids"}
+        return {"prompt": prompt, "cache_key": cache_key, "save_state": save_state, "params": params}
+
+    async def generate(
+        self,
+        prompt: str,
+        cache_key: Optional[str] = None,
+        save_state: bool = False,
+        **params
+    ) -> GenerationResult:
+        result = GenerationResult()
+        worker = self.acquire()
+        worker.pending += 1
+        try:
+            payload = await worker.post("/generate", self._payload(prompt, cache_key, save_state, params))
+        except Exception:
+            result.finished_at = time.perf_counter()
+            self.stats.record(result, failed=True)
+            raise
+        finally:
+            worker.pending -= 1
+        result.text = payload["text"]
+        apply_worker_timings(result, payload)
+        worker.note_model(payload)
+        self.stats.record(result)
+        return result
+
+    def stream(
+        self,
+        prompt: str,
+        cache_key: Optional[str] = None,
+        save_state: bool = False,
+        **params
+    ) -> RemoteGenerationStream:
+        return RemoteGenerationStream(self, self._payload(prompt, cache_key, save_state, params))
+
+    async def select_history(
+        self,
+        history: List[Dict],
+        fixed_messages: List[Tuple[str, str]],
+        max_tokens: int
+    ) -> List[Dict]:
+        """ContextAssembler.select_history run by a worker with the model's tokenizer"""
+        payload = await self.acquire().post("/select_history", {
+            "history": [{"role": m["role"], "content": m["content"]} for m in history],
+            "fixed_messages": [list(message) for message in fixed_messages],
+            "max_tokens": max_tokens,
+        })
+        return history[len(history) - payload["kept"]:]
+
+    async def invalidate_conversation(self, user_key: str):
+        """Drop a user's cached conversation states on every worker"""
+        for worker in self.workers:
+            try:
+                await worker.post("/invalidate", {"user_key": user_key})
+            except ModelWorkerError as e:
+                logger.warning(f"Could not invalidate conversation state: {e}")
+
+    async def health(self) -> List[dict]:
+        """Every worker's /health, which also refreshes model_identity and capacity"""
+        return [dict(await worker.health(), socket=worker.socket_path) for worker in self.workers]
+
+    @property
+    def model_identity(self) -> Optional[str]:
+        """Model served by the workers, None until one of them reported it"""
+        identities = sorted({worker.model_identity for worker in self.workers if worker.model_identity})
+        return "+".join(identities) if identities else None
+
+    def capacity(self) -> int:
+        """Model instances across workers (one for a worker that has not reported yet)"""
+        return sum(worker.capacity or 1 for worker in self.workers)
+
+    def occupancy(self) -> dict:
+        pending = [worker.pending for worker in self.workers]
+        return {
+            "size": self.capacity(),
+            "workers": len(self.workers),
+            "busy": sum(1 for p in pending if p > 0),
+            "pending": pending,
+            "remote": True,
+        }
+
+    async def aclose(self):
+        for worker in self.workers:
+            await worker.aclose()
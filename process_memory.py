@@ -0,0 +1,160 @@
+"""
+Process memory accounting and model page-cache warming for multi-worker deployments
+GGUF weights are mmap'd read-only, so every process that maps the model file shares
+the same page-cache pages. RSS counts those pages in full for every worker. PSS
+divides them between the processes sharing them, so PSS is the per-worker cost.
+
+Usage:
+    python process_memory.py --children <gunicorn master pid>
+    python process_memory.py <pid> [<pid> ...]
+"""
+import logging
+import mmap
+import os
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# smaps fields reported (kB), keyed by the names used in the reports
+SMAPS_FIELDS = {
+    "Rss": "rss_kb",
+    "Pss": "pss_kb",
+    "Shared_Clean": "shared_clean_kb",
+    "Shared_Dirty": "shared_dirty_kb",
+    "Private_Clean": "private_clean_kb",
+    "Private_Dirty": "private_dirty_kb",
+    "Swap": "swap_kb",
+}
+
+
+def _add_smaps_line(totals: Dict[str, int], line: str):
+    key, _, rest = line.partition(":")
+    field = SMAPS_FIELDS.get(key)
+    if field:
+        totals[field] = totals.get(field, 0) + int(rest.split()[0])
+
+
+def read_memory(pid="self") -> Dict[str, int]:
+    """
+    Whole-process memory from /proc/<pid>/smaps_rollup (Linux)
+
+    Returns:
+        Dict of kB values (rss_kb, pss_kb, shared_*_kb, private_*_kb, swap_kb),
+        empty where /proc is unavailable
+    """
+    totals: Dict[str, int] = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                _add_smaps_line(totals, line)
+    except OSError:
+        pass
+    return totals
+
+
+def read_mapping_memory(path: str, pid="self") -> Dict[str, int]:
+    """
+    Memory of the mappings of one file (e.g. the GGUF model) in a process
+
+    Args:
+        path: Mapped file
+        pid: Process id, "self" by default
+
+    Returns:
+        Dict of kB values summed over every mapping of the file
+    """
+    target = os.path.realpath(path)
+    totals: Dict[str, int] = {}
+    in_target = False
+    try:
+        with open(f"/proc/{pid}/smaps") as f:
+            for line in f:
+                first = line.split(None, 1)[0]
+                if "-" in first and not first.endswith(":"):
+                    # Mapping header: "start-end perms offset dev inode [path]"
+                    fields = line.split(None, 5)
+                    in_target = len(fields) == 6 and fields[5].strip() == target
+                elif in_target:
+                    _add_smaps_line(totals, line)
+    except OSError:
+        pass
+    return totals
+
+
+def preload_model_pages(path: str) -> bool:
+    """
+    Warm the page cache with the model file (MADV_WILLNEED read-ahead)
+
+    Called in the gunicorn master before workers fork, so the workers' model loads
+    read the weights from memory rather than disk. This is only cache warming: the
+    backends' read-only mmaps share page-cache pages between processes whether or
+    not the file was read ahead, and the mapping is closed again right away.
+
+    Returns:
+        True if the read-ahead was requested
+    """
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+            if not (hasattr(mapping, "madvise") and hasattr(mmap, "MADV_WILLNEED")):
+                return False
+            mapping.madvise(mmap.MADV_WILLNEED)
+            size = len(mapping)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not warm the page cache with {path}: {e}")
+        return False
+    logger.info(f"Requested read-ahead of {size / (1024 * 1024):.0f} MB of model pages from {path}")
+    return True
+
+
+def child_pids(pid: int) -> List[int]:
+    """Direct children of a process (e.g. the workers of a gunicorn master)"""
+    children: List[int] = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return sorted(set(children))
+
+
+def memory_report(model_path: Optional[str] = None, pid="self") -> Dict[str, Dict[str, int]]:
+    """Process memory and, if given, the share of it taken by the model file"""
+    report = {"process": read_memory(pid)}
+    if model_path:
+        report["model_file"] = read_mapping_memory(model_path, pid)
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="RSS/PSS per process, including the model file mapping")
+    parser.add_argument("pids", nargs="*", type=int)
+    parser.add_argument("--children", type=int, help="Report the children of this process (gunicorn master)")
+    parser.add_argument("--model-path", default=os.getenv("MODEL_PATH"))
+    args = parser.parse_args()
+
+    pids = list(args.pids)
+    if args.children:
+        pids = [args.children] + child_pids(args.children)
+
+    def mb(value_kb: int) -> str:
+        return f"{value_kb / 1024:9.1f}"
+
+    print(f"{'pid':>8} {'rss MB':>9} {'pss MB':>9} {'model rss':>9} {'model pss':>9} {'private MB':>10}")
+    total_pss = 0
+    for pid in pids:
+        report = memory_report(args.model_path, pid)
+        process, model = report["process"], report.get("model_file", {})
+        total_pss += process.get("pss_kb", 0)
+        private = process.get("private_clean_kb", 0) + process.get("private_dirty_kb", 0)
+        print(
+            f"{pid:>8} {mb(process.get('rss_kb', 0))} {mb(process.get('pss_kb', 0))} "
+            f"{mb(model.get('rss_kb', 0))} {mb(model.get('pss_kb', 0))} {mb(private):>10}"
+        )
+    print(f"{'total':>8} {'':>9} {mb(total_pss)}")
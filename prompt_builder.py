@@ -0,0 +1,97 @@
+"""
+Llama-3 chat prompt construction
+Prompts are kept as a list of template segments, one per turn. Every segment starts
+and ends on a special token, so the joined text and the token ids (concatenated
+cached per-segment tokens) are built without re-tokenizing the whole prompt.
+"""
+from typing import Iterable, List, Optional
+
+# Opens the assistant turn the model completes; every chat prompt ends with it
+ASSISTANT_HEADER = "<|start_header_id|>assistant<|end_header_id|>\n\n"
+
+
+def format_system_prefix(system_prompt: str) -> str:
+    """Format the leading system message, shared by every chat prompt (and the prefix cache)"""
+    return f"<|begin_of_text|><|start_header_id|>system<|end_header_id|>\n\n{system_prompt}<|eot_id|>"
+
+
+def format_chat_message(role: str, content: str) -> str:
+    """One Llama-3 chat turn (user, assistant or a non-leading system message)"""
+    return f"<|start_header_id|>{role}<|end_header_id|>\n\n{content}<|eot_id|>"
+
+
+class PromptBuilder:
+    """
+    Incrementally builds a Llama-3.2-Instruct prompt as template segments
+
+    The joined text is computed once and cached; token_ids() concatenates the
+    TokenCounter's cached tokens for each segment, so the static system prompt and
+    previously seen history turns are never tokenized again.
+    """
+
+    def __init__(self):
+        self.segments: List[str] = []
+        self.finished = False
+        self._text: Optional[str] = None
+
+    def add(self, role: str, content: str) -> "PromptBuilder":
+        """Append one turn; only the very first system message gets begin_of_text"""
+        if self.finished:
+            raise ValueError("Cannot add messages after the assistant header")
+        if role == "system" and not self.segments:
+            self.segments.append(format_system_prefix(content))
+        elif role in ("system", "user", "assistant"):
+            self.segments.append(format_chat_message(role, content))
+        else:
+            return self
+        self._text = None
+        return self
+
+    def add_messages(self, messages: Iterable) -> "PromptBuilder":
+        """Append messages with .role and .content (e.g. ChatMessage)"""
+        for msg in messages:
+            self.add(msg.role, msg.content)
+        return self
+
+    def finish(self) -> "PromptBuilder":
+        """Add the assistant header the response is generated after"""
+        if not self.finished:
+            self.segments.append(ASSISTANT_HEADER)
+            self.finished = True
+            self._text = None
+        return self
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = "".join(self.segments)
+        return self._text
+
+    def token_ids(self, counter) -> List[int]:
+        """
+        Prompt token ids exactly as the backend would tokenize the joined text
+
+        Args:
+            counter: TokenCounter for the loaded model (segment tokens are cached)
+
+        Returns:
+            BOS ids followed by every segment's tokens
+        """
+        ids = list(counter.bos_ids)
+        for segment in self.segments:
+            ids.extend(counter.tokens(segment))
+        return ids
+
+
+def strip_prompt_echo(text: str, prompt_length: int) -> str:
+    """
+    Remove the prompt if the backend echoed it in front of the completion
+
+    Every chat prompt ends with the assistant header, so an echo is detected by
+    looking for the header right before prompt_length instead of comparing the
+    whole prompt (neither backend echoes by default, so this is usually a no-op).
+    """
+    header_start = prompt_length - len(ASSISTANT_HEADER)
+    if header_start >= 0 and len(text) >= prompt_length and text[header_start:prompt_length] == ASSISTANT_HEADER:
+        return text[prompt_length:].strip()
+    return text
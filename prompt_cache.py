@@ -0,0 +1,314 @@
+"""
+Model state caching for evaluated prompt prefixes
+Every chat prompt starts with the same travel-agent system prompt, so its KV state
+is evaluated once and restored before each generation instead of being recomputed.
+Per-user states let follow-up messages skip re-evaluating the conversation history.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def tokenize_prompt(model, text: str, use_ctransformers: bool) -> List[int]:
+    """
+    Tokenize text exactly the way the backend tokenizes a completion prompt
+
+    Args:
+        model: Loaded ctransformers or llama-cpp-python model
+        text: Prompt text (may contain Llama-3 special tokens)
+        use_ctransformers: Which backend the model belongs to
+
+    Returns:
+        List of token ids
+    """
+    if use_ctransformers:
+        return list(model.tokenize(text))
+    return list(model.tokenize(text.encode("utf-8"), add_bos=True, special=True))
+
+
+def context_starts_with(model, tokens: List[int], use_ctransformers: bool) -> bool:
+    """Check whether the model's evaluated context already begins with tokens"""
+    if use_ctransformers:
+        context = model._context
+        return len(context) >= len(tokens) and list(context[:len(tokens)]) == tokens
+    return model.n_tokens >= len(tokens) and model.input_ids[:len(tokens)].tolist() == tokens
+
+
+class PrefixStateCache:
+    """
+    Snapshot of the model state after evaluating a fixed prompt prefix
+
+    llama-cpp-python: the state is captured with save_state() and restored with
+    load_state() whenever the context no longer starts with the prefix (for example
+    after a /v1/completions call with an unrelated prompt). Llama.generate then
+    reuses the matching prefix and only evaluates the rest of the prompt.
+
+    ctransformers has no state snapshot API. The prefix is evaluated once at startup
+    and its own longest-prefix matching reuses it while the context still holds it.
+    """
+
+    def __init__(self, prefix: str, use_ctransformers: bool):
+        self.prefix = prefix
+        self.use_ctransformers = use_ctransformers
+        self.tokens: Optional[List[int]] = None
+        self.state = None
+        self.hits = 0
+        self.restores = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def prime(self, model) -> bool:
+        """
+        Evaluate the prefix and snapshot the resulting state (run on the inference thread)
+
+        Returns:
+            True if the prefix was evaluated, False otherwise
+        """
+        try:
+            tokens = tokenize_prompt(model, self.prefix, self.use_ctransformers)
+            if self.use_ctransformers:
+                # Trims the context to the shared prefix and returns what is left to evaluate
+                remaining = model.prepare_inputs_for_generation(tokens)
+                if remaining:
+                    model.eval(remaining)
+            else:
+                model.reset()
+                model.eval(tokens)
+                self.state = model.save_state()
+            self.tokens = tokens
+            size_mb = self.state.llama_state_size / (1024 * 1024) if self.state is not None else 0
+            logger.info(f"Cached system prompt prefix: {len(tokens)} tokens, {size_mb:.1f} MB state")
+            return True
+        except Exception as e:
+            logger.error(f"Error priming prefix state cache: {e}")
+            self.tokens = None
+            self.state = None
+            return False
+
+    def restore(self, model, prompt: str) -> bool:
+        """
+        Make sure the model context starts with the cached prefix before generating
+
+        Args:
+            model: Model about to generate (called on the inference thread)
+            prompt: Full prompt about to be evaluated
+
+        Returns:
+            True if the context now starts with the prefix, False on a miss
+        """
+        if self.tokens is None or not prompt.startswith(self.prefix):
+            with self._lock:
+                self.misses += 1
+            return False
+
+        if context_starts_with(model, self.tokens, self.use_ctransformers):
+            with self._lock:
+                self.hits += 1
+            return True
+
+        if self.state is None:
+            with self._lock:
+                self.misses += 1
+            return False
+
+        model.load_state(self.state)
+        with self._lock:
+            self.restores += 1
+        return True
+
+    def stats(self) -> dict:
+        """Hit/restore/miss counters for monitoring"""
+        with self._lock:
+            return {
+                "prefix_tokens": len(self.tokens) if self.tokens else 0,
+                "state_bytes": self.state.llama_state_size if self.state is not None else 0,
+                "hits": self.hits,
+                "restores": self.restores,
+                "misses": self.misses,
+            }
+
+
+def common_prefix_length(a: List[int], b: List[int]) -> int:
+    """Number of leading tokens shared by two token lists"""
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class _StateEntry:
+    """One cached model state and its bookkeeping"""
+
+    __slots__ = ("key", "user_key", "tokens", "state", "size", "last_used")
+
+    def __init__(self, key: tuple, user_key: str, tokens: List[int], state, size: int):
+        self.key = key
+        self.user_key = user_key
+        self.tokens = tokens
+        self.state = state
+        self.size = size
+        self.last_used = time.monotonic()
+
+
+class ConversationStateCache:
+    """
+    LRU of per-user model states so follow-up messages only evaluate the new suffix
+
+    Entries are keyed by (user_email, hash of the evaluated tokens) and bounded by a
+    memory budget. Before a generation the entry sharing the longest token prefix
+    with the new prompt is loaded, provided it beats what the context already
+    holds. Entries expire after the conversation TTL. llama-cpp-python only.
+
+    Llama.save_state() also copies the logits of every evaluated position (up to
+    n_batch x n_vocab floats, ~256 MB for Llama-3 at n_batch 512). Generation always
+    re-evaluates the last prompt token after a restore, so they are never read back;
+    only one row is kept (load_state broadcasts it). Save time and entry size are
+    reported in stats() since the copy runs on the inference thread.
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: float):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.saves = 0
+        self.oversized = 0
+        self.save_seconds = 0.0
+        self.last_save_seconds = 0.0
+        self.last_entry_bytes = 0
+        self._entries: "OrderedDict[tuple, _StateEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def restore(self, model, user_key: str, prompt: str, prompt_tokens: Optional[List[int]] = None) -> bool:
+        """
+        Load the cached state that best matches the prompt (run on the inference thread)
+
+        Args:
+            model: llama-cpp-python model about to generate
+            user_key: Conversation owner (normalized user email)
+            prompt: Full prompt about to be evaluated
+            prompt_tokens: The prompt's tokens if the caller already has them
+
+        Returns:
+            True if a cached state was loaded, False on a miss
+        """
+        if prompt_tokens is None:
+            prompt_tokens = tokenize_prompt(model, prompt, use_ctransformers=False)
+        with self._lock:
+            self._expire()
+            best_entry = None
+            best_length = 0
+            for entry in self._entries.values():
+                if entry.user_key != user_key:
+                    continue
+                length = common_prefix_length(entry.tokens, prompt_tokens)
+                if length > best_length:
+                    best_entry, best_length = entry, length
+
+            current_length = common_prefix_length(
+                model.input_ids[:model.n_tokens].tolist(), prompt_tokens
+            )
+            if best_entry is None or best_length <= current_length:
+                self.misses += 1
+                return False
+
+            best_entry.last_used = time.monotonic()
+            self._entries.move_to_end(best_entry.key)
+            self.hits += 1
+            state = best_entry.state
+
+        model.load_state(state)
+        logger.debug(f"Restored conversation state for {user_key} ({best_length} tokens reused)")
+        return True
+
+    def save(self, model, user_key: str):
+        """Snapshot the model state after a generation (run on the inference thread)"""
+        if self.max_bytes <= 0:
+            return
+        started = time.perf_counter()
+        try:
+            state = model.save_state()
+        except Exception as e:
+            logger.error(f"Error saving conversation state: {e}")
+            return
+        _drop_logits(state)
+
+        tokens = state.input_ids[:state.n_tokens].tolist()
+        size = state.llama_state_size + getattr(state.scores, "nbytes", 0) + getattr(state.input_ids, "nbytes", 0)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.saves += 1
+            self.save_seconds += elapsed
+            self.last_save_seconds = elapsed
+            self.last_entry_bytes = size
+            if size > self.max_bytes:
+                self.oversized += 1
+                return
+
+        key = (user_key, _token_digest(tokens))
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous.size
+            self._entries[key] = _StateEntry(key, user_key, tokens, state, size)
+            self.current_bytes += size
+            self._expire()
+            while self.current_bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.size
+                self.evictions += 1
+
+    def invalidate(self, user_key: str):
+        """Drop every cached state for a user (e.g. after clearing their history)"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == user_key]:
+                self.current_bytes -= self._entries.pop(key).size
+
+    def _expire(self):
+        """Remove entries idle for longer than the TTL (caller holds the lock)"""
+        cutoff = time.monotonic() - self.ttl_seconds
+        for key in [k for k, e in self._entries.items() if e.last_used < cutoff]:
+            self.current_bytes -= self._entries.pop(key).size
+            self.expirations += 1
+
+    def stats(self) -> dict:
+        """Hit/miss/eviction counters and memory usage for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "saves": self.saves,
+                "oversized": self.oversized,
+                "avg_save_ms": round(self.save_seconds / self.saves * 1000, 1) if self.saves else 0.0,
+                "last_save_ms": round(self.last_save_seconds * 1000, 1),
+                "avg_entry_bytes": self.current_bytes // len(self._entries) if self._entries else 0,
+                "last_entry_bytes": self.last_entry_bytes,
+            }
+
+
+def _drop_logits(state):
+    """Keep a single row of a saved state's logits matrix (see ConversationStateCache)"""
+    scores = getattr(state, "scores", None)
+    if getattr(scores, "ndim", 0) == 2 and scores.shape[0] > 1:
+        state.scores = scores[-1:].copy()
+
+
+def _token_digest(tokens: List[int]) -> str:
+    """Stable hash of a token sequence"""
+    return hashlib.sha1(",".join(map(str, tokens)).encode()).hexdigest()
@@ -0,0 +1,246 @@
+"""
+Response cache for first-turn chat requests
+Many users open a conversation with near-identical journey questions ("how long
+from NYC to Boston?"). The answer depends on the route and the Directions data
+injected into the prompt, but also on what was asked ("which trains go from NYC
+to Boston?" is not "plan a vegetarian trip from NYC to Boston"). First-turn
+journey requests are therefore bucketed by the normalized origin/destination
+pairs and a hash of the journey summaries, and only reuse an answer whose
+question matches closely within that bucket. Generic first-turn questions can
+optionally be matched by bag-of-words similarity.
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
+
+from directions_cache import normalize_location
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "900"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+# Cosine similarity needed to reuse an answer to a generic question (0 = journeys only)
+RESPONSE_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("RESPONSE_CACHE_SIMILARITY_THRESHOLD", "0"))
+# Cosine similarity needed between questions about the same route (above 1 = exact question only)
+RESPONSE_CACHE_JOURNEY_SIMILARITY_THRESHOLD = float(
+    os.getenv("RESPONSE_CACHE_JOURNEY_SIMILARITY_THRESHOLD", "0.9")
+)
+
+# Dimensions of the hashed bag-of-words vectors
+VECTOR_BUCKETS = 1 << 16
+
+_WORD_RE = re.compile(r"[a-z0-9']+")
+
+
+def _digest(*parts) -> str:
+    return hashlib.sha1(json.dumps(parts, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def question_vector(text: str) -> Dict[int, float]:
+    """
+    Normalized hashed bag-of-words vector of a question (unigrams and bigrams)
+
+    A lightweight stand-in for sentence embeddings: no model is needed and
+    rephrasings that share most words ("how long from NYC to Boston" vs. "how long
+    is it from NYC to Boston?") land close together.
+    """
+    words = _WORD_RE.findall(text.casefold())
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    counts = Counter(
+        int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=4).digest(), "big") % VECTOR_BUCKETS
+        for feature in features
+    )
+    norm = math.sqrt(sum(c * c for c in counts.values()))
+    return {bucket: c / norm for bucket, c in counts.items()} if norm else {}
+
+
+def cosine_similarity(a: Dict[int, float], b: Dict[int, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(bucket, 0.0) for bucket, weight in a.items())
+
+
+class ResponseCacheKey:
+    """Lookup key for one request; the vector of its question is used for similarity matching"""
+
+    __slots__ = ("digest", "kind", "scope", "vector")
+
+    def __init__(self, digest: str, kind: str, scope: str, vector: Optional[Dict[int, float]] = None):
+        self.digest = digest
+        self.kind = kind
+        # Only answers with the same scope are reused: the sampling parameters, plus
+        # the routes and Directions data for journey keys
+        self.scope = scope
+        self.vector = vector
+
+
+def sampling_scope(sampling: dict) -> str:
+    """Hash of the sampling parameters that change the generated answer"""
+    stop = sampling.get("stop")
+    return _digest(
+        sampling.get("max_tokens"),
+        sampling.get("temperature"),
+        sampling.get("top_p"),
+        sampling.get("top_k"),
+        sampling.get("repeat_penalty"),
+        sorted(stop) if stop else None,
+    )
+
+
+class ResponseCache:
+    """
+    TTL + LRU cache of chat answers for first-turn requests
+
+    Args:
+        ttl_seconds: How long an answer is reused
+        max_entries: LRU bound
+        similarity_threshold: Cosine similarity for generic questions (0 disables them)
+        journey_similarity_threshold: Cosine similarity for questions about the same route
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float,
+        max_entries: int,
+        similarity_threshold: float = 0.0,
+        journey_similarity_threshold: float = 0.9
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.journey_similarity_threshold = journey_similarity_threshold
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key_for(
+        self,
+        user_messages: List[str],
+        history: List[dict],
+        journeys: List,
+        sampling: dict,
+        has_assistant_turns: bool = False
+    ) -> Optional[ResponseCacheKey]:
+        """
+        Cache key for a chat request, or None when its answer must be generated
+
+        Only first turns are cached: a user with conversation history (or a request
+        carrying earlier turns) always gets a fresh, context-aware answer.
+
+        Args:
+            user_messages: Contents of the request's user messages
+            history: Stored conversation history for the user
+            journeys: JourneyResolution objects detected in the request
+            sampling: Sampling parameters of the request
+            has_assistant_turns: The request itself replays earlier assistant turns
+        """
+        if self.max_entries <= 0:
+            return None
+        if history or has_assistant_turns or len(user_messages) != 1:
+            with self._lock:
+                self.bypassed += 1
+            return None
+
+        scope = sampling_scope(sampling)
+        question = " ".join(user_messages[0].split()).casefold()
+        summaries = [journey.summary for journey in journeys if journey.summary]
+        if summaries:
+            routes = [
+                [normalize_location(journey.origin), normalize_location(journey.destination)]
+                for journey in journeys if journey.summary
+            ]
+            route_scope = _digest("journey", routes, _digest(summaries), scope)
+            return ResponseCacheKey(
+                _digest(route_scope, question), "journey", route_scope, question_vector(question)
+            )
+
+        if self.similarity_threshold <= 0 or journeys:
+            # Generic caching is off, or the journey lookup failed (answer would differ)
+            return None
+        return ResponseCacheKey(
+            _digest("question", question, scope), "question", scope, question_vector(question)
+        )
+
+    def get(self, key: ResponseCacheKey) -> Optional[dict]:
+        """Cached response for the key (or a similar question), None on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key.digest)
+            if entry is not None:
+                self._entries.move_to_end(key.digest)
+                self.hits += 1
+                return entry[2]
+
+            threshold = (
+                self.journey_similarity_threshold if key.kind == "journey" else self.similarity_threshold
+            )
+            if key.vector and 0 < threshold <= 1:
+                best_digest, best_score = None, threshold
+                for digest, (_, cached_key, _) in self._entries.items():
+                    if cached_key.kind != key.kind or cached_key.scope != key.scope:
+                        continue
+                    score = cosine_similarity(key.vector, cached_key.vector)
+                    if score >= best_score:
+                        best_digest, best_score = digest, score
+                if best_digest is not None:
+                    self._entries.move_to_end(best_digest)
+                    self.similar_hits += 1
+                    return self._entries[best_digest][2]
+
+            self.misses += 1
+            return None
+
+    def put(self, key: ResponseCacheKey, response: dict):
+        """Store a generated response, evicting the least recently used entries"""
+        with self._lock:
+            self._entries[key.digest] = (time.monotonic() + self.ttl_seconds, key, response)
+            self._entries.move_to_end(key.digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _expire(self, now: float):
+        """Drop expired entries (caller holds the lock)"""
+        for digest in [d for d, entry in self._entries.items() if entry[0] <= now]:
+            del self._entries[digest]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.similar_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": round((self.hits + self.similar_hits) / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+response_cache = ResponseCache(
+    ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES if RESPONSE_CACHE_ENABLED else 0,
+    similarity_threshold=RESPONSE_CACHE_SIMILARITY_THRESHOLD,
+    journey_similarity_threshold=RESPONSE_CACHE_JOURNEY_SIMILARITY_THRESHOLD
+)
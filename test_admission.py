@@ -0,0 +1,108 @@
+"""
+Tests for admission control in front of generation
+"""
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def test_admits_immediately_under_capacity():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=2, max_queued=0, max_queue_wait=1)
+        first = await controller.acquire()
+        second = await controller.acquire()
+        assert controller.in_flight == 2
+        first.release()
+        first.release()  # idempotent
+        second.release()
+        assert controller.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    async def scenario():
+        controller = AdmissionController(
+            max_in_flight=1, max_queued=1, max_queue_wait=5, service_time=lambda: 4.0
+        )
+        ticket = await controller.acquire()
+        waiting = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+        assert controller.queued == 1
+
+        with pytest.raises(AdmissionRejected) as excinfo:
+            await controller.acquire()
+        # One queued request plus the rejected one, 4 s each, one slot
+        assert excinfo.value.retry_after == 8
+        assert controller.stats()["rejected"] == 1
+
+        ticket.release()
+        (await waiting).release()
+        assert controller.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_queue_wait_timeout():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queued=4, max_queue_wait=0.01)
+        ticket = await controller.acquire()
+        with pytest.raises(AdmissionRejected):
+            await controller.acquire()
+        assert controller.queued == 0
+        assert controller.stats()["timed_out"] == 1
+        ticket.release()
+        assert controller.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_slots_are_handed_over_in_fifo_order():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queued=4, max_queue_wait=5)
+        order = []
+
+        async def worker(name):
+            ticket = await controller.acquire()
+            order.append(name)
+            await asyncio.sleep(0)
+            ticket.release()
+
+        ticket = await controller.acquire()
+        tasks = [asyncio.ensure_future(worker(name)) for name in ["a", "b", "c"]]
+        await asyncio.sleep(0)
+        ticket.release()
+        await asyncio.gather(*tasks)
+
+        assert order == ["a", "b", "c"]
+        assert controller.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_resize_admits_waiters_and_shrinks_on_release():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queued=4, max_queue_wait=5)
+        first = await controller.acquire()
+        waiting = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+        assert controller.queued == 1
+
+        # Model workers reported more capacity: the waiter gets a new slot
+        controller.resize(2)
+        second = await waiting
+        assert controller.in_flight == 2
+
+        # Capacity dropped: slots in use are given back instead of handed over
+        controller.resize(1)
+        queued = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+        first.release()
+        assert controller.in_flight == 1 and controller.queued == 1
+        second.release()
+        (await queued).release()
+        assert controller.in_flight == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,71 @@
+"""
+Tests for cached and stateless authenticated user lookups
+"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import auth
+from auth import create_access_token, get_current_user, invalidate_user_cache
+
+USER = {"id": "abc123", "name": "Test User", "email": "test@example.com", "password": "hashed"}
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    calls = []
+
+    async def get_user_by_email(email):
+        calls.append(email)
+        return dict(USER) if email.lower() == USER["email"] else None
+
+    monkeypatch.setattr(auth, "get_user_by_email", get_user_by_email)
+    invalidate_user_cache()
+    yield calls
+    invalidate_user_cache()
+
+
+def test_user_lookup_is_cached(lookups):
+    token = create_access_token({"sub": USER["email"]})
+
+    first = asyncio.run(get_current_user(token))
+    second = asyncio.run(get_current_user(token))
+
+    assert first == second == {"id": "abc123", "name": "Test User", "email": "test@example.com"}
+    assert len(lookups) == 1
+
+    invalidate_user_cache(USER["email"])
+    asyncio.run(get_current_user(token))
+    assert len(lookups) == 2
+
+
+def test_cache_expires(lookups, monkeypatch):
+    monkeypatch.setattr(auth, "USER_CACHE_TTL_SECONDS", 0)
+    token = create_access_token({"sub": USER["email"]})
+
+    asyncio.run(get_current_user(token))
+    asyncio.run(get_current_user(token))
+    assert len(lookups) == 2
+
+
+def test_stateless_mode_skips_database(lookups, monkeypatch):
+    monkeypatch.setattr(auth, "AUTH_STATELESS", True)
+    token = create_access_token({"sub": USER["email"], "name": USER["name"], "uid": USER["id"]})
+
+    user = asyncio.run(get_current_user(token))
+
+    assert user == {"id": "abc123", "name": "Test User", "email": "test@example.com"}
+    assert lookups == []
+
+    # No creation date in the token, so none is made up
+    info = asyncio.run(auth.get_current_user_info(user))
+    assert info.created_at is None
+    assert asyncio.run(auth.get_current_user_info(user)) == info
+
+
+def test_unknown_user_is_rejected(lookups):
+    token = create_access_token({"sub": "nobody@example.com"})
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(get_current_user(token))
+    assert excinfo.value.status_code == 401
@@ -0,0 +1,63 @@
+"""
+Tests for concurrent chat enrichment
+"""
+import asyncio
+import time
+
+import chat_enrichment
+from chat_enrichment import gather_enrichment
+from google_maps_service import JourneyResolution
+
+ROUTE = [{"summary": "I-95 N", "legs": [{
+    "distance": {"text": "215 mi"},
+    "duration": {"text": "3 hours 45 mins"},
+    "start_address": "New York, NY, USA",
+    "end_address": "Boston, MA, USA",
+}]}]
+
+
+def patch_stages(monkeypatch, history_delay, directions_delay):
+    async def get_conversation_history(user_email):
+        await asyncio.sleep(history_delay)
+        return [{"role": "user", "content": "earlier message"}]
+
+    async def resolve_journey_cached(origin, destination):
+        await asyncio.sleep(directions_delay)
+        return JourneyResolution(origin, destination, ROUTE)
+
+    monkeypatch.setattr(chat_enrichment, "get_conversation_history", get_conversation_history)
+    monkeypatch.setattr(chat_enrichment, "resolve_journey_cached", resolve_journey_cached)
+
+
+def test_stages_run_concurrently(monkeypatch):
+    patch_stages(monkeypatch, history_delay=0.2, directions_delay=0.2)
+
+    start = time.perf_counter()
+    enrichment = asyncio.run(gather_enrichment("a@example.com", ["Trip from New York to Boston"]))
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < 0.35
+    assert enrichment.history == [{"role": "user", "content": "earlier message"}]
+    assert enrichment.journey.origin == "New York"
+    assert enrichment.journey.found
+
+
+def test_slow_stage_is_skipped_after_deadline(monkeypatch):
+    patch_stages(monkeypatch, history_delay=0, directions_delay=1)
+    monkeypatch.setattr(chat_enrichment, "DIRECTIONS_TIMEOUT_SECONDS", 0.05)
+
+    enrichment = asyncio.run(gather_enrichment("a@example.com", ["from Paris to Lyon"]))
+
+    assert enrichment.history
+    assert enrichment.journey.destination == "Lyon"
+    assert not enrichment.journey.found
+    assert enrichment.journey.summary is None
+
+
+def test_no_journey_detected(monkeypatch):
+    patch_stages(monkeypatch, history_delay=0, directions_delay=0)
+
+    enrichment = asyncio.run(gather_enrichment("a@example.com", ["What should I pack?"]))
+
+    assert enrichment.journey is None
+    assert enrichment.journeys == []
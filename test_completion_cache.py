@@ -0,0 +1,130 @@
+"""
+Tests for the /v1/completions exact-match cache
+"""
+import asyncio
+
+from completion_cache import CompletionCache, is_deterministic
+
+GREEDY = {"max_tokens": 50, "temperature": 0.0, "top_p": 0.9, "top_k": 40, "repeat_penalty": 1.1, "stop": None}
+SAMPLED = dict(GREEDY, temperature=0.7)
+
+
+def make_cache(**kwargs):
+    cache = CompletionCache(**kwargs)
+    cache.model_identity = "model.gguf|llama-cpp"
+    return cache
+
+
+def test_only_deterministic_requests_are_cached():
+    cache = make_cache(max_entries=10, max_bytes=1 << 20)
+    assert is_deterministic(GREEDY)
+    assert is_deterministic(dict(SAMPLED, top_k=1))
+    assert not is_deterministic(SAMPLED)
+
+    assert cache.key_for("Summarize: Boston", GREEDY)
+    assert cache.key_for("Summarize: Boston", SAMPLED) is None
+    assert cache.stats()["skipped_nondeterministic"] == 1
+
+    permissive = make_cache(max_entries=10, max_bytes=1 << 20, deterministic_only=False)
+    assert permissive.key_for("Summarize: Boston", SAMPLED)
+
+
+def test_key_covers_prompt_parameters_and_model():
+    cache = make_cache(max_entries=10, max_bytes=1 << 20)
+    base = cache.key_for("Summarize: Boston", GREEDY)
+    assert cache.key_for("Summarize: Boston", dict(GREEDY)) == base
+    keys = {
+        base,
+        cache.key_for("Summarize: Boston ", GREEDY),
+        cache.key_for("Summarize: Boston", dict(GREEDY, max_tokens=51)),
+        cache.key_for("Summarize: Boston", dict(GREEDY, stop=["\n"])),
+    }
+    cache.model_identity = "other.gguf|llama-cpp"
+    keys.add(cache.key_for("Summarize: Boston", GREEDY))
+    assert len(keys) == 5
+
+
+def test_memory_tier_hits_and_evicts():
+    async def run():
+        cache = CompletionCache(max_entries=2, max_bytes=1 << 20)
+        for i in range(3):
+            await cache.put(f"k{i}", f"text {i}", 3, 10)
+        assert await cache.get("k0") is None
+        assert (await cache.get("k2"))["text"] == "text 2"
+        return cache.stats()
+
+    stats = asyncio.run(run())
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1
+    assert stats["memory_hits"] == 1 and stats["misses"] == 1
+
+
+def test_memory_tier_respects_byte_budget():
+    async def run():
+        cache = CompletionCache(max_entries=100, max_bytes=1000)
+        await cache.put("big", "x" * 2000, 500, 10)
+        for i in range(4):
+            await cache.put(f"k{i}", "y" * 300, 80, 10)
+        return cache, await cache.get("big")
+
+    cache, big = asyncio.run(run())
+    assert big is None
+    assert cache.stats()["bytes"] <= 1000
+    assert cache.stats()["entries"] < 4
+
+
+def test_sqlite_tier_survives_restart(tmp_path):
+    path = str(tmp_path / "completions.sqlite")
+
+    async def write():
+        cache = CompletionCache(max_entries=10, max_bytes=1 << 20, sqlite_path=path)
+        await cache.put("key", "Boston is 346 km away", 7, 20)
+        cache.close()
+
+    async def read():
+        cache = CompletionCache(max_entries=10, max_bytes=1 << 20, sqlite_path=path)
+        first = await cache.get("key")
+        second = await cache.get("key")
+        stats = cache.stats()
+        cache.close()
+        return first, second, stats
+
+    asyncio.run(write())
+    first, second, stats = asyncio.run(read())
+    assert first == {"text": "Boston is 346 km away", "completion_tokens": 7, "prompt_tokens": 20}
+    assert second == first
+    assert stats["disk_hits"] == 1 and stats["memory_hits"] == 1
+    assert stats["disk_entries"] == 1
+
+
+def test_disk_entries_counted_without_querying_sqlite(tmp_path):
+    async def run():
+        cache = CompletionCache(max_entries=0, max_bytes=1 << 20, sqlite_path=str(tmp_path / "c.sqlite"),
+                                sqlite_max_entries=3)
+        before = cache.stats()["disk_entries"]
+        await cache.put("a", "one", 1, 1)
+        await cache.put("a", "one again", 2, 1)
+        await cache.put("b", "two", 1, 1)
+        counted = cache.stats()["disk_entries"]
+        rewritten = await cache.get("a")
+        for i in range(97):  # the 100th write trims to sqlite_max_entries
+            await cache.put(f"k{i}", "x", 1, 1)
+        trimmed = cache.stats()["disk_entries"]
+        cache.close()
+        return before, counted, rewritten, trimmed
+
+    before, counted, rewritten, trimmed = asyncio.run(run())
+    assert before is None
+    assert counted == 2
+    assert rewritten["text"] == "one again"
+    assert trimmed == 3
+
+
+def test_disabled_cache_returns_no_key():
+    cache = make_cache(max_entries=0, max_bytes=1 << 20)
+    assert cache.key_for("Summarize: Boston", GREEDY) is None
+
+
+def test_no_caching_until_the_model_is_known():
+    cache = CompletionCache(max_entries=10, max_bytes=1 << 20)
+    assert cache.key_for("Summarize: Boston", GREEDY) is None
@@ -0,0 +1,64 @@
+"""
+Tests for token-budget history packing
+"""
+from context_assembler import ContextAssembler, TokenCounter, format_chat_message
+
+
+def word_tokenizer(calls):
+    def tokenize(text):
+        calls.append(text)
+        return text.split()
+    return tokenize
+
+
+def history(*contents):
+    return [{"role": "user", "content": c} for c in contents]
+
+
+def test_keeps_newest_history_that_fits():
+    counter = TokenCounter(word_tokenizer([]))
+    assembler = ContextAssembler(counter, n_ctx=70)
+    fixed = [("system", "travel agent"), ("user", "current question")]
+    messages = history("one " * 10, "two " * 10, "three " * 10)
+
+    message_cost = counter.count(format_chat_message("user", "two " * 10))
+    fixed_cost = assembler.count_messages(fixed) + 1  # plus the assistant header
+    budget = 70 - 20 - 16 - fixed_cost
+    assert message_cost < budget < 3 * message_cost
+
+    kept = assembler.select_history(messages, fixed, max_tokens=20)
+
+    expected = budget // message_cost
+    assert kept == messages[len(messages) - expected:]
+    assert kept[-1]["content"].startswith("three")
+    assert assembler.stats()["trimmed_messages"] == 3 - expected
+
+
+def test_short_history_is_kept_whole():
+    assembler = ContextAssembler(TokenCounter(word_tokenizer([])), n_ctx=2048)
+    messages = history("hi", "plan a trip", "thanks")
+    assert assembler.select_history(messages, [("system", "prompt")], max_tokens=100) == messages
+    assert assembler.stats()["trimmed_requests"] == 0
+
+
+def test_token_counts_are_cached():
+    calls = []
+    counter = TokenCounter(word_tokenizer(calls), max_entries=2)
+    assert counter.count("a b c") == 3
+    assert counter.count("a b c") == 3
+    assert len(calls) == 1
+    counter.count("d")
+    counter.count("e")
+    counter.count("a b c")
+    assert len(calls) == 4
+
+
+def test_prompt_count_is_sum_of_cached_segments():
+    calls = []
+    counter = TokenCounter(word_tokenizer(calls), bos_ids=[1])
+    segments = ["system prompt here", "user says hi", "assistant header"]
+
+    assert counter.count_prompt(segments) == 1 + 3 + 3 + 2
+    calls.clear()
+    counter.count_prompt(segments[:2] + ["user says more", "assistant header"])
+    assert calls == ["user says more"]
@@ -0,0 +1,163 @@
+"""
+Tests for the in-process conversation history cache
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import conversation_memory
+from conversation_memory import ConversationHotCache, get_conversation_history, store_message
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, field, direction):
+        self.docs = sorted(self.docs, key=lambda d: d[field], reverse=direction < 0)
+        return self
+
+    def limit(self, n):
+        self.docs = self.docs[:n]
+        return self
+
+    async def to_list(self, length):
+        return [{k: d[k] for k in ("role", "content", "timestamp")} for d in self.docs[:length]]
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = []
+        self.finds = 0
+
+    def find(self, query, projection):
+        self.finds += 1
+        return FakeCursor([d for d in self.docs if d["user_email"] == query["user_email"]])
+
+    async def insert_many(self, docs, ordered=True):
+        self.docs.extend(dict(doc) for doc in docs)
+        return FakeInsertResult(docs)
+
+
+class FakeInsertResult:
+    def __init__(self, docs):
+        self.inserted_ids = list(range(len(docs)))
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.conversation_history = FakeCollection()
+
+
+def setup(monkeypatch, capacity=3):
+    db = FakeDatabase()
+    cache = ConversationHotCache(capacity=capacity, ttl_seconds=60, max_users=10)
+    monkeypatch.setattr(conversation_memory, "get_database", lambda: db)
+    monkeypatch.setattr(conversation_memory, "history_cache", cache)
+    return db, cache
+
+
+def test_follow_up_reads_are_served_from_cache(monkeypatch):
+    db, cache = setup(monkeypatch)
+
+    async def scenario():
+        await store_message("A@example.com", "user", "first")
+        first = await get_conversation_history("a@example.com", limit=3)
+        await store_message("a@example.com", "user", "second")
+        await store_message("a@example.com", "user", "third")
+        await store_message("a@example.com", "user", "fourth")
+        second = await get_conversation_history("a@example.com", limit=3)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert [m["content"] for m in first] == ["first"]
+    assert [m["content"] for m in second] == ["second", "third", "fourth"]
+    assert db.conversation_history.finds == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_expired_messages_are_dropped():
+    cache = ConversationHotCache(capacity=5, ttl_seconds=60, max_users=10)
+    old = {"role": "user", "content": "old", "timestamp": datetime.utcnow() - timedelta(minutes=5)}
+    new = {"role": "user", "content": "new", "timestamp": datetime.utcnow()}
+    cache.load("a@example.com", [old, new], version=0)
+
+    assert [m["content"] for m in cache.get("a@example.com", 5)] == ["new"]
+
+
+def test_stale_read_is_not_cached():
+    cache = ConversationHotCache(capacity=5, ttl_seconds=60, max_users=10)
+    version = cache.version("a@example.com")
+    cache.append("a@example.com", {"role": "user", "content": "raced", "timestamp": datetime.utcnow()})
+    cache.load("a@example.com", [], version)
+
+    assert cache.get("a@example.com", 5) is None
+
+
+def test_users_are_evicted_lru():
+    cache = ConversationHotCache(capacity=5, ttl_seconds=60, max_users=2)
+    for user in ["a", "b", "c"]:
+        cache.load(user, [], version=0)
+    assert cache.get("a", 5) is None
+    assert cache.get("c", 5) == []
+
+
+def test_cached_history_is_reread_after_max_age():
+    """Writes by other processes show up once the cached buffer is max_age_seconds old"""
+    cache = ConversationHotCache(capacity=5, ttl_seconds=60, max_users=10, max_age_seconds=0.01)
+    cache.load("a@example.com", [], version=0)
+    assert cache.get("a@example.com", 5) == []
+
+    time.sleep(0.02)
+    assert cache.get("a@example.com", 5) is None
+    assert cache.stats()["refreshes"] == 1
+
+
+class FlushDuringReadCollection(FakeCollection):
+    """Flushes the write buffer while a query is running; stores milliseconds like MongoDB"""
+
+    def __init__(self, buffer, read_after_flush):
+        super().__init__()
+        self.buffer = buffer
+        self.read_after_flush = read_after_flush
+
+    def find(self, query, projection):
+        cursor = super().find(query, projection)
+        collection = self
+
+        class Cursor(FakeCursor):
+            async def to_list(self, length):
+                await collection.buffer.flush()
+                if collection.read_after_flush:
+                    self.docs = [d for d in collection.docs if d["user_email"] == query["user_email"]]
+                    self.sort("timestamp", -1)
+                return await super().to_list(length)
+
+        return Cursor(cursor.docs)
+
+    async def insert_many(self, docs, ordered=True):
+        for doc in docs:
+            doc = dict(doc)
+            doc["timestamp"] = doc["timestamp"].replace(microsecond=doc["timestamp"].microsecond // 1000 * 1000)
+            self.docs.append(doc)
+        return FakeInsertResult(docs)
+
+
+def test_read_racing_a_flush_returns_each_message_once(monkeypatch):
+    for read_after_flush in (False, True):
+        db, cache = setup(monkeypatch)
+        buffer = conversation_memory.ConversationWriteBuffer(batch_size=10, flush_interval=60, max_pending=100)
+        db.conversation_history = FlushDuringReadCollection(buffer, read_after_flush)
+        monkeypatch.setattr(conversation_memory, "write_buffer", buffer)
+
+        async def scenario():
+            await buffer.add({
+                "user_email": "a@example.com", "role": "user", "content": "to Boston",
+                "timestamp": datetime(2026, 1, 1, 12, 0, 0, 123456),
+            })
+            return await get_conversation_history("a@example.com")
+
+        history = asyncio.run(scenario())
+        assert [m["content"] for m in history] == ["to Boston"]
+        assert buffer.stats()["written"] == 1
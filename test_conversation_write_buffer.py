@@ -0,0 +1,266 @@
+"""
+Tests for the batched conversation-history write buffer
+"""
+import asyncio
+
+import conversation_memory
+from conversation_memory import ConversationWriteBuffer
+
+
+class FakeInsertResult:
+    def __init__(self, docs):
+        self.inserted_ids = list(range(len(docs)))
+
+
+class FakeCollection:
+    def __init__(self):
+        self.batches = []
+
+    async def insert_many(self, docs, ordered=True):
+        assert ordered is False
+        self.batches.append(list(docs))
+        return FakeInsertResult(docs)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.conversation_history = FakeCollection()
+
+
+def make_doc(user, content):
+    return {"user_email": user, "role": "user", "content": content}
+
+
+def test_messages_are_batched_and_flushed_on_stop(monkeypatch):
+    db = FakeDatabase()
+    monkeypatch.setattr(conversation_memory, "get_database", lambda: db)
+
+    async def scenario():
+        buffer = ConversationWriteBuffer(batch_size=10, flush_interval=60, max_pending=100)
+        buffer.start()
+        for i in range(5):
+            await buffer.add(make_doc("a@example.com", f"message {i}"))
+        assert len(buffer.pending_for("a@example.com")) == 5
+        assert db.conversation_history.batches == []
+        await buffer.stop()
+        return buffer
+
+    buffer = asyncio.run(scenario())
+
+    assert len(db.conversation_history.batches) == 1
+    assert len(db.conversation_history.batches[0]) == 5
+    assert buffer.stats()["written"] == 5
+    assert buffer.stats()["pending"] == 0
+
+
+def test_size_threshold_triggers_background_flush(monkeypatch):
+    db = FakeDatabase()
+    monkeypatch.setattr(conversation_memory, "get_database", lambda: db)
+
+    async def scenario():
+        buffer = ConversationWriteBuffer(batch_size=3, flush_interval=60, max_pending=100)
+        buffer.start()
+        for i in range(3):
+            await buffer.add(make_doc("a@example.com", f"message {i}"))
+        await asyncio.sleep(0.01)
+        batches = list(db.conversation_history.batches)
+        await buffer.stop()
+        return batches
+
+    assert [len(batch) for batch in asyncio.run(scenario())] == [3]
+
+
+def test_full_buffer_flushes_inline_and_discard(monkeypatch):
+    db = FakeDatabase()
+    monkeypatch.setattr(conversation_memory, "get_database", lambda: db)
+
+    async def scenario():
+        buffer = ConversationWriteBuffer(batch_size=2, flush_interval=60, max_pending=4)
+        await buffer.add(make_doc("a@example.com", "keep"))
+        await buffer.add(make_doc("b@example.com", "drop"))
+        assert buffer.discard("b@example.com") == 1
+        for i in range(3):
+            await buffer.add(make_doc("a@example.com", f"message {i}"))
+        return buffer
+
+    buffer = asyncio.run(scenario())
+
+    # Not started, but reaching max_pending still writes everything
+    assert sum(len(batch) for batch in db.conversation_history.batches) == 4
+    assert all(doc["user_email"] == "a@example.com" for batch in db.conversation_history.batches for doc in batch)
+    assert buffer.stats()["pending"] == 0
+
+
+class FakeSessionCollection:
+    def __init__(self):
+        self.requests = []
+
+    async def bulk_write(self, requests, ordered=True):
+        assert ordered is False
+        self.requests.extend(requests)
+
+
+def test_session_layout_writes_one_upsert_per_user(monkeypatch):
+    db = FakeDatabase()
+    db.conversation_sessions = FakeSessionCollection()
+    monkeypatch.setattr(conversation_memory, "get_database", lambda: db)
+    monkeypatch.setattr(conversation_memory, "CONVERSATION_STORAGE_LAYOUT", "session")
+
+    async def scenario():
+        buffer = ConversationWriteBuffer(batch_size=10, flush_interval=60, max_pending=100)
+        for user, content in [("a@example.com", "1"), ("b@example.com", "2"), ("a@example.com", "3")]:
+            doc = make_doc(user, content)
+            doc["timestamp"] = conversation_memory.datetime.utcnow()
+            await buffer.add(doc)
+        await buffer.flush()
+        return buffer
+
+    buffer = asyncio.run(scenario())
+
+    requests = db.conversation_sessions.requests
+    assert len(requests) == 2
+    messages = requests[0]._doc[0]["$set"]["messages"]["$slice"]
+    new_messages = messages[0]["$concatArrays"][1]["$filter"]["input"]["$literal"]
+    assert [m["content"] for m in new_messages] == ["1", "3"]
+    assert messages[1] == -conversation_memory.CONVERSATION_HISTORY_LIMIT
+    assert buffer.stats()["written"] == 3
+    assert db.conversation_history.batches == []
+
+
+class SlowCollection(FakeCollection):
+    """insert_many that takes a while, and fails the first `failures` calls"""
+
+    def __init__(self, delay=0.05, failures=0):
+        super().__init__()
+        self.delay = delay
+        self.failures = failures
+
+    async def insert_many(self, docs, ordered=True):
+        await asyncio.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("connection reset")
+        return await super().insert_many(docs, ordered=ordered)
+
+
+def test_stop_waits_for_the_batch_being_written(monkeypatch):
+    db = FakeDatabase()
+    db.conversation_history = SlowCollection()
+    monkeypatch.setattr(conversation_memory, "get_database", lambda: db)
+
+    async def scenario():
+        buffer = ConversationWriteBuffer(batch_size=2, flush_interval=60, max_pending=100)
+        buffer.start()
+        for i in range(3):
+            await buffer.add(make_doc("a@example.com", str(i)))
+        await asyncio.sleep(0.01)  # The first batch is now being written
+        assert len(buffer.pending_for("a@example.com")) == 3
+        await buffer.stop()
+        return buffer
+
+    buffer = asyncio.run(scenario())
+
+    written = [doc["content"] for batch in db.conversation_history.batches for doc in batch]
+    assert written == ["0", "1", "2"]
+    assert buffer.stats()["written"] == 3
+
+
+def test_failed_batch_is_retried_first(monkeypatch):
+    db = FakeDatabase()
+    db.conversation_history = SlowCollection(delay=0, failures=1)
+    monkeypatch.setattr(conversation_memory, "get_database", lambda: db)
+
+    async def scenario():
+        buffer = ConversationWriteBuffer(batch_size=2, flush_interval=60, max_pending=100)
+        for i in range(3):
+            await buffer.add(make_doc("a@example.com", str(i)))
+        await buffer.flush()
+        # The failed batch is back at the head of the queue, still visible to readers
+        assert [doc["content"] for doc in buffer.pending_for("a@example.com")] == ["0", "1", "2"]
+        await buffer.flush()
+        return buffer
+
+    buffer = asyncio.run(scenario())
+
+    assert [[doc["content"] for doc in batch] for batch in db.conversation_history.batches] == [["0", "1"], ["2"]]
+    stats = buffer.stats()
+    assert stats["written"] == 3
+    assert stats["retried"] == 2
+    assert stats["failed"] == 0
+
+
+def test_messages_are_dropped_after_max_attempts(monkeypatch):
+    db = FakeDatabase()
+    db.conversation_history = SlowCollection(delay=0, failures=10)
+    monkeypatch.setattr(conversation_memory, "get_database", lambda: db)
+
+    async def scenario():
+        buffer = ConversationWriteBuffer(batch_size=10, flush_interval=60, max_pending=100, max_attempts=2)
+        buffer.start()
+        await buffer.add(make_doc("a@example.com", "lost"))
+        await buffer.stop()
+        return buffer
+
+    stats = asyncio.run(scenario()).stats()
+    assert stats["failed"] == 1
+    assert stats["pending"] == 0
+
+
+def test_buffer_stays_bounded_while_the_database_is_down(monkeypatch):
+    monkeypatch.setattr(conversation_memory, "get_database", lambda: None)
+
+    async def scenario():
+        buffer = ConversationWriteBuffer(batch_size=2, flush_interval=60, max_pending=4)
+        for i in range(10):
+            await buffer.add(make_doc("a@example.com", str(i)))
+        return buffer
+
+    buffer = asyncio.run(scenario())
+
+    # The newest messages are kept; the oldest are counted as lost
+    assert [doc["content"] for doc in buffer.pending_for("a@example.com")] == ["6", "7", "8", "9"]
+    stats = buffer.stats()
+    assert stats["pending"] == 4
+    assert stats["failed"] == 6
+
+
+class FlakySessionCollection(FakeSessionCollection):
+    """bulk_write that times out once after the server may have applied it"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    async def bulk_write(self, requests, ordered=True):
+        self.calls += 1
+        await super().bulk_write(requests, ordered=ordered)
+        if self.calls == 1:
+            raise TimeoutError("operation timed out")
+
+
+def test_session_retry_writes_the_same_message_ids(monkeypatch):
+    db = FakeDatabase()
+    db.conversation_sessions = FlakySessionCollection()
+    monkeypatch.setattr(conversation_memory, "get_database", lambda: db)
+    monkeypatch.setattr(conversation_memory, "CONVERSATION_STORAGE_LAYOUT", "session")
+
+    async def scenario():
+        buffer = ConversationWriteBuffer(batch_size=10, flush_interval=60, max_pending=100)
+        doc = make_doc("a@example.com", "to Boston")
+        doc["timestamp"] = conversation_memory.datetime.utcnow()
+        await buffer.add(doc)
+        await buffer.flush()
+        await buffer.flush()
+        return buffer
+
+    buffer = asyncio.run(scenario())
+
+    attempts = []
+    for request in db.conversation_sessions.requests:
+        stage = request._doc[0]["$set"]
+        new_messages = stage["messages"]["$slice"][0]["$concatArrays"][1]["$filter"]
+        # Messages already in the session (by id) are filtered out, so the retry is a no-op there
+        assert new_messages["cond"] == {"$not": [{"$in": ["$$this.id", {"$ifNull": ["$messages.id", []]}]}]}
+        attempts.append([m["id"] for m in new_messages["input"]["$literal"]])
+    assert len(attempts) == 2 and attempts[0] == attempts[1] and attempts[0][0] is not None
+    assert buffer.stats()["written"] == 1
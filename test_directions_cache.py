@@ -0,0 +1,60 @@
+"""
+Tests for the Google Directions result cache
+"""
+import asyncio
+import time
+from datetime import datetime
+
+import directions_cache as cache_module
+from directions_cache import DirectionsCache, get_directions_cached, make_cache_key
+
+ROUTE = [{"summary": "I-95 N", "legs": []}]
+
+
+def test_cache_key_normalization_and_buckets():
+    departure = datetime(2026, 1, 1, 12, 0)
+    key = make_cache_key("  New   York ", "BOSTON", "driving", departure, bucket_minutes=15)
+    assert key == make_cache_key("new york", "boston", "Driving", departure.replace(minute=14), bucket_minutes=15)
+    assert key != make_cache_key("new york", "boston", "driving", departure.replace(minute=15), bucket_minutes=15)
+    assert key != make_cache_key("new york", "boston", "transit", departure, bucket_minutes=15)
+
+
+def test_ttl_and_lru_eviction():
+    cache = DirectionsCache(ttl_seconds=60, max_entries=2)
+    cache.put("a", ROUTE)
+    cache.put("b", ROUTE)
+    cache.get("a")
+    cache.put("c", ROUTE)
+    assert cache.get("b") is None
+    assert cache.get("a") == ROUTE
+    assert cache.stats()["evictions"] == 1
+
+    cache.ttl_seconds = 0.01
+    time.sleep(0.02)
+    assert cache.get("a") is None
+
+
+def test_get_directions_cached_calls_api_once(monkeypatch):
+    calls = []
+
+    async def fake_get_directions(origin, destination, **kwargs):
+        calls.append((origin, destination))
+        return ROUTE
+
+    cache = DirectionsCache(ttl_seconds=60, max_entries=10)
+    monkeypatch.setattr(cache_module, "directions_cache", cache)
+    monkeypatch.setattr(cache_module, "get_directions", fake_get_directions)
+
+    async def scenario():
+        first = await get_directions_cached("New York", "Boston")
+        second = await get_directions_cached("new york ", " boston")
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert first == second == ROUTE
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
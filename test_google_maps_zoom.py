@@ -1,7 +1,9 @@
 """
 Tests for Google Maps service zoom functionality
 """
+import asyncio
 import pytest
+import google_maps_service
 from google_maps_service import generate_map_image_url
 import os
 from dotenv import load_dotenv
@@ -15,9 +17,16 @@ pytestmark = pytest.mark.skipif(
 )
 
 
+@pytest.fixture(autouse=True)
+def fresh_maps_client():
+    """Each asyncio.run() gets its own event loop, so don't reuse pooled connections"""
+    yield
+    google_maps_service.maps_client = None
+
+
 def test_generate_map_url_default_zoom():
     """Test map URL generation with default (auto) zoom"""
-    url = generate_map_image_url("New York", "Boston")
+    url = asyncio.run(generate_map_image_url("New York", "Boston"))
     
     assert url is not None
     assert "maps.googleapis.com/maps/api/staticmap" in url
@@ -31,7 +40,7 @@ def test_generate_map_url_default_zoom():
 
 def test_generate_map_url_with_zoom():
     """Test map URL generation with custom zoom level"""
-    url = generate_map_image_url("New York", "Boston", zoom=10)
+    url = asyncio.run(generate_map_image_url("New York", "Boston", zoom=10))
     
     assert url is not None
     assert "zoom=10" in url
@@ -41,21 +50,21 @@ def test_generate_map_url_with_zoom():
 def test_generate_map_url_zoom_validation():
     """Test that zoom levels are validated and clamped"""
     # Test minimum zoom (should clamp to 1)
-    url_min = generate_map_image_url("New York", "Boston", zoom=0)
+    url_min = asyncio.run(generate_map_image_url("New York", "Boston", zoom=0))
     assert "zoom=1" in url_min
     
     # Test maximum zoom (should clamp to 21)
-    url_max = generate_map_image_url("New York", "Boston", zoom=25)
+    url_max = asyncio.run(generate_map_image_url("New York", "Boston", zoom=25))
     assert "zoom=21" in url_max
     
     # Test valid zoom
-    url_valid = generate_map_image_url("New York", "Boston", zoom=15)
+    url_valid = asyncio.run(generate_map_image_url("New York", "Boston", zoom=15))
     assert "zoom=15" in url_valid
 
 
 def test_generate_map_url_custom_size():
     """Test map URL generation with custom size"""
-    url = generate_map_image_url("New York", "Boston", size="800x600", zoom=12)
+    url = asyncio.run(generate_map_image_url("New York", "Boston", size="800x600", zoom=12))
     
     assert url is not None
     assert "size=800x600" in url
@@ -64,7 +73,7 @@ def test_generate_map_url_custom_size():
 
 def test_generate_map_url_scale_parameter():
     """Test that scale parameter is included"""
-    url = generate_map_image_url("New York", "Boston", scale=1)
+    url = asyncio.run(generate_map_image_url("New York", "Boston", scale=1))
     
     assert url is not None
     assert "scale=1" in url
@@ -72,7 +81,7 @@ def test_generate_map_url_scale_parameter():
 
 def test_generate_map_url_with_polyline():
     """Test that polyline is included in the URL"""
-    url = generate_map_image_url("New York", "Boston", zoom=10)
+    url = asyncio.run(generate_map_image_url("New York", "Boston", zoom=10))
     
     assert url is not None
     # Should have path parameter with encoded polyline
@@ -0,0 +1,65 @@
+"""
+Tests for resolving a journey with a single Directions API call
+"""
+import asyncio
+
+import directions_cache
+import google_maps_service
+from directions_cache import DirectionsCache, resolve_journey_cached
+
+SAMPLE_DIRECTIONS = [{
+    "summary": "I-95 N",
+    "bounds": {
+        "northeast": {"lat": 42.0, "lng": -71.0},
+        "southwest": {"lat": 40.0, "lng": -74.0},
+    },
+    "overview_polyline": {"points": "abc123"},
+    "legs": [{
+        "distance": {"text": "215 mi"},
+        "duration": {"text": "3 hours 45 mins"},
+        "start_address": "New York, NY, USA",
+        "end_address": "Boston, MA, USA",
+    }],
+}]
+
+
+def fake_directions(monkeypatch, result):
+    calls = []
+
+    async def get_directions(origin, destination, **kwargs):
+        calls.append((origin, destination))
+        return result
+
+    monkeypatch.setattr(directions_cache, "get_directions", get_directions)
+    monkeypatch.setattr(directions_cache, "directions_cache", DirectionsCache(ttl_seconds=60, max_entries=10))
+    monkeypatch.setattr(google_maps_service, "GOOGLE_MAPS_API_KEY", "test-key")
+    return calls
+
+
+def test_summary_and_map_share_one_directions_call(monkeypatch):
+    calls = fake_directions(monkeypatch, SAMPLE_DIRECTIONS)
+
+    journey = asyncio.run(resolve_journey_cached("New York", "Boston"))
+    summary = journey.summary
+    url = journey.map_image_url()
+    zoomed_url = journey.map_image_url(zoom=10)
+
+    assert calls == [("New York", "Boston")]
+    assert "Distance: 215 mi" in summary
+    assert "path=weight:3|color:0x0000ff|enc:abc123" in url
+    assert "center=41.0,-72.5" in zoomed_url
+    # Formatted once when the journey is resolved
+    assert journey.summary is summary
+
+
+def test_failed_lookup_is_not_retried(monkeypatch):
+    calls = fake_directions(monkeypatch, None)
+
+    journey = asyncio.run(resolve_journey_cached("Nowhere", "Elsewhere"))
+
+    assert not journey.found
+    assert journey.summary is None
+    url = journey.map_image_url(zoom=5)
+    assert "center=Nowhere" in url
+    assert "path=" not in url
+    assert len(calls) == 1
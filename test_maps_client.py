@@ -0,0 +1,111 @@
+"""
+Tests for the async Google Maps client against a local stub server
+"""
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from maps_client import MapsApiError, MapsClient
+
+
+class StubMapsHandler(BaseHTTPRequestHandler):
+    """Serves canned Directions / Distance Matrix responses"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        server = self.server
+        server.requests.append((url.path, params))
+
+        if server.failures_left > 0:
+            server.failures_left -= 1
+            self.respond(503, {"status": "UNAVAILABLE"})
+        elif params.get("origin") == "Nowhere":
+            self.respond(200, {"status": "REQUEST_DENIED", "error_message": "bad request"})
+        elif url.path == "/maps/api/directions/json":
+            self.respond(200, {"status": "OK", "routes": [{"summary": "I-95 N"}]})
+        elif url.path == "/maps/api/distancematrix/json":
+            self.respond(200, {"status": "OK", "rows": [{"elements": []}]})
+        else:
+            self.respond(404, {})
+
+    def respond(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubMapsHandler)
+    server.requests = []
+    server.failures_left = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(server, **kwargs):
+    host, port = server.server_address
+    return MapsClient(api_key="test-key", base_url=f"http://{host}:{port}", backoff_base=0.01, **kwargs)
+
+
+def test_directions_and_distance_matrix(stub_server):
+    async def scenario():
+        client = make_client(stub_server)
+        try:
+            routes = await client.directions("New York", "Boston", alternatives=True, traffic_model="best_guess")
+            matrix = await client.distance_matrix(["New York", "Albany"], ["Boston"])
+        finally:
+            await client.aclose()
+        return routes, matrix
+
+    routes, matrix = asyncio.run(scenario())
+
+    assert routes == [{"summary": "I-95 N"}]
+    assert matrix["rows"] == [{"elements": []}]
+    path, params = stub_server.requests[0]
+    assert params["key"] == "test-key"
+    assert params["alternatives"] == "true"
+    assert params["traffic_model"] == "best_guess"
+    assert stub_server.requests[1][1]["origins"] == "New York|Albany"
+
+
+def test_retries_transient_failures(stub_server):
+    stub_server.failures_left = 2
+
+    async def scenario():
+        client = make_client(stub_server, max_retries=2)
+        try:
+            return await client.directions("New York", "Boston")
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(scenario()) == [{"summary": "I-95 N"}]
+    assert len(stub_server.requests) == 3
+
+
+def test_api_error_status_is_raised(stub_server):
+    async def scenario():
+        client = make_client(stub_server)
+        try:
+            await client.directions("Nowhere", "Boston")
+        finally:
+            await client.aclose()
+
+    with pytest.raises(MapsApiError) as excinfo:
+        asyncio.run(scenario())
+    assert excinfo.value.status == "REQUEST_DENIED"
+    assert len(stub_server.requests) == 1
@@ -0,0 +1,81 @@
+"""
+Tests for the persisted backend manifest that skips loader probing
+"""
+import json
+import os
+
+import pytest
+
+import model_loader
+
+
+@pytest.fixture
+def model_file(tmp_path, monkeypatch):
+    path = tmp_path / "model.gguf"
+    path.write_bytes(b"GGUF" + b"\0" * 64)
+    monkeypatch.setattr(model_loader, "MODEL_PATH", str(path))
+    monkeypatch.setattr(model_loader, "MODEL_MANIFEST_PATH", None)
+    monkeypatch.setattr(model_loader, "ctransformers_available", True)
+    monkeypatch.setattr(model_loader, "llama_cpp_available", True)
+    monkeypatch.setattr(model_loader, "_backends_detected", True)
+    return path
+
+
+@pytest.fixture
+def attempts(monkeypatch):
+    """Only the from_pretrained loader with model_type=None succeeds"""
+    calls = []
+
+    def fake_load(config):
+        calls.append(dict(config))
+        if config["backend"] == "ctransformers" and (config["model_type"] or config["loader"] != "from_pretrained"):
+            raise RuntimeError("unsupported model type")
+        return object()
+
+    monkeypatch.setattr(model_loader, "load_model_from_config", fake_load)
+    return calls
+
+
+def test_probe_writes_manifest_used_by_next_boot(model_file, attempts):
+    _, config = model_loader.load_model(use_ctransformers=True)
+    assert len(attempts) > 1
+    assert os.path.exists(f"{model_file}.backend.json")
+
+    attempts.clear()
+    _, cached_config = model_loader.load_model(use_ctransformers=True)
+    assert cached_config == config
+    assert attempts == [config]
+
+
+def test_manifest_is_stale_when_model_file_changes(model_file, attempts):
+    model_loader.load_model(use_ctransformers=True)
+    model_file.write_bytes(b"GGUF" + b"\1" * 128)
+
+    assert model_loader.read_manifest() is None
+    attempts.clear()
+    model_loader.load_model(use_ctransformers=True)
+    assert len(attempts) > 1
+
+
+def test_failed_manifest_config_falls_back_to_probing(model_file, attempts):
+    model_loader.write_manifest({"backend": "ctransformers", "loader": "model_file", "model_type": "llama", "local_files_only": True})
+
+    _, config = model_loader.load_model(use_ctransformers=True)
+    assert config["model_type"] is None
+    with open(f"{model_file}.backend.json") as f:
+        assert json.load(f)["config"] == config
+
+
+def test_manifest_respects_backend_preference(model_file, attempts):
+    model_loader.write_manifest({"backend": "ctransformers", "loader": "from_pretrained", "model_type": None, "local_files_only": False})
+
+    _, config = model_loader.load_model(use_ctransformers=False)
+    assert config == {"backend": "llama-cpp"}
+    assert attempts == [{"backend": "llama-cpp"}]
+
+
+def test_manifest_can_be_disabled(model_file, attempts, monkeypatch):
+    monkeypatch.setattr(model_loader, "MODEL_MANIFEST_PATH", "")
+    model_loader.load_model(use_ctransformers=True)
+    assert not os.path.exists(f"{model_file}.backend.json")
+    assert model_loader.read_manifest() is None
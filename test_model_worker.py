@@ -0,0 +1,148 @@
+"""
+Tests for the split deployment: RemoteInferencePool talking to model_worker's app
+"""
+import asyncio
+
+import httpx
+import pytest
+
+import model_worker
+from context_assembler import ContextAssembler, TokenCounter
+from inference_executor import InferenceExecutorPool
+from model_runtime import ModelRuntime
+from model_warmup import model_warmup
+from model_worker_client import ModelWorkerError, RemoteInferencePool
+
+
+class FakeModel:
+    """ctransformers-style model answering with a fixed reply"""
+
+    def __call__(self, prompt, **kwargs):
+        if kwargs.get("stream"):
+            return iter(["Visit ", "Oxford"])
+        return "Visit Oxford"
+
+    def tokenize(self, text, add_bos_token=None):
+        return text.split()
+
+
+@pytest.fixture
+def worker_runtime():
+    pool = InferenceExecutorPool.from_models([FakeModel()], use_ctransformers=True)
+    assembler = ContextAssembler(TokenCounter(lambda text: text.split()), n_ctx=60)
+    model_worker.runtime = ModelRuntime(pool, assembler, use_ctransformers=True)
+    yield model_worker.runtime
+    model_worker.runtime = None
+    pool.shutdown()
+
+
+def remote_pool(*paths):
+    transports = {path: httpx.ASGITransport(app=model_worker.app) for path in paths}
+    return RemoteInferencePool(list(paths), transports=transports)
+
+
+SAMPLING = {"max_tokens": 8, "temperature": 0.5, "top_p": 0.9, "top_k": 40, "repeat_penalty": 1.1, "stop": None}
+
+
+def test_generate_through_worker(worker_runtime):
+    async def scenario():
+        pool = remote_pool("/tmp/worker-0.sock")
+        result = await pool.generate("plan a trip", cache_key="alice", prompt_ids=[1, 2], **SAMPLING)
+        await pool.aclose()
+        return pool, result
+
+    pool, result = asyncio.run(scenario())
+    assert result.text == "Visit Oxford"
+    assert result.completion_tokens == 2
+    # ctransformers does not report prompt tokens, so the worker counts them
+    assert result.prompt_tokens == 3
+    assert pool.stats.snapshot()["completed"] == 1
+    assert pool.pending == 0
+
+
+def test_stream_through_worker(worker_runtime):
+    async def scenario():
+        pool = remote_pool("/tmp/worker-0.sock")
+        generation = pool.stream("plan a trip", **SAMPLING)
+        pieces = [piece async for piece in generation]
+        await pool.aclose()
+        return generation, pieces
+
+    generation, pieces = asyncio.run(scenario())
+    assert pieces == ["Visit ", "Oxford"]
+    assert generation.result.text == "Visit Oxford"
+    assert generation.result.completion_tokens == 2
+    assert generation.result.prompt_tokens == 3
+
+
+def test_history_selection_runs_on_worker(worker_runtime):
+    history = [{"role": "user", "content": f"message {i} " * 5, "timestamp": object()} for i in range(6)]
+
+    async def scenario():
+        pool = remote_pool("/tmp/worker-0.sock")
+        kept = await pool.select_history(history, [("system", "travel agent")], max_tokens=10)
+        await pool.aclose()
+        return kept
+
+    kept = asyncio.run(scenario())
+    expected = worker_runtime.context_assembler.select_history(history, [("system", "travel agent")], 10)
+    assert kept == expected
+    assert 0 < len(kept) < len(history)
+
+
+def test_health_and_unloaded_worker():
+    async def scenario():
+        pool = remote_pool("/tmp/worker-0.sock")
+        health = await pool.health()
+        with pytest.raises(ModelWorkerError):
+            await pool.generate("plan a trip", **SAMPLING)
+        await pool.aclose()
+        return health
+
+    health = asyncio.run(scenario())
+    assert health[0]["status"] == "loading"
+    assert health[0]["socket"] == "/tmp/worker-0.sock"
+
+
+def test_ready_worker_health(worker_runtime):
+    model_warmup.skip()
+    try:
+        async def scenario():
+            pool = remote_pool("/tmp/worker-0.sock")
+            health = await pool.health()
+            await pool.aclose()
+            return health
+
+        assert asyncio.run(scenario())[0]["status"] == "ready"
+    finally:
+        model_warmup.status = "pending"
+
+
+def test_requests_go_to_least_busy_worker():
+    pool = remote_pool("/tmp/worker-0.sock", "/tmp/worker-1.sock")
+    first = pool.acquire()
+    first.pending += 1
+    assert pool.acquire() is not first
+    assert pool.occupancy() == {"size": 2, "workers": 2, "busy": 1, "pending": [1, 0], "remote": True}
+
+
+def test_handshake_reports_model_and_capacity(worker_runtime):
+    """Identity and capacity come from the workers, not the API process's MODEL_PATH"""
+    async def scenario():
+        pool = remote_pool("/tmp/worker-0.sock", "/tmp/worker-1.sock")
+        before = pool.model_identity
+        await pool.health()
+        after_health = pool.model_identity
+        # The worker's model is swapped; the next generation reports the new one
+        worker_runtime.model_identity = "other.gguf|llama-cpp"
+        for worker in pool.workers:
+            await pool.generate("plan a trip", **SAMPLING)
+        await pool.aclose()
+        return pool, before, after_health
+
+    pool, before, after_health = asyncio.run(scenario())
+    assert before is None
+    assert after_health.endswith("|ctransformers")
+    assert pool.model_identity == "other.gguf|llama-cpp"
+    assert pool.capacity() == 2
+    assert pool.occupancy()["size"] == 2
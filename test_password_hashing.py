@@ -0,0 +1,31 @@
+"""
+Tests for off-loop bcrypt hashing and rehash detection
+"""
+import asyncio
+
+import auth
+from auth import get_password_hash, get_password_hash_async, password_needs_rehash, verify_password_async
+
+
+def test_async_hash_and_verify_roundtrip(monkeypatch):
+    monkeypatch.setattr(auth, "BCRYPT_ROUNDS", 4)
+
+    async def scenario():
+        hashed = await get_password_hash_async("secret123")
+        ok = await verify_password_async("secret123", hashed)
+        bad = await verify_password_async("wrong", hashed)
+        return hashed, ok, bad
+
+    hashed, ok, bad = asyncio.run(scenario())
+    assert hashed.startswith("$2b$04$")
+    assert ok and not bad
+
+
+def test_password_needs_rehash_when_cost_changes(monkeypatch):
+    monkeypatch.setattr(auth, "BCRYPT_ROUNDS", 4)
+    hashed = get_password_hash("secret123")
+    assert not password_needs_rehash(hashed)
+
+    monkeypatch.setattr(auth, "BCRYPT_ROUNDS", 5)
+    assert password_needs_rehash(hashed)
+    assert not password_needs_rehash("not-a-bcrypt-hash")
@@ -0,0 +1,81 @@
+"""
+Tests for per-process memory accounting of shared model pages
+"""
+import json
+import mmap
+import os
+
+import pytest
+
+from process_memory import child_pids, preload_model_pages, read_mapping_memory, read_memory
+
+pytestmark = pytest.mark.skipif(
+    not os.path.exists("/proc/self/smaps_rollup") or not hasattr(os, "fork"),
+    reason="needs Linux /proc smaps and fork"
+)
+
+FILE_SIZE = 8 * 1024 * 1024
+
+
+def touch(mapping):
+    """Fault in every page of a mapping, as generation does with the weights"""
+    return sum(mapping[offset] for offset in range(0, len(mapping), mmap.PAGESIZE))
+
+
+@pytest.fixture
+def model_file(tmp_path):
+    path = tmp_path / "model.gguf"
+    path.write_bytes(os.urandom(FILE_SIZE))
+    return str(path)
+
+
+def test_read_memory_reports_rss_and_pss():
+    memory = read_memory()
+    assert memory["rss_kb"] > 0
+    assert 0 < memory["pss_kb"] <= memory["rss_kb"]
+
+
+def test_forked_workers_share_model_pages(model_file):
+    """RSS counts the mapped weights in every worker; PSS splits them between workers"""
+    assert preload_model_pages(model_file)
+
+    with open(model_file, "rb") as f:
+        parent_mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    touch(parent_mapping)
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # Worker: its backend maps the model file again and reads every page
+        try:
+            with open(model_file, "rb") as f:
+                worker_mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            touch(worker_mapping)
+            os.write(write_fd, json.dumps(read_mapping_memory(model_file)).encode())
+        finally:
+            os._exit(0)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        worker = json.loads(f.read())
+    os.waitpid(pid, 0)
+    parent_mapping.close()
+
+    size_kb = FILE_SIZE // 1024
+    assert worker["rss_kb"] >= size_kb
+    # No private copy of the weights in the worker
+    assert worker.get("private_dirty_kb", 0) == 0
+    # At least the parent and the worker hold the same pages
+    assert worker["pss_kb"] <= worker["rss_kb"] * 0.6
+
+
+def test_child_pids():
+    pid = os.fork()
+    if pid == 0:
+        os.read(os.pipe()[0], 1)  # Block until killed
+        os._exit(0)
+    try:
+        assert pid in child_pids(os.getpid())
+    finally:
+        os.kill(pid, 9)
+        os.waitpid(pid, 0)
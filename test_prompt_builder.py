@@ -0,0 +1,73 @@
+"""
+Tests for incremental Llama-3 prompt construction
+"""
+from types import SimpleNamespace
+
+from context_assembler import TokenCounter
+from prompt_builder import (
+    ASSISTANT_HEADER,
+    PromptBuilder,
+    format_system_prefix,
+    strip_prompt_echo
+)
+
+
+def message(role, content):
+    return SimpleNamespace(role=role, content=content)
+
+
+def test_segments_follow_llama3_template():
+    messages = [
+        message("system", "You are a travel agent"),
+        message("user", "Plan a trip"),
+        message("system", "[JOURNEY DATA]"),
+        message("tool", "ignored"),
+    ]
+    segments = PromptBuilder().add_messages(messages).finish().segments
+
+    assert segments[0] == format_system_prefix("You are a travel agent")
+    assert segments[1] == "<|start_header_id|>user<|end_header_id|>\n\nPlan a trip<|eot_id|>"
+    assert not segments[2].startswith("<|begin_of_text|>")
+    assert segments[-1] == ASSISTANT_HEADER
+    assert len(segments) == 4
+
+
+def test_text_is_cached_until_the_prompt_changes():
+    builder = PromptBuilder().add("system", "prompt")
+    first = builder.text
+    assert builder.text is first
+
+    builder.add("user", "hi").finish()
+    assert builder.text == first + "<|start_header_id|>user<|end_header_id|>\n\nhi<|eot_id|>" + ASSISTANT_HEADER
+
+
+def test_token_ids_reuse_cached_segment_tokens():
+    """Only segments not seen before are tokenized; BOS comes from the counter"""
+    calls = []
+
+    def tokenize(text):
+        calls.append(text)
+        return [len(word) for word in text.split()]
+
+    counter = TokenCounter(tokenize, bos_ids=[128000])
+    first = PromptBuilder().add("system", "travel agent").add("user", "hi").finish()
+    ids = first.token_ids(counter)
+
+    assert ids[0] == 128000
+    assert len(ids) == counter.count_prompt(first.segments)
+    assert ids[1:] == [t for segment in first.segments for t in tokenize(segment)]
+
+    calls.clear()
+    follow_up = PromptBuilder().add("system", "travel agent").add("user", "hi").add("user", "more").finish()
+    follow_up.token_ids(counter)
+    assert calls == ["<|start_header_id|>user<|end_header_id|>\n\nmore<|eot_id|>"]
+
+
+def test_strip_prompt_echo():
+    prompt = PromptBuilder().add("system", "prompt").add("user", "hi").finish().text
+
+    assert strip_prompt_echo(prompt + " Hello!", len(prompt)) == "Hello!"
+    assert strip_prompt_echo("Hello!", len(prompt)) == "Hello!"
+    # A long answer that does not echo the prompt is returned unchanged
+    answer = "x" * (len(prompt) + 10)
+    assert strip_prompt_echo(answer, len(prompt)) == answer
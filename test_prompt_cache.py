@@ -0,0 +1,206 @@
+"""
+Tests for model state caching of evaluated prompt prefixes
+"""
+import time
+
+from prompt_cache import ConversationStateCache, PrefixStateCache
+
+
+class FakeArray(list):
+    """Minimal stand-in for the numpy input_ids array"""
+
+    def tolist(self):
+        return list(self)
+
+    def __getitem__(self, item):
+        result = super().__getitem__(item)
+        return FakeArray(result) if isinstance(item, slice) else result
+
+
+class FakeState:
+    def __init__(self, input_ids, n_tokens):
+        self.input_ids = FakeArray(input_ids)
+        self.n_tokens = n_tokens
+        self.scores = None
+        self.llama_state_size = 1024 * n_tokens
+
+
+class FakeLlamaModel:
+    """Character-level 'tokenizer' with an inspectable context"""
+
+    def __init__(self):
+        self.input_ids = FakeArray()
+        self.n_tokens = 0
+        self.evaluated = 0
+        self.loads = 0
+
+    def tokenize(self, text, add_bos=True, special=False):
+        return [ord(c) for c in text.decode("utf-8")]
+
+    def reset(self):
+        self.n_tokens = 0
+
+    def eval(self, tokens):
+        self.input_ids = FakeArray(list(self.input_ids[:self.n_tokens]) + list(tokens))
+        self.n_tokens += len(tokens)
+        self.evaluated += len(tokens)
+
+    def save_state(self):
+        return FakeState(list(self.input_ids), self.n_tokens)
+
+    def load_state(self, state):
+        self.input_ids = FakeArray(state.input_ids)
+        self.n_tokens = state.n_tokens
+        self.loads += 1
+
+
+def test_prime_and_restore_llama_cpp():
+    """The prefix is evaluated once and reloaded when the context moved on"""
+    model = FakeLlamaModel()
+    cache = PrefixStateCache("SYSTEM", use_ctransformers=False)
+
+    assert cache.prime(model)
+    assert model.evaluated == len("SYSTEM")
+
+    # Context still holds the prefix: no reload needed
+    assert cache.restore(model, "SYSTEM user turn")
+    assert model.loads == 0
+
+    # An unrelated prompt replaced the context: state is reloaded
+    model.reset()
+    model.eval([ord(c) for c in "other prompt"])
+    assert cache.restore(model, "SYSTEM next turn")
+    assert model.loads == 1
+    assert model.input_ids[:6].tolist() == [ord(c) for c in "SYSTEM"]
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["restores"] == 1
+    assert stats["misses"] == 0
+
+
+def test_restore_skips_prompts_without_prefix():
+    """Prompts that do not start with the prefix are left alone"""
+    model = FakeLlamaModel()
+    cache = PrefixStateCache("SYSTEM", use_ctransformers=False)
+    cache.prime(model)
+
+    model.reset()
+    assert not cache.restore(model, "free-form completion prompt")
+    assert model.loads == 0
+    assert cache.stats()["misses"] == 1
+
+
+def test_restore_before_prime_is_a_miss():
+    cache = PrefixStateCache("SYSTEM", use_ctransformers=False)
+    assert not cache.restore(FakeLlamaModel(), "SYSTEM hello")
+
+
+def run_turn(model, cache, user, prompt):
+    """Simulate one generation: restore, evaluate the unmatched suffix, save"""
+    cache.restore(model, user, prompt)
+    tokens = model.tokenize(prompt.encode("utf-8"))
+    shared = 0
+    while shared < min(model.n_tokens, len(tokens)) and model.input_ids[shared] == tokens[shared]:
+        shared += 1
+    model.n_tokens = shared
+    model.eval(tokens[shared:])
+    cache.save(model, user)
+
+
+def test_conversation_state_reused_for_follow_up():
+    """A follow-up prompt restores the user's state and only evaluates the suffix"""
+    model = FakeLlamaModel()
+    cache = ConversationStateCache(max_bytes=10 ** 9, ttl_seconds=60)
+
+    run_turn(model, cache, "alice", "SYS|alice: hi")
+    run_turn(model, cache, "bob", "SYS|bob: hello")
+
+    model.evaluated = 0
+    run_turn(model, cache, "alice", "SYS|alice: hi|alice: again")
+
+    assert model.loads == 1
+    assert model.evaluated == len("|alice: again")
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["entries"] == 3
+
+
+def test_conversation_state_miss_when_context_is_better():
+    """No reload happens when the live context already shares more tokens"""
+    model = FakeLlamaModel()
+    cache = ConversationStateCache(max_bytes=10 ** 9, ttl_seconds=60)
+
+    run_turn(model, cache, "alice", "SYS|alice: hi")
+    assert not cache.restore(model, "alice", "SYS|alice: hi there")
+    assert model.loads == 0
+    assert cache.stats()["misses"] == 2
+
+
+def test_conversation_state_memory_budget():
+    """The least recently used states are evicted once the budget is exceeded"""
+    model = FakeLlamaModel()
+    cache = ConversationStateCache(max_bytes=1024 * 40, ttl_seconds=60)
+
+    for user in ["a", "b", "c"]:
+        run_turn(model, cache, user, f"SYS|{user}: message")
+
+    stats = cache.stats()
+    assert stats["bytes"] <= 1024 * 40
+    assert stats["evictions"] >= 1
+
+
+def test_conversation_state_ttl_and_invalidate():
+    model = FakeLlamaModel()
+    cache = ConversationStateCache(max_bytes=10 ** 9, ttl_seconds=0.01)
+
+    run_turn(model, cache, "alice", "SYS|alice: hi")
+    time.sleep(0.02)
+    model.reset()
+    assert not cache.restore(model, "alice", "SYS|alice: hi|more")
+    assert cache.stats()["expirations"] == 1
+
+    cache.ttl_seconds = 60
+    run_turn(model, cache, "alice", "SYS|alice: hi")
+    cache.invalidate("alice")
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["bytes"] == 0
+
+
+class FakeScores:
+    """Logits matrix stand-in: rows x vocab floats"""
+
+    ndim = 2
+
+    def __init__(self, rows, vocab=1000):
+        self.shape = (rows, vocab)
+        self.nbytes = rows * vocab * 4
+
+    def __getitem__(self, item):
+        return FakeScores(len(range(*item.indices(self.shape[0]))), self.shape[1])
+
+    def copy(self):
+        return FakeScores(*self.shape)
+
+
+def test_conversation_state_drops_saved_logits():
+    """Only one logits row is kept per state, and save time and size are reported"""
+    model = FakeLlamaModel()
+    save_state = model.save_state
+
+    def save_with_logits():
+        state = save_state()
+        state.scores = FakeScores(512)
+        return state
+
+    model.save_state = save_with_logits
+    cache = ConversationStateCache(max_bytes=10 ** 9, ttl_seconds=60)
+    run_turn(model, cache, "alice", "SYS|alice: hi")
+
+    state = next(iter(cache._entries.values())).state
+    assert state.scores.shape == (1, 1000)
+    stats = cache.stats()
+    assert stats["saves"] == 1
+    assert stats["last_entry_bytes"] == stats["bytes"]
+    assert stats["bytes"] < FakeScores(512).nbytes
+    assert stats["avg_save_ms"] >= 0
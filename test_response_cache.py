@@ -0,0 +1,98 @@
+"""
+Tests for the first-turn chat response cache
+"""
+import time
+from types import SimpleNamespace
+
+from response_cache import ResponseCache, cosine_similarity, question_vector
+
+SAMPLING = {"max_tokens": 100, "temperature": 0.5, "top_p": 0.9, "top_k": 40, "repeat_penalty": 1.1, "stop": None}
+
+
+def journey(origin, destination, summary="Distance: 346 km\nDuration: 3 hours 45 mins"):
+    return SimpleNamespace(origin=origin, destination=destination, summary=summary)
+
+
+def test_journey_questions_share_an_answer():
+    cache = ResponseCache(ttl_seconds=60, max_entries=10)
+    key = cache.key_for(["how long from NYC to Boston?"], [], [journey("NYC", "Boston")], SAMPLING)
+    cache.put(key, {"id": "chatcmpl-1", "content": "About 4 hours", "usage": {}})
+
+    # Another user, different case and spacing, same route and Directions data
+    other = cache.key_for(["How long  from NYC to Boston?"], [], [journey(" nyc ", "BOSTON")], SAMPLING)
+    assert cache.get(other)["content"] == "About 4 hours"
+    # Punctuation only changes the digest, not the question vector
+    similar = cache.key_for(["how long from NYC to Boston"], [], [journey("NYC", "Boston")], SAMPLING)
+    assert cache.get(similar)["content"] == "About 4 hours"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["similar_hits"] == 1
+
+
+def test_different_questions_about_a_route_do_not_share_an_answer():
+    cache = ResponseCache(ttl_seconds=60, max_entries=10)
+    route = [journey("New York", "Boston")]
+    key = cache.key_for(["I am vegetarian with a dog, plan a trip from New York to Boston"], [], route, SAMPLING)
+    cache.put(key, {"id": "chatcmpl-1", "content": "Vegetarian, dog-friendly stops", "usage": {}})
+
+    for question in ("What trains go from New York to Boston?", "how long from New York to Boston"):
+        assert cache.get(cache.key_for([question], [], route, SAMPLING)) is None
+    assert cache.stats()["misses"] == 2
+
+    # Above 1 only the exact question is reused
+    exact = ResponseCache(ttl_seconds=60, max_entries=10, journey_similarity_threshold=1.1)
+    exact.put(exact.key_for(["NYC to Boston?"], [], [journey("NYC", "Boston")], SAMPLING), {"content": "4h"})
+    assert exact.get(exact.key_for(["nyc to boston?"], [], [journey("NYC", "Boston")], SAMPLING)) == {"content": "4h"}
+    assert exact.get(exact.key_for(["NYC to Boston"], [], [journey("NYC", "Boston")], SAMPLING)) is None
+
+
+def test_key_changes_with_directions_data_and_sampling():
+    cache = ResponseCache(ttl_seconds=60, max_entries=10)
+    base = cache.key_for(["NYC to Boston"], [], [journey("NYC", "Boston")], SAMPLING)
+    traffic = cache.key_for(["NYC to Boston"], [], [journey("NYC", "Boston", "Duration: 5 hours")], SAMPLING)
+    longer = cache.key_for(["NYC to Boston"], [], [journey("NYC", "Boston")], dict(SAMPLING, max_tokens=200))
+    assert len({base.digest, traffic.digest, longer.digest}) == 3
+
+
+def test_follow_up_turns_bypass_the_cache():
+    cache = ResponseCache(ttl_seconds=60, max_entries=10)
+    history = [{"role": "user", "content": "hi"}]
+    assert cache.key_for(["NYC to Boston"], history, [journey("NYC", "Boston")], SAMPLING) is None
+    assert cache.key_for(["NYC to Boston"], [], [journey("NYC", "Boston")], SAMPLING, has_assistant_turns=True) is None
+    assert cache.key_for(["a", "b"], [], [journey("NYC", "Boston")], SAMPLING) is None
+    assert cache.stats()["bypassed"] == 3
+
+
+def test_generic_questions_need_similarity_enabled():
+    cache = ResponseCache(ttl_seconds=60, max_entries=10)
+    assert cache.key_for(["What should I pack for Paris?"], [], [], SAMPLING) is None
+
+    cache = ResponseCache(ttl_seconds=60, max_entries=10, similarity_threshold=0.7)
+    key = cache.key_for(["What should I pack for a trip to Paris?"], [], [], SAMPLING)
+    cache.put(key, {"id": "chatcmpl-2", "content": "Layers", "usage": {}})
+
+    similar = cache.key_for(["what should i pack for a trip to paris"], [], [], SAMPLING)
+    assert cache.get(similar)["content"] == "Layers"
+    unrelated = cache.key_for(["Best time to visit Tokyo?"], [], [], SAMPLING)
+    assert cache.get(unrelated) is None
+    # A failed journey lookup is never answered from generic questions
+    assert cache.key_for(["Paris to Lyon"], [], [journey("Paris", "Lyon", None)], SAMPLING) is None
+
+
+def test_question_vectors():
+    a = question_vector("how long from NYC to Boston")
+    assert abs(cosine_similarity(a, a) - 1.0) < 1e-9
+    assert cosine_similarity(a, question_vector("how long is it from NYC to Boston?")) > 0.7
+    assert cosine_similarity(a, question_vector("hotels in Rome")) < 0.2
+
+
+def test_ttl_and_lru_bound():
+    cache = ResponseCache(ttl_seconds=0.01, max_entries=2)
+    keys = [cache.key_for([f"{o} to Boston"], [], [journey(o, "Boston")], SAMPLING) for o in ("A", "B", "C")]
+    for key in keys:
+        cache.put(key, {"content": key.digest})
+    assert cache.stats()["evictions"] == 1
+    assert cache.get(keys[0]) is None
+
+    time.sleep(0.02)
+    assert cache.get(keys[2]) is None
+    assert cache.stats()["entries"] == 0